@@ -0,0 +1,55 @@
+""" candump_bench.py
+
+Measures how fast a candump log is read, frame by frame with iter_frames,
+in blocks with iter_batches and in blocks parsed by 2, 4, ... worker
+processes, up to the number of CPUs.
+
+Usage: python benchmarks/candump_bench.py [count]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from pyvit.batch import FrameBatch
+from pyvit.file import log
+
+
+def write_log(filename, count):
+    frames = FrameBatch()
+    for i in range(count):
+        frames.append_raw(0x100 + i % 64, bytes([i & 0xFF] * 8), 0,
+                          i / 2000, 'can0')
+    log.CandumpFile(filename).export_frames(frames)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    fd, filename = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+    write_log(filename, count)
+    cdf = log.CandumpFile(filename)
+
+    start = time.perf_counter()
+    frames = sum(1 for _ in cdf.iter_frames())
+    elapsed = time.perf_counter() - start
+    print('iter_frames   %12.0f frames/s' % (frames / elapsed))
+
+    start = time.perf_counter()
+    frames = sum(len(batch) for batch in cdf.iter_batches())
+    elapsed = time.perf_counter() - start
+    print('iter_batches  %12.0f frames/s' % (frames / elapsed))
+
+    workers = 2
+    while workers <= max(2, os.cpu_count()):
+        start = time.perf_counter()
+        frames = sum(len(batch) for batch in
+                     cdf.iter_batches(chunk_size=4 << 20, workers=workers))
+        elapsed = time.perf_counter() - start
+        print('%2d workers    %12.0f frames/s' % (workers, frames / elapsed))
+        workers *= 2
+    os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
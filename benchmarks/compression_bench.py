@@ -0,0 +1,55 @@
+""" compression_bench.py
+
+Measures, for each codec available, how fast a candump log is written and
+read back, and how large it is compared to the plain log. Writing is
+measured with the codec's own stream and with threaded compression.
+
+Usage: python benchmarks/compression_bench.py [count]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from pyvit.batch import FrameBatch
+from pyvit.file import compression, log
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    frames = FrameBatch()
+    for i in range(count):
+        frames.append_raw(0x100 + i % 64, bytes([i & 0xFF] * 8), 0,
+                          i / 2000, 'can0')
+    threads = os.cpu_count() or 1
+    plain_size = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        print('%-6s %8s %12s %12s %8s' % ('codec', 'threads', 'write/s',
+                                          'read/s', 'ratio'))
+        for codec in compression.CODECS:
+            for codec_threads in (None, threads):
+                if codec is None and codec_threads:
+                    continue
+                filename = os.path.join(directory, 'bench.log')
+                cdf = log.CandumpFile(filename, codec)
+
+                start = time.perf_counter()
+                cdf.export_frames(frames, threads=codec_threads)
+                write = count / (time.perf_counter() - start)
+
+                start = time.perf_counter()
+                read = sum(len(batch) for batch in cdf.iter_batches())
+                read /= time.perf_counter() - start
+
+                size = os.path.getsize(filename)
+                if plain_size is None:
+                    plain_size = size
+                print('%-6s %8s %12.0f %12.0f %8.2f'
+                      % (codec or 'plain', codec_threads or '-', write, read,
+                         plain_size / size))
+                os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
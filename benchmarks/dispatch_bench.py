@@ -0,0 +1,148 @@
+""" dispatch_bench.py
+
+Measures how fast the dispatcher backends fan received frames out to their
+receivers, with 1, 10 and 50 receivers. Each frame is stamped with
+time.perf_counter() by the device and every receiver is drained by its own
+thread, so latency is the time from the device handing over a frame to a
+receiver getting it.
+
+The transmit rate is measured by sending frames one at a time and with
+send_batch to a device that discards them.
+
+Usage: python benchmarks/dispatch_bench.py [count]
+"""
+import multiprocessing
+import sys
+import threading
+import time
+
+from pyvit import can
+from pyvit.dispatch import Dispatcher, ThreadDispatcher
+
+
+class SourceDev:
+    """ Device that produces count frames as fast as it is asked to """
+
+    def __init__(self, count):
+        self.count = count
+        self._sent = 0
+
+    def start(self):
+        self._sent = 0
+
+    def stop(self):
+        pass
+
+    def send(self, frame):
+        pass
+
+    def recv(self):
+        if self._sent >= self.count:
+            time.sleep(0.001)
+            return None
+        self._sent += 1
+        return can.Frame.from_raw(0x123, b'\x01\x02\x03\x04\x05\x06\x07\x08',
+                                  0, time.perf_counter())
+
+
+class SinkDev:
+    """ Device that discards what it is sent, and never receives """
+
+    def __init__(self, count):
+        self.count = count
+        self.done = multiprocessing.Event()
+        self._sent = 0
+
+    def start(self):
+        self._sent = 0
+        self.done.clear()
+
+    def stop(self):
+        pass
+
+    def send(self, frame):
+        self._sent += 1
+        if self._sent == self.count:
+            self.done.set()
+
+    def send_batch(self, frames):
+        for frame in frames:
+            self.send(frame)
+
+    def recv(self):
+        time.sleep(0.01)
+        return None
+
+
+def drain(rx_queue, count, latencies):
+    for _ in range(count):
+        frame = rx_queue.get()
+        latencies.append(time.perf_counter() - frame.timestamp)
+
+
+def run(backend, receivers, count):
+    disp = backend(SourceDev(count))
+    rx_queues = [disp.create_queue() for _ in range(receivers)]
+    for rx_queue in rx_queues:
+        disp.add_receiver(rx_queue)
+
+    latencies = [[] for _ in range(receivers)]
+    threads = [threading.Thread(target=drain, args=(q, count, l))
+               for q, l in zip(rx_queues, latencies)]
+    for t in threads:
+        t.start()
+
+    start = time.perf_counter()
+    disp.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    disp.close()
+
+    all_latencies = sorted(l for ls in latencies for l in ls)
+    median = all_latencies[len(all_latencies) // 2]
+    p99 = all_latencies[int(len(all_latencies) * 0.99)]
+    return count / elapsed, median, p99
+
+
+def run_tx(backend, batched, count):
+    dev = SinkDev(count)
+    disp = backend(dev)
+    frames = [can.Frame(0x123, [i & 0xFF] * 8) for i in range(count)]
+    disp.start()
+    start = time.perf_counter()
+    if batched:
+        # bursts of 16 frames, like ISO-TP consecutive frames
+        for i in range(0, count, 16):
+            disp.send_batch(frames[i:i + 16])
+    else:
+        for frame in frames:
+            disp.send(frame)
+    dev.done.wait()
+    elapsed = time.perf_counter() - start
+    disp.close()
+    return count / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    print('%-18s %9s %12s %12s %12s' %
+          ('backend', 'receivers', 'frames/s', 'median us', 'p99 us'))
+    for name, backend in (('Dispatcher', Dispatcher),
+                          ('ThreadDispatcher', ThreadDispatcher)):
+        for receivers in (1, 10, 50):
+            rate, median, p99 = run(backend, receivers, count)
+            print('%-18s %9d %12.0f %12.1f %12.1f' %
+                  (name, receivers, rate, median * 1e6, p99 * 1e6))
+
+    print()
+    print('%-18s %12s %12s' % ('backend', 'send/s', 'send_batch/s'))
+    for name, backend in (('Dispatcher', Dispatcher),
+                          ('ThreadDispatcher', ThreadDispatcher)):
+        print('%-18s %12.0f %12.0f' % (name, run_tx(backend, False, count),
+                                       run_tx(backend, True, count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+""" frame_bench.py
+
+Compares the cost of building CAN frames through the validating constructor
+and through Frame.from_raw, the path used by the device drivers.
+
+Usage: python benchmarks/frame_bench.py [count]
+"""
+import sys
+import timeit
+import tracemalloc
+
+from pyvit import can
+
+
+def validated():
+    return can.Frame(0x123, [1, 2, 3, 4, 5, 6, 7, 8])
+
+
+def raw():
+    return can.Frame.from_raw(0x123, b'\x01\x02\x03\x04\x05\x06\x07\x08',
+                              0, 1.0)
+
+
+def memory_per_frame(factory, count):
+    tracemalloc.start()
+    frames = [factory() for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del frames
+    return size / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    for name, factory in (('Frame()', validated),
+                          ('Frame.from_raw()', raw)):
+        seconds = min(timeit.repeat(factory, number=count, repeat=5))
+        print('%-18s %8.3f us/frame %8.1f bytes/frame' %
+              (name, seconds / count * 1e6,
+               memory_per_frame(factory, count)))
+
+
+if __name__ == '__main__':
+    main()
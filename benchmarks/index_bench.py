@@ -0,0 +1,62 @@
+""" index_bench.py
+
+Measures how long a candump log takes to index and to load the cached
+index, and how fast a time window is read through the index compared to
+reading the log up to it.
+
+Usage: python benchmarks/index_bench.py [count]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from pyvit.batch import FrameBatch
+from pyvit.file import log
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    frames = FrameBatch()
+    for i in range(count):
+        frames.append_raw(0x100 + i % 64, bytes([i & 0xFF] * 8), 0,
+                          i / 2000, 'can0')
+    directory = tempfile.TemporaryDirectory()
+    filename = os.path.join(directory.name, 'bench.log')
+    cdf = log.CandumpFile(filename)
+    cdf.export_frames(frames)
+    # the window is the last tenth of the log
+    start_time = count * 0.9 / 2000
+    end_time = count / 2000
+
+    with directory:
+        start = time.perf_counter()
+        cdf.index()
+        print('build         %10.3f s' % (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        index = cdf.index()
+        print('load cached   %10.3f s' % (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        for i in range(100):
+            index.find(start_time * i / 100)
+        print('find          %10.3f ms' %
+              ((time.perf_counter() - start) * 10))
+
+        start = time.perf_counter()
+        window = cdf.extract(start_time, end_time, index)
+        print('extract       %10.3f s  %d frames' %
+              (time.perf_counter() - start, len(window)))
+
+        start = time.perf_counter()
+        scanned = 0
+        for batch in cdf.iter_batches():
+            scanned += sum(1 for t in batch.timestamps
+                           if start_time <= t <= end_time)
+        print('full scan     %10.3f s  %d frames' %
+              (time.perf_counter() - start, scanned))
+
+
+if __name__ == '__main__':
+    main()
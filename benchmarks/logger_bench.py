@@ -0,0 +1,54 @@
+""" logger_bench.py
+
+Measures how fast Logger takes frames, one at a time with log_frame and
+as a FrameBatch with log_batch, and the CPU time spent per frame.
+
+Usage: python benchmarks/logger_bench.py [count]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from pyvit import can
+from pyvit.batch import FrameBatch
+from pyvit.log import Logger
+
+
+def run(name, filename, count, log):
+    start = time.perf_counter()
+    cpu = time.process_time()
+    with Logger(filename) as logger:
+        log(logger)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    print('%-10s %12.0f frames/s %8.2f us CPU/frame'
+          % (name, count / elapsed, cpu / count * 1e6))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    frames = [can.Frame(0x100 + i % 64, data=[i & 0xFF] * (i % 9),
+                        timestamp=i / 2000, interface='can0')
+              for i in range(count)]
+    batch = FrameBatch.from_frames(frames)
+    fd, filename = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+
+    def log_frames(logger):
+        for frame in frames:
+            logger.log_frame(frame)
+
+    def log_batches(logger):
+        for i in range(0, count, 1000):
+            logger.log_batch(batch[i:i + 1000])
+
+    try:
+        run('log_frame', filename, count, log_frames)
+        run('log_batch', filename, count, log_batches)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
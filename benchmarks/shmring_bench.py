@@ -0,0 +1,77 @@
+""" shmring_bench.py
+
+Compares moving frames from one process to another through a
+multiprocessing.Queue, which pickles every frame, and through a shared
+memory ring. The ring writer does not wait for the reader, frames it
+overwrites before they are read are counted as lost.
+
+Usage: python benchmarks/shmring_bench.py [count]
+"""
+import multiprocessing
+import sys
+import time
+
+from pyvit import can
+from pyvit.utils.shmring import RingWriter, RingReader
+
+
+def produce_queue(rx_queue, count):
+    frame = can.Frame(0x123, [1, 2, 3, 4, 5, 6, 7, 8])
+    for _ in range(count):
+        rx_queue.put(frame)
+
+
+def produce_ring(name, count, created, done):
+    writer = RingWriter(capacity=1 << 16, name=name)
+    created.set()
+    for _ in range(count):
+        writer.put_raw(0x123, b'\x01\x02\x03\x04\x05\x06\x07\x08')
+    # unlinking leaves the reader's mapping alone, but keep the ring until
+    # it is done all the same
+    done.wait()
+    writer.close()
+
+
+def run_queue(count):
+    rx_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=produce_queue,
+                                      args=(rx_queue, count))
+    start = time.perf_counter()
+    process.start()
+    for _ in range(count):
+        rx_queue.get()
+    elapsed = time.perf_counter() - start
+    process.join()
+    return count / elapsed
+
+
+def run_ring(count):
+    name = 'pyvit_bench_%d' % time.monotonic_ns()
+    created = multiprocessing.Event()
+    done = multiprocessing.Event()
+    process = multiprocessing.Process(target=produce_ring,
+                                      args=(name, count, created, done))
+    process.start()
+    created.wait()
+    reader = RingReader(name, oldest=True)
+    start = time.perf_counter()
+    received = 0
+    while received + reader.lost < count:
+        received += len(reader.recv_batch(max_frames=256, timeout=1))
+    elapsed = time.perf_counter() - start
+    lost = reader.lost
+    reader.close()
+    done.set()
+    process.join()
+    return received / elapsed, lost
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print('multiprocessing.Queue %12.0f frames/s' % run_queue(count))
+    rate, lost = run_ring(count)
+    print('shared memory ring    %12.0f frames/s, %d lost' % (rate, lost))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+""" trace_bench.py
+
+Writes the same frames to a candump log and to a binary trace, then times
+finding a 5 second window in each: the candump log has to be parsed from
+the start, the trace only decodes the chunks in the window.
+
+Usage: python benchmarks/trace_bench.py [count]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from pyvit.batch import FrameBatch
+from pyvit.file import log
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    # 2000 frames a second
+    frames = FrameBatch()
+    for i in range(count):
+        frames.append_raw(0x100 + i % 64, bytes([i & 0xFF] * 8), 0,
+                          i / 2000, 'can0')
+    middle = count / 4000
+
+    directory = tempfile.mkdtemp()
+    candump_name = os.path.join(directory, 'bench.log')
+    trace_name = os.path.join(directory, 'bench.trace')
+    log.CandumpFile(candump_name).export_frames(frames)
+    with log.TraceWriter(trace_name) as writer:
+        writer.write_batch(frames)
+
+    start = time.perf_counter()
+    candump = log.CandumpFile(candump_name)
+    window = FrameBatch()
+    with open(candump_name) as f:
+        for line in f:
+            timestamp = float(line[1:line.index(')')])
+            if middle <= timestamp <= middle + 5:
+                window.append_raw(*candump._str_to_fields(line))
+    candump_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with log.TraceReader(trace_name) as reader:
+        trace_window = reader.read(middle, middle + 5)
+    trace_time = time.perf_counter() - start
+
+    print('%-8s %12s %10s %12s' % ('format', 'size MB', 'frames', 'window s'))
+    print('%-8s %12.1f %10d %12.4f' % ('candump',
+                                       os.path.getsize(candump_name) / 1e6,
+                                       len(window), candump_time))
+    print('%-8s %12.1f %10d %12.4f' % ('trace',
+                                       os.path.getsize(trace_name) / 1e6,
+                                       len(trace_window), trace_time))
+    os.remove(candump_name)
+    os.remove(trace_name)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
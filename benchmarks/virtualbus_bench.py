@@ -0,0 +1,61 @@
+""" virtualbus_bench.py
+
+Measures how many frames a VirtualBus moves between two nodes without a
+bitrate, sent one at a time and in batches of 64, and how close a timed bus
+at 1 Mbit/s comes to the frame rate its bitrate allows.
+
+Usage: python benchmarks/virtualbus_bench.py [count]
+"""
+import sys
+import time
+
+from pyvit import can
+from pyvit.hw.loopback import VirtualBus
+
+
+def run_fast(count, batched):
+    bus = VirtualBus()
+    tx, rx = bus.attach(), bus.attach()
+    tx.start()
+    rx.start()
+    frames = [can.Frame(0x123, [i & 0xFF] * 8) for i in range(count)]
+
+    start = time.perf_counter()
+    if batched:
+        for i in range(0, count, 64):
+            tx.send_batch(frames[i:i + 64])
+    else:
+        for frame in frames:
+            tx.send(frame)
+    for _ in range(count):
+        rx.recv()
+    return count / (time.perf_counter() - start)
+
+
+def run_timed(count):
+    bus = VirtualBus(bitrate=1000000)
+    tx, rx = bus.attach(), bus.attach()
+    tx.start()
+    rx.start()
+    frame = can.Frame(0x123, [0x55] * 8)
+
+    start = time.perf_counter()
+    tx.send_batch([frame] * count)
+    for _ in range(count):
+        rx.recv()
+    elapsed = time.perf_counter() - start
+    bus.close()
+    return count / elapsed, 1 / bus.duration(frame)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print('fast, send        %12.0f frames/s' % run_fast(count, False))
+    print('fast, send_batch  %12.0f frames/s' % run_fast(count, True))
+    rate, expected = run_timed(min(count, 20000))
+    print('1 Mbit/s          %12.0f frames/s, %.0f expected' %
+          (rate, expected))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+""" batch.py
+
+Columnar storage for large numbers of CAN frames.
+
+"""
+from array import array
+from itertools import compress
+
+from . import can
+
+# payload width that holds any CAN FD frame
+FD_WIDTH = 64
+
+
+class FrameBatch(object):
+    """ Stores many CAN frames in contiguous columns
+
+    Frames are only built when a batch is iterated or indexed, so a batch of
+    ten million frames costs a handful of arrays instead of ten million
+    objects.
+
+    Attributes:
+        timestamps (array of float): time of each frame, NaN when unset
+        arb_ids (array of int): arbitration identifier of each frame
+        flags (array of int): can.FrameFlags bits of each frame
+        dlcs (array of int): number of data bytes in each frame
+        interfaces (array of int): index into interface_names of each frame
+        interface_names (list of str): interface names used in this batch
+        payloads (bytearray): data of each frame, padded to width bytes
+        width (int): number of payload bytes stored per frame, 8 for
+                     classic CAN or FD_WIDTH once a CAN FD frame is added
+    """
+
+    def __init__(self, width=8):
+        self.width = width
+        self.timestamps = array('d')
+        self.arb_ids = array('I')
+        self.flags = array('B')
+        self.dlcs = array('B')
+        self.interfaces = array('H')
+        self.interface_names = [None]
+        self.payloads = bytearray()
+        self._interface_index = {None: 0}
+        self._padding = bytes(width)
+
+    @classmethod
+    def from_frames(cls, frames, width=8):
+        batch = cls(width)
+        batch.extend(frames)
+        return batch
+
+    @classmethod
+    def concat(cls, batches, width=None):
+        """ Join several batches into a new batch, in order """
+        batches = list(batches)
+        if width is None:
+            width = max([b.width for b in batches] or [8])
+        result = cls(width)
+        for batch in batches:
+            result._extend_batch(batch)
+        return result
+
+    def _get_interface(self, interface):
+        index = self._interface_index.get(interface)
+        if index is None:
+            index = len(self.interface_names)
+            self.interface_names.append(interface)
+            self._interface_index[interface] = index
+        return index
+
+    def append_raw(self, arb_id, payload, flags=0, timestamp=None,
+                   interface=None):
+        """ Add a frame from trusted values, see can.Frame.from_raw """
+        dlc = len(payload)
+        if dlc > self.width:
+            self.widen(dlc)
+        self.timestamps.append(timestamp if timestamp is not None
+                               else float('nan'))
+        self.arb_ids.append(arb_id)
+        self.flags.append(flags)
+        self.dlcs.append(dlc)
+        self.interfaces.append(self._get_interface(interface))
+        self.payloads += payload
+        self.payloads += self._padding[dlc:]
+
+    def widen(self, width):
+        """ Make room for payloads of up to width bytes. Batches widen
+        themselves to the CAN FD width when a longer frame is added. """
+        if width > FD_WIDTH:
+            raise ValueError('payload of %d bytes does not fit in a batch'
+                             % width)
+        if width <= self.width:
+            return
+        width = FD_WIDTH
+        pad = bytes(width - self.width)
+        view = memoryview(self.payloads)
+        self.payloads = bytearray().join(
+            bytes(view[i * self.width:(i + 1) * self.width]) + pad
+            for i in range(len(self)))
+        self.width = width
+        self._padding = bytes(width)
+
+    def append(self, frame):
+        self.append_raw(frame.arb_id, frame.payload, frame.flags,
+                        frame.timestamp, frame.interface)
+
+    def extend(self, frames):
+        if isinstance(frames, FrameBatch):
+            self._extend_batch(frames)
+        else:
+            for frame in frames:
+                self.append(frame)
+
+    def _extend_batch(self, other):
+        self.widen(other.width)
+        self.timestamps.extend(other.timestamps)
+        self.arb_ids.extend(other.arb_ids)
+        self.flags.extend(other.flags)
+        self.dlcs.extend(other.dlcs)
+        # interface indices are local to each batch and must be translated
+        remap = [self._get_interface(name) for name in other.interface_names]
+        self.interfaces.extend(remap[i] for i in other.interfaces)
+        if other.width == self.width:
+            self.payloads += other.payloads
+        else:
+            pad = self._padding[other.width:]
+            for i in range(len(other)):
+                self.payloads += other.payloads[i * other.width:
+                                                (i + 1) * other.width]
+                self.payloads += pad
+
+    def payload(self, index):
+        """ Return the data bytes of one frame """
+        start = index * self.width
+        return bytes(self.payloads[start:start + self.dlcs[index]])
+
+    def frame(self, index):
+        """ Build a can.Frame for one entry of the batch """
+        if index < 0:
+            index += len(self)
+        timestamp = self.timestamps[index]
+        return can.Frame.from_raw(
+            self.arb_ids[index], self.payload(index), self.flags[index],
+            None if timestamp != timestamp else timestamp,
+            self.interface_names[self.interfaces[index]])
+
+    def select(self, selectors):
+        """ Return a new batch of the frames whose selector is true """
+        selectors = list(selectors)
+        result = FrameBatch(self.width)
+        result.timestamps = array('d', compress(self.timestamps, selectors))
+        result.arb_ids = array('I', compress(self.arb_ids, selectors))
+        result.flags = array('B', compress(self.flags, selectors))
+        result.dlcs = array('B', compress(self.dlcs, selectors))
+        result.interfaces = array('H', compress(self.interfaces, selectors))
+        result.interface_names = list(self.interface_names)
+        result._interface_index = dict(self._interface_index)
+        view = memoryview(self.payloads)
+        width = self.width
+        result.payloads = bytearray().join(
+            view[i * width:(i + 1) * width]
+            for i in compress(range(len(self)), selectors))
+        return result
+
+    def filter_ids(self, arb_ids):
+        """ Return a new batch of the frames with an id in arb_ids """
+        arb_ids = frozenset(arb_ids)
+        return self.select([i in arb_ids for i in self.arb_ids])
+
+    def filter_mask(self, arb_id, mask):
+        """ Return a new batch of the frames where id & mask matches """
+        match = arb_id & mask
+        return self.select([(i & mask) == match for i in self.arb_ids])
+
+    def __len__(self):
+        return len(self.arb_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            result = FrameBatch(self.width)
+            result.timestamps = self.timestamps[index]
+            result.arb_ids = self.arb_ids[index]
+            result.flags = self.flags[index]
+            result.dlcs = self.dlcs[index]
+            result.interfaces = self.interfaces[index]
+            result.interface_names = list(self.interface_names)
+            result._interface_index = dict(self._interface_index)
+            width = self.width
+            if step == 1:
+                result.payloads = self.payloads[start * width:stop * width]
+            else:
+                # frames in slice order, which may run backwards
+                view = memoryview(self.payloads)
+                result.payloads = bytearray().join(
+                    view[i * width:(i + 1) * width]
+                    for i in range(start, stop, step))
+            return result
+        if index >= len(self) or index < -len(self):
+            raise IndexError('batch index out of range')
+        return self.frame(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def __add__(self, other):
+        return FrameBatch.concat((self, other))
+
+    def to_frames(self):
+        return list(self)
@@ -1,29 +1,95 @@
+from array import array
+from collections import namedtuple
+
 from . import can
 
 
+DecodedMessage = namedtuple('DecodedMessage',
+                            ['name', 'arb_id', 'timestamp', 'signals'])
+DecodedMessage.__doc__ = """ Signal values decoded from one frame
+
+signals is a tuple of SignalValue, ordered by start bit.
+"""
+
+SignalValue = namedtuple('SignalValue', ['name', 'value'])
+
+
 class Bus:
-    # message that belong to this bus
-    _messages = []
+    def __init__(self, messages=None):
+        # messages that belong to this bus
+        self._messages = []
+        # the same messages, indexed by (arb_id, is_extended_id)
+        self._index = {}
+        if messages:
+            self.add_messages(messages)
 
     def add_message(self, message):
         assert isinstance(message, Message), 'invalid message'
-        if message in self._messages:
+        key = (message.arb_id, message.is_extended_id)
+        if key in self._index:
             raise ValueError('Message %s already in bus' % message)
         else:
             self._messages.append(message)
+            self._index[key] = message
+
+    def add_messages(self, messages):
+        for message in messages:
+            self.add_message(message)
 
     def remove_message(self, message):
-        assert isinstance(Message, message), 'invalid message'
+        assert isinstance(message, Message), 'invalid message'
         try:
             self._messages.remove(message)
         except ValueError:
             raise ValueError('Message %s is not in bus' % message)
+        del self._index[(message.arb_id, message.is_extended_id)]
+
+    def get_message(self, arb_id, extended=False):
+        return self._index.get((arb_id, extended))
 
     def parse_frame(self, frame):
         assert isinstance(frame, can.Frame), 'invalid frame'
-        for message in self._messages:
-            if message.arb_id == frame.arb_id:
-                return message.parse_frame(frame)
+        message = self._index.get((frame.arb_id, frame.is_extended_id))
+        if message is not None:
+            return message.parse_frame(frame)
+
+    def decode_frame(self, frame):
+        """ Decode a frame without modifying the bus's Signal objects
+
+        Returns a DecodedMessage, or None if the frame does not belong to a
+        message of this bus. Safe to call from several threads at once.
+        """
+        message = self._index.get((frame.arb_id, frame.is_extended_id))
+        if message is None:
+            return None
+        decoder = message.decoder
+        return DecodedMessage(message.name, frame.arb_id, frame.timestamp,
+                              tuple(map(SignalValue, decoder.names,
+                                        decoder.decode(frame.payload))))
+
+    def parse_batch(self, batch):
+        # returns one entry per frame: a dict of signal values by name, or
+        # None if the frame does not belong to a message of this bus
+        results = []
+        for frame in batch:
+            message = self._index.get((frame.arb_id, frame.is_extended_id))
+            if message is None:
+                results.append(None)
+            else:
+                decoder = message.decoder
+                results.append(dict(zip(decoder.names,
+                                        decoder.decode(frame.payload))))
+        return results
+
+    def decode_batch(self, batch, arb_id, extended=False):
+        """ Decode all frames of a FrameBatch with the given id
+
+        Returns a dict of array columns, one per signal name plus
+        'timestamp', or None if no message of this bus has that id.
+        """
+        message = self._index.get((arb_id, extended))
+        if message is not None:
+            return message.decoder.decode_batch(batch)
 
     def __str__(self):
         s = "Bus:\n"
@@ -33,21 +99,31 @@ class Bus:
 
 
 class Message(object):
-    def __init__(self, name, arb_id):
+    def __init__(self, name, arb_id, extended=False):
         self.name = name
         self.arb_id = arb_id
+        self.is_extended_id = extended
         # signals that belong to this message, indexed by start bit
         self._signals = {}
+        self._decoder = None
 
     def add_signal(self, signal, start_bit):
         assert isinstance(signal, Signal), 'invalid signal'
         assert(isinstance(start_bit, int) and
                (start_bit < 63, 'invalid start bit'))
         self._signals[start_bit] = signal
+        self._decoder = None
 
     def remove_signal(self, signal):
         pass
 
+    @property
+    def decoder(self):
+        # compiled on first use, and again after the signals change
+        if self._decoder is None:
+            self._decoder = MessageDecoder(self)
+        return self._decoder
+
     def parse_frame(self, frame):
         assert isinstance(frame, can.Frame), 'invalid frame'
         assert frame.arb_id == self.arb_id, 'frame id does not match msg id'
@@ -67,9 +143,7 @@ class Message(object):
             end_bit = signal.bit_length + start_bit
 
             # compute the mask
-            mask = 0
-            for j in range(start_bit, end_bit):
-                mask = mask + 2**j
+            mask = (1 << end_bit) - (1 << start_bit)
 
             # apply the mask, then downshift
             value = (frame_value & mask) >> start_bit
@@ -92,6 +166,63 @@ class Message(object):
         return s
 
 
+class MessageDecoder(object):
+    """ Compiled decoder for the signals of a Message
+
+    The shift, mask, factor and offset of every signal are computed once.
+    Decoding returns new values and never modifies the Signal objects, so a
+    decoder can be shared between threads. Signal definitions are copied
+    when the decoder is built.
+
+    Attributes:
+        arb_id (int): arbitration id of the message
+        names (tuple of str): signal names, ordered by start bit
+    """
+
+    def __init__(self, message):
+        self.arb_id = message.arb_id
+        self.is_extended_id = message.is_extended_id
+        signals = sorted(message._signals.items(), key=lambda i: i[0])
+        self.names = tuple(signal.name for _, signal in signals)
+        self._codecs = tuple((start_bit, (1 << signal.bit_length) - 1,
+                              signal.factor, signal.offset)
+                             for start_bit, signal in signals)
+
+    def decode(self, payload):
+        """ Decode a payload into a tuple of values, ordered as names """
+        value = int.from_bytes(payload, 'little')
+        return tuple(((value >> shift) & mask) * factor + offset
+                     for shift, mask, factor, offset in self._codecs)
+
+    def decode_batch(self, batch):
+        """ Decode the frames of a FrameBatch that carry this message
+
+        Returns a dict with one array('d') column per signal name, plus a
+        'timestamp' column.
+        """
+        view = memoryview(batch.payloads)
+        width = batch.width
+        from_bytes = int.from_bytes
+        arb_id = self.arb_id
+        extended = can.FrameFlags.Extended if self.is_extended_id else 0
+
+        rows = [i for i, (frame_id, flags)
+                in enumerate(zip(batch.arb_ids, batch.flags))
+                if frame_id == arb_id and
+                (flags & can.FrameFlags.Extended) == extended]
+        # combine the data bytes of each frame into a single value, once
+        values = [from_bytes(view[i * width:(i + 1) * width], 'little')
+                  for i in rows]
+
+        columns = {'timestamp': array('d', (batch.timestamps[i]
+                                            for i in rows))}
+        for name, (shift, mask, factor, offset) in zip(self.names,
+                                                       self._codecs):
+            columns[name] = array('d', (((v >> shift) & mask) * factor +
+                                        offset for v in values))
+        return columns
+
+
 class Signal:
     def __init__(self, name, bit_length, factor=1, offset=0):
         self.name = name
@@ -13,17 +13,49 @@ class FrameType:
     OverloadFrame = 4
 
 
+class FrameFlags:
+    """ Enumerates the flag bits understood by Frame.from_raw """
+    Extended = 0x1
+    Remote = 0x2
+    Error = 0x4
+    FD = 0x8
+    BitRateSwitch = 0x10
+    ErrorStateIndicator = 0x20
+
+
+# data lengths a CAN FD frame can have
+FD_LENGTHS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+
+
+def fd_length(length):
+    """ Return the smallest valid CAN FD data length that holds length
+    bytes """
+    for fd_len in FD_LENGTHS:
+        if fd_len >= length:
+            return fd_len
+    raise ValueError('CAN FD data cannot contain more than 64 bytes')
+
+
 class Frame(object):
     """ Represents a CAN Frame
 
     Attributes:
         arb_id (int): Arbitration identifier of the Frame
         data (list of int): CAN data bytes
+        payload (bytes): CAN data bytes as an immutable bytes object
         frame_type (int): type of CAN frame
+        is_fd (bool): frame is a CAN FD frame, with up to 64 data bytes
+        bitrate_switch (bool): CAN FD data phase uses the fast bitrate
+        error_state_indicator (bool): CAN FD sender is error passive
     """
 
+    __slots__ = ('_arb_id', '_data', '_payload', '_frame_type',
+                 'interface', 'timestamp', 'is_extended_id', 'is_fd',
+                 'bitrate_switch', 'error_state_indicator')
+
     def __init__(self, arb_id, data=None, frame_type=FrameType.DataFrame,
-                 interface=None, timestamp=None, extended=False):
+                 interface=None, timestamp=None, extended=False, fd=False,
+                 bitrate_switch=False, error_state_indicator=False):
         """ Initializer of Frame
         Args:
             arb_id (int): identifier of CAN frame
@@ -34,18 +66,59 @@ class Frame(object):
                                           defaults to None
             ts (float, optional): time frame was received at
                                   defaults to None
+            fd (bool, optional): CAN FD frame, defaults to False
+            bitrate_switch (bool, optional): CAN FD BRS flag
+            error_state_indicator (bool, optional): CAN FD ESI flag
         """
 
         self.frame_type = frame_type
         self.interface = interface
         self.timestamp = timestamp
         self.is_extended_id = extended
+        self.is_fd = fd
+        self.bitrate_switch = bitrate_switch
+        self.error_state_indicator = error_state_indicator
         self.arb_id = arb_id
         if data:
             self.data = data
         else:
             self.data = []
 
+    @classmethod
+    def from_raw(cls, arb_id, payload=b'', flags=0, timestamp=None,
+                 interface=None):
+        """ Build a Frame from trusted values, skipping validation
+
+        This is the constructor used by device drivers and file readers,
+        where the identifier and payload come straight from hardware or a
+        parser and are already known to be in range.
+
+        Args:
+            arb_id (int): identifier of CAN frame, without flag bits
+            payload (bytes): data of CAN frame, bytes or memoryview
+            flags (int, optional): combination of FrameFlags bits
+            timestamp (float, optional): time frame was received at
+            interface (string, optional): name of the interface the frame is on
+        """
+        frame = cls.__new__(cls)
+        frame._arb_id = arb_id
+        frame._payload = payload
+        frame._data = None
+        if flags & FrameFlags.Remote:
+            frame._frame_type = FrameType.RemoteFrame
+        elif flags & FrameFlags.Error:
+            frame._frame_type = FrameType.ErrorFrame
+        else:
+            frame._frame_type = FrameType.DataFrame
+        frame.is_extended_id = bool(flags & FrameFlags.Extended)
+        frame.is_fd = bool(flags & FrameFlags.FD)
+        frame.bitrate_switch = bool(flags & FrameFlags.BitRateSwitch)
+        frame.error_state_indicator = bool(flags &
+                                           FrameFlags.ErrorStateIndicator)
+        frame.timestamp = timestamp
+        frame.interface = interface
+        return frame
+
     @property
     def arb_id(self):
         return self._arb_id
@@ -65,20 +138,38 @@ class Frame(object):
 
     @property
     def data(self):
+        # the list is built on first access, frames created by from_raw only
+        # pay for it when a caller actually wants a list
+        if self._data is None:
+            self._data = list(self._payload)
         return self._data
 
     @data.setter
     def data(self, value):
         # data should be a list
         assert isinstance(value, list), 'CAN data must be a list'
-        # data can only be 8 bytes maximum
-        assert not len(value) > 8, 'CAN data cannot contain more than 8 bytes'
+        if self.is_fd:
+            # CAN FD data can only have one of the lengths in FD_LENGTHS
+            assert len(value) in FD_LENGTHS, 'invalid CAN FD data length'
+        else:
+            # data can only be 8 bytes maximum
+            assert not len(value) > 8, \
+                'CAN data cannot contain more than 8 bytes'
         # each byte must be a valid byte, int between 0x0 and 0xFF
         for byte in value:
             assert isinstance(byte, int), 'CAN data must consist of bytes'
             assert byte >= 0 and byte <= 0xFF, 'CAN data must consist of bytes'
         # data is valid
         self._data = value
+        self._payload = None
+
+    @property
+    def payload(self):
+        # once the list view exists it may have been modified in place, so it
+        # is the authoritative copy of the data
+        if self._data is not None:
+            return bytes(self._data)
+        return self._payload
 
     @property
     def frame_type(self):
@@ -91,17 +182,52 @@ class Frame(object):
             value == FrameType.OverloadFrame, 'invalid frame type'
         self._frame_type = value
 
+    @property
+    def flags(self):
+        flags = 0
+        if self.is_extended_id:
+            flags |= FrameFlags.Extended
+        if self._frame_type == FrameType.RemoteFrame:
+            flags |= FrameFlags.Remote
+        elif self._frame_type == FrameType.ErrorFrame:
+            flags |= FrameFlags.Error
+        if self.is_fd:
+            flags |= FrameFlags.FD
+            if self.bitrate_switch:
+                flags |= FrameFlags.BitRateSwitch
+            if self.error_state_indicator:
+                flags |= FrameFlags.ErrorStateIndicator
+        return flags
+
     @property
     def dlc(self):
-        return len(self.data)
+        if self._data is not None:
+            return len(self._data)
+        return len(self._payload)
+
+    def __getstate__(self):
+        # memoryview payloads cannot be pickled, send a bytes copy instead
+        return (None, {'_arb_id': self._arb_id,
+                       '_data': None,
+                       '_payload': bytes(self.payload),
+                       '_frame_type': self._frame_type,
+                       'interface': self.interface,
+                       'timestamp': self.timestamp,
+                       'is_extended_id': self.is_extended_id,
+                       'is_fd': self.is_fd,
+                       'bitrate_switch': self.bitrate_switch,
+                       'error_state_indicator': self.error_state_indicator})
 
     def __str__(self):
         return ('ID=0x%X, DLC=%d, Data=[%s]' %
                 (self.arb_id, self.dlc, ', '.join(('%02X' % b)
-                                                  for b in self.data)))
+                                                  for b in self.payload)))
 
     def __eq__(self, other):
         return (self.arb_id == other.arb_id and
-                self.data == other.data and
+                self.payload == other.payload and
                 self.frame_type == other.frame_type and
-                self.is_extended_id == other.is_extended_id)
+                self.is_extended_id == other.is_extended_id and
+                self.is_fd == other.is_fd and
+                self.bitrate_switch == other.bitrate_switch and
+                self.error_state_indicator == other.error_state_indicator)
@@ -1,5 +1,17 @@
+import asyncio
 import multiprocessing
-from multiprocessing import Queue, Process
+import os
+import select
+import selectors
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import Queue, Process, RawArray, RawValue
+from queue import Empty
+
+from . import can
+from .utils.ringbuffer import AsyncRingBuffer, RingBuffer
+from .utils.shmring import RingWriter
 
 """The class uses two processes (_send_process e _recv_process) in order to transmit and receive
 The first one transmits evrything from queue _tx_queue
@@ -7,77 +19,509 @@ The second one puts evrything received in all the queues present in the list _rx
 So in order to transmit a frame we have to add it to the queue _tx_queue with method send
 In order to receive we have to read from our queue added trought method add_receiver
 
-singleprocess if True indicates to use only one process for receiving and transmitting. These is implemented in function _communication_loop
+The send process takes every frame already waiting in _tx_queue at once and hands them to the device together, with
+its send_batch method if it has one. send_batch of the dispatcher queues several frames with a single put.
+
+singleprocess if True indicates to use only one process for receiving and transmitting. These is implemented in function _communication_loop,
+which runs the send loop on a thread of that process so transmission never waits for a frame to be received
+
+A receiver can ask for only some frames, by arbitration id, by (id, mask) pairs or with a predicate. Frames are
+routed in the receiving process, so the others never go through the receiver's queue.
+
+A receiver can be bounded with maxsize, overflow then selects what happens to a frame that does not fit. Each
+receiver counts the frames it was given and dropped, a bounded one also the deepest its queue has been, see stats.
+
+A utils.shmring.RingWriter can be a receiver as well, frames are then written to shared memory by the receiving
+process, and read by RingReaders in any process, instead of being pickled through a queue.
+
+The processes are started once and kept: stop asks them to finish what is queued (or to drop it, with drain=False) and
+then to wait, start wakes them up again. stop waits at most timeout seconds, a process stuck in the device is
+terminated and replaced on the next start. close ends the processes.
 
 REMEMBER: start the dispatcher with method start
 """
 
 
+class Overflow:
+    """ Enumerates what happens when a frame arrives for a full receiver """
+    # discard the new frame
+    DropNewest = 'drop-newest'
+    # discard the oldest frame in the queue to make room
+    DropOldest = 'drop-oldest'
+    # wait for the consumer, this holds up every receiver and, once the
+    # device buffers fill up, the bus
+    Block = 'block'
+
+
+ReceiverStats = namedtuple('ReceiverStats', ['enqueued', 'dropped',
+                                             'high_watermark', 'depth',
+                                             'maxsize'])
+ReceiverStats.__doc__ = """ Counters of one receiver, see Dispatcher.stats """
+
+
+def _depth(rx_queue):
+    # frames in rx_queue, None where the platform cannot tell, as
+    # multiprocessing queues on macOS
+    try:
+        return rx_queue.qsize()
+    except NotImplementedError:
+        return None
+
+
+class _Receiver:
+    """ Puts frames into one receive queue, applying its bound and counting
+    what happens
+
+    The counters are in shared memory, so they can be read from the process
+    that added the receiver while another process delivers to it.
+    """
+
+    ENQUEUED = 0
+    DROPPED = 1
+    HIGH_WATERMARK = 2
+
+    # seconds between checks of a full queue with the Block policy
+    BLOCK_POLL = 0.0005
+
+    def __init__(self, rx_queue, maxsize=0, overflow=Overflow.DropNewest):
+        if overflow not in (Overflow.DropNewest, Overflow.DropOldest,
+                            Overflow.Block):
+            raise ValueError('invalid overflow policy %s' % overflow)
+        if maxsize and _depth(rx_queue) is None:
+            raise ValueError('a bounded receiver needs a queue with qsize, '
+                             'which is not available on this platform')
+        self.rx_queue = rx_queue
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.counters = RawArray('Q', 3)
+
+    def put(self, frame):
+        rx_queue = self.rx_queue
+        counters = self.counters
+        if not self.maxsize:
+            # the depth of an unbounded queue is not needed, it is left
+            # alone on the hot path
+            rx_queue.put_nowait(frame)
+            counters[self.ENQUEUED] += 1
+            return
+
+        depth = rx_queue.qsize()
+        if depth >= self.maxsize:
+            if self.overflow == Overflow.DropNewest:
+                counters[self.DROPPED] += 1
+                return
+            elif self.overflow == Overflow.DropOldest:
+                try:
+                    rx_queue.get_nowait()
+                    counters[self.DROPPED] += 1
+                    depth -= 1
+                except Empty:
+                    # the consumer got there first, or the oldest frames
+                    # are still on their way into a multiprocessing queue,
+                    # which counts them as soon as they are put. The queue
+                    # then holds one more until they arrive.
+                    pass
+            else:
+                while rx_queue.qsize() >= self.maxsize:
+                    time.sleep(self.BLOCK_POLL)
+                depth = rx_queue.qsize()
+
+        rx_queue.put_nowait(frame)
+        counters[self.ENQUEUED] += 1
+        if depth + 1 > counters[self.HIGH_WATERMARK]:
+            counters[self.HIGH_WATERMARK] = depth + 1
+
+    def stats(self):
+        return ReceiverStats(self.counters[self.ENQUEUED],
+                             self.counters[self.DROPPED],
+                             self.counters[self.HIGH_WATERMARK],
+                             _depth(self.rx_queue), self.maxsize)
+
+    def reset_stats(self):
+        for i in range(len(self.counters)):
+            self.counters[i] = 0
+
+
+class Router:
+    """ Maps arbitration ids to the receivers that subscribed to them
+
+    A receiver matches a frame when its id is in arb_ids or matches one of
+    the (id, mask) pairs, or when neither is given. The predicate, if any, is
+    then called with the frame. The receivers for each id are worked out once
+    and cached, the cache is rebuilt whenever a subscription changes.
+    """
+
+    # ids seen before the cache is thrown away, extended ids are unbounded
+    MAX_CACHED_IDS = 4096
+
+    def __init__(self):
+        self._subscriptions = []
+        self._cache = {}
+
+    def subscribe(self, index, receiver, arb_ids=None, masks=None,
+                  predicate=None):
+        """ Set the subscription of the receiver at index, appending it if
+        index is the number of receivers """
+        if arb_ids is not None:
+            arb_ids = frozenset(arb_ids)
+        if masks is not None:
+            masks = tuple((arb_id & mask, mask) for arb_id, mask in masks)
+        subscription = (receiver, arb_ids, masks, predicate)
+        if index == len(self._subscriptions):
+            self._subscriptions.append(subscription)
+        else:
+            self._subscriptions[index] = subscription
+        self._cache = {}
+
+    def unsubscribe(self, index):
+        del self._subscriptions[index]
+        self._cache = {}
+
+    def lookup(self, arb_id):
+        """ Return (receiver, predicate) of each receiver of this id """
+        # take the cache first, a subscription changed by another thread
+        # while this runs replaces it and drops what is stored here
+        cache = self._cache
+        try:
+            return cache[arb_id]
+        except KeyError:
+            pass
+
+        receivers = tuple((receiver, predicate)
+                          for receiver, arb_ids, masks, predicate
+                          in self._subscriptions
+                          if self._matches(arb_id, arb_ids, masks))
+        if len(cache) >= self.MAX_CACHED_IDS:
+            cache.clear()
+        cache[arb_id] = receivers
+        return receivers
+
+    @staticmethod
+    def _matches(arb_id, arb_ids, masks):
+        if arb_ids is None and masks is None:
+            return True
+        if arb_ids is not None and arb_id in arb_ids:
+            return True
+        if masks is not None:
+            for match, mask in masks:
+                if arb_id & mask == match:
+                    return True
+        return False
+
+    def route(self, frame):
+        """ Put frame into the queue of every receiver that wants it """
+        for receiver, predicate in self.lookup(frame.arb_id):
+            if predicate is None or predicate(frame):
+                receiver.put(frame)
+
+
+def poll_device(device, timeout):
+    """ Wait up to timeout seconds for device to have a frame to receive
+
+    Uses the poll method of the device, or select on its fileno. Returns
+    True if a frame is waiting, False if not and None if the device cannot
+    be waited on, in which case only recv can tell.
+    """
+    poll = getattr(device, 'poll', None)
+    if poll is not None:
+        return poll(timeout)
+    fileno = getattr(device, 'fileno', None)
+    if fileno is not None:
+        readable, _, _ = select.select([fileno()], [], [], timeout)
+        return bool(readable)
+    return None
+
+
+class _WorkerControl:
+    """ Events shared by a dispatcher and one generation of its workers """
+
+    def __init__(self, event):
+        # set while the dispatcher runs, workers wait for it when cleared
+        self.run = event()
+        # set by stop(drain=False), queued and received frames are dropped
+        self.discard = event()
+        # set by close, parked workers return
+        self.shutdown = event()
+        # set by each worker once it has finished and is waiting for run
+        self.send_parked = event()
+        self.recv_parked = event()
+
+
 class Dispatcher:
+    # most frames handed to the device in one go
+    MAX_TX_BATCH = 64
+    # seconds between checks for stop while the device is idle
+    POLL_INTERVAL = 0.02
+    # a draining stop routes received frames until the device has been
+    # quiet for this many seconds
+    DRAIN_IDLE = 0.05
+    # seconds stop and close wait for the workers by default
+    STOP_TIMEOUT = 1.0
+    # receivers can only be added and removed while stopped
+    _STATIC_RECEIVERS = True
+
     def __init__(self, device, single_process = False):
-        # ensure the device has the required method functions
-        if not (hasattr(device, 'start') and hasattr(device, 'stop') and
-                hasattr(device, 'send') and hasattr(device, 'recv')):
-            raise ValueError('invalid device')
+        self._check_device(device)
 
         self._device = device
         self._rx_queues = []
-        self._tx_queue = Queue()
+        self._receivers = []
+        self._router = Router()
+        self._tx_queue = self._create_tx_queue()
         self._running = False
         self._single_process = single_process
+        self._workers = []
+        self._control = None
+        # the workers hold a copy of the receivers made when they started
+        self._stale_workers = False
+        # subscription changes made while running are passed to the
+        # receiving process, the counter tells it how many to expect
+        self._route_updates = Queue()
+        self._route_version = RawValue('L', 0)
+        # the time.monotonic() of the last device start, for the copies of
+        # the device in the workers
+        self._device_started = RawValue('d', 0.0)
 
-    def add_receiver(self, rx_queue):
-        if self.is_running:
+    @staticmethod
+    def _check_device(device):
+        # ensure the device has the required method functions
+        if not (hasattr(device, 'start') and hasattr(device, 'stop') and
+                hasattr(device, 'send') and hasattr(device, 'recv')):
+            raise ValueError('invalid device')
+
+    def add_receiver(self, rx_queue, arb_ids=None, masks=None,
+                     predicate=None, maxsize=0,
+                     overflow=Overflow.DropNewest):
+        """ Add a queue that receives frames
+
+        Args:
+            rx_queue: queue the frames are put into
+            arb_ids (iterable of int, optional): ids the receiver wants
+            masks (list of (int, int), optional): (id, mask) pairs, a frame
+                                                 matches when its id & mask
+                                                 equals id & mask
+            predicate (callable, optional): called with each frame whose id
+                                            matched, the frame is only
+                                            delivered if it returns True.
+                                            With the process backend it
+                                            runs in the receiving process.
+            maxsize (int, optional): most frames waiting in the queue, 0 for
+                                     no limit
+            overflow (str, optional): Overflow policy once maxsize frames
+                                      are waiting, defaults to DropNewest
+
+        Without arb_ids and masks the receiver gets every frame.
+        """
+        if self.is_running and self._STATIC_RECEIVERS:
             raise Exception('dispatcher must be stopped to add receiver')
 
         # ensure the receive queue is a queue
-        if not isinstance(rx_queue, multiprocessing.queues.Queue):
+        if not self._is_valid_queue(rx_queue):
             raise ValueError('invalid receive queue, %s' % type(rx_queue))
         # ensure this queue is not already in the dispacher
         elif rx_queue in self._rx_queues:
             raise ValueError('queue already in dispatcher')
 
+        receiver = _Receiver(rx_queue, maxsize, overflow)
+        self._router.subscribe(len(self._rx_queues), receiver, arb_ids,
+                               masks, predicate)
         self._rx_queues.append(rx_queue)
+        self._receivers.append(receiver)
+        self._invalidate_workers()
+
+    def update_receiver(self, rx_queue, arb_ids=None, masks=None,
+                        predicate=None):
+        """ Change the frames a receiver gets, see add_receiver
+
+        predicate None keeps the predicate the receiver has, remove and add
+        the receiver again to drop it. While the process backend is running
+        the predicate cannot change, as it lives in the receiving process.
+        """
+        if rx_queue not in self._rx_queues:
+            raise ValueError('rx_queue not in dispatcher')
+        index = self._rx_queues.index(rx_queue)
+
+        if predicate is None:
+            # the receiving process keeps its copy of the predicate as well
+            predicate = self._predicate(index)
+        if predicate is not self._predicate(index):
+            if self.is_running:
+                raise ValueError('predicate cannot change while running')
+            self._invalidate_workers()
+        elif self._workers:
+            self._route_updates.put((index, arb_ids, masks))
+            self._route_version.value += 1
+        self._router.subscribe(index, self._receivers[index], arb_ids, masks,
+                               predicate)
+
+    def stats(self, rx_queue=None):
+        """ Return the ReceiverStats of rx_queue, or a list with those of
+        every receiver in the order they were added
+
+        enqueued and dropped count frames since the receiver was added,
+        high_watermark is the most frames its queue has held, tracked for
+        bounded receivers only, and depth the number it holds now, None
+        where the platform cannot tell.
+        """
+        if rx_queue is None:
+            return [receiver.stats() for receiver in self._receivers]
+        if rx_queue not in self._rx_queues:
+            raise ValueError('rx_queue not in dispatcher')
+        return self._receivers[self._rx_queues.index(rx_queue)].stats()
+
+    def reset_stats(self):
+        """ Zero the counters of every receiver """
+        for receiver in self._receivers:
+            receiver.reset_stats()
+
+    def _is_valid_queue(self, rx_queue):
+        return isinstance(rx_queue, (multiprocessing.queues.Queue,
+                                     RingWriter))
+
+    def create_queue(self):
+        """ Return a new receive queue suited to this dispatcher """
+        return Queue()
+
+    def _create_tx_queue(self):
+        return Queue()
+
+    def _create_control(self):
+        return _WorkerControl(multiprocessing.Event)
+
+    def _create_worker(self, target, control):
+        return Process(target=target, args=(control, ), daemon=True)
+
+    def _invalidate_workers(self):
+        # receivers are inherited by the worker processes, which have to be
+        # replaced to see a new one
+        if self._workers:
+            self._stale_workers = True
 
     def remove_receiver(self, rx_queue):
-        if self.is_runnning():
+        if self.is_running and self._STATIC_RECEIVERS:
             raise Exception('dispatcher must be stopped to remove receiver')
 
         # check the receive queue is in the dispatcher
         if rx_queue not in self._rx_queues:
             raise ValueError('rx_queue not in dispatcher')
         else:
-            self._rx_queue.remove(rx_queue)
+            index = self._rx_queues.index(rx_queue)
+            self._router.unsubscribe(index)
+            del self._rx_queues[index]
+            del self._receivers[index]
+            self._invalidate_workers()
+
+    def _predicate(self, index):
+        return self._router._subscriptions[index][3]
+
+    def _apply_route_updates(self, applied):
+        # runs in the receiving process, its router is a copy of ours
+        while applied < self._route_version.value:
+            index, arb_ids, masks = self._route_updates.get()
+            self._router.subscribe(index, self._receivers[index], arb_ids,
+                                   masks, self._predicate(index))
+            applied += 1
+        return applied
 
     def start(self):
         if self.is_running:
             raise Exception('dispatcher already running')
 
         self._device.start()
-        self._tx_queue = Queue()
+        if hasattr(self._device, 'started_at'):
+            self._device_started.value = self._device.started_at
+        if self._stale_workers:
+            self._end_workers(self.STOP_TIMEOUT)
+        if self._workers:
+            control = self._control
+            control.discard.clear()
+            control.send_parked.clear()
+            control.recv_parked.clear()
+            control.run.set()
+        else:
+            self._start_workers()
+        self._running = True
 
+    def _start_workers(self):
+        self._control = self._create_control()
+        self._control.run.set()
         if self._single_process:
-            self._comm_process = Process(target=self._communication_loop)
-            self._comm_process.start()
+            targets = (self._communication_loop, )
         else:
-            self._send_process = Process(target=self._send_loop)
-            self._recv_process = Process(target=self._recv_loop)
-            self._recv_process.start()
-            self._send_process.start()
-        self._running = True
+            targets = (self._recv_loop, self._send_loop)
+        # the routes the workers start with, later updates reach them
+        # through _route_updates
+        self._routes_started = self._route_version.value
+        self._workers = [self._create_worker(target, self._control)
+                         for target in targets]
+        for worker in self._workers:
+            worker.start()
+        self._stale_workers = False
 
-    def stop(self):
+    def _end_workers(self, timeout):
+        # parked workers return once shutdown is set, others are terminated
+        # or, for threads, left to return when their device call does
+        control = self._control
+        control.discard.set()
+        control.shutdown.set()
+        control.send_parked.set()
+        control.run.set()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.is_alive() and hasattr(worker, 'terminate'):
+                worker.terminate()
+                worker.join()
+        self._workers = []
+        self._control = None
+        # a worker ended while taking from the queue may have broken it. A
+        # thread left behind stops at the None once its device call returns
+        self._tx_queue.put(None)
+        self._tx_queue = self._create_tx_queue()
+
+    def stop(self, drain=True, timeout=None):
+        """ Stop sending and receiving, the workers wait for the next start
+
+        Args:
+            drain (bool, optional): if True, frames queued with send are
+                                    sent and frames the device has received
+                                    are routed before stop returns. If False
+                                    they are dropped.
+            timeout (float, optional): seconds to wait for the workers,
+                                       defaults to STOP_TIMEOUT. Workers
+                                       still busy after it, usually stuck in
+                                       the device, are ended and replaced on
+                                       the next start.
+        """
         if not self.is_running:
             raise Exception('dispatcher not running')
+        if timeout is None:
+            timeout = self.STOP_TIMEOUT
 
-        if self._single_process:
-            self._comm_process.terminate()
-        else:
-            self._recv_process.terminate()
-            self._send_process.terminate()
+        control = self._control
+        if not drain:
+            control.discard.set()
+        control.run.clear()
+        # wakes the send loop, everything queued before it is sent first
+        self._tx_queue.put(None)
+        deadline = time.monotonic() + timeout
+        if not (control.send_parked.wait(timeout) and
+                control.recv_parked.wait(max(0, deadline -
+                                             time.monotonic()))):
+            self._end_workers(0)
         self._device.stop()
         self._running = False
 
+    def close(self, timeout=None):
+        """ Stop the dispatcher if it is running and end its workers, the
+        next start begins new ones """
+        if timeout is None:
+            timeout = self.STOP_TIMEOUT
+        if self.is_running:
+            self.stop(timeout=timeout)
+        if self._workers:
+            self._end_workers(timeout)
+
     @property
     def is_running(self):
         return self._running
@@ -87,31 +531,497 @@ class Dispatcher:
             raise Exception('dispatcher not running')
         self._tx_queue.put(data)
 
-    def _send_loop(self):
+    def send_batch(self, frames):
+        """ Send several frames, in order, with one put on the transmit
+        queue """
+        if not self.is_running:
+            raise Exception('dispatcher not running')
+        self._tx_queue.put(list(frames))
+
+    def _next_tx_batch(self, tx_queue):
+        # block for the first frame, then take what is already queued. A
+        # None in the queue ends the batch and tells the caller to stop
+        frames = []
+        item = tx_queue.get()
+        while item is not None:
+            if isinstance(item, list):
+                frames.extend(item)
+            else:
+                frames.append(item)
+            if len(frames) >= self.MAX_TX_BATCH:
+                break
+            try:
+                item = tx_queue.get_nowait()
+            except Empty:
+                break
+        return frames, item is None
+
+    def _send_frames(self, frames, device=None):
+        if device is None:
+            device = self._device
+        if len(frames) > 1 and hasattr(device, 'send_batch'):
+            device.send_batch(frames)
+        else:
+            for frame in frames:
+                device.send(frame)
+
+    @staticmethod
+    def _park(parked, control):
+        # wait for the dispatcher to start again, False once it is closed
+        parked.set()
+        control.run.wait()
+        return not control.shutdown.is_set()
+
+    def _send_loop(self, control):
+        # workers are started running, a stop that came first finds them
+        # as soon as they look
+        tx_queue = self._tx_queue
         while True:
-            data = self._tx_queue.get()
-            self._device.send(data)
+            stopping = False
+            while not stopping:
+                frames, stopping = self._next_tx_batch(tx_queue)
+                if frames and not control.discard.is_set():
+                    self._send_frames(frames)
+            if not self._park(control.send_parked, control):
+                return
 
-    def _recv_loop(self):
+    def _recv_loop(self, control):
+        device = self._device
+        router = self._router
+        applied = self._routes_started
         while True:
-            if not self._tx_queue.empty():
-                data = self._tx_queue.get()
-                self._device.send(data)
-            data = self._device.recv()
-            if data is not None:
-                for rx_queue in self._rx_queues:
-                    rx_queue.put_nowait(data)
-
-    def _communication_loop(self):
+            while control.run.is_set() and not control.shutdown.is_set():
+                if poll_device(device, self.POLL_INTERVAL) is False:
+                    continue
+                data = device.recv()
+                if self._route_version.value != applied:
+                    applied = self._apply_route_updates(applied)
+                if data is not None and not control.discard.is_set():
+                    router.route(data)
+
+            if not control.discard.is_set():
+                # frames sent before stop may still be coming back
+                control.send_parked.wait()
+                while poll_device(device, self.DRAIN_IDLE):
+                    data = device.recv()
+                    if data is not None:
+                        router.route(data)
+            if not self._park(control.recv_parked, control):
+                return
+            self._align_device(device)
+
+    def _align_device(self, device):
+        # the copy of the device in this process was started by the first
+        # start only, its clock follows the restarted one
+        if hasattr(device, 'align_clock'):
+            device.align_clock(self._device_started.value)
+
+    def _communication_loop(self, control):
         """
-        After each received frame check if there is something to send, in case send it and receive again
+        Transmit from a thread and receive in this one, both in the single dispatcher process
         :return:
         """
+        send_thread = threading.Thread(target=self._send_loop,
+                                       args=(control, ), daemon=True)
+        send_thread.start()
+        self._recv_loop(control)
+
+
+class ThreadDispatcher(Dispatcher):
+    """Dispatcher that runs _send_loop and _recv_loop on threads instead of
+    processes
+
+    Received frames are handed to every receiver by reference, nothing is
+    pickled, so each receiver costs one append to its buffer. Any queue with
+    put_nowait, get_nowait and qsize can be a receiver, create_queue returns
+    a RingBuffer. The device is shared between the two threads.
+    """
+
+    # seconds MultiDispatcher waits for a thread serving a device without
+    # fileno, a device whose recv blocks until the next frame leaves it
+    # behind as a daemon thread
+    RECV_JOIN_TIMEOUT = 1
+
+    def _is_valid_queue(self, rx_queue):
+        return isinstance(rx_queue, RingWriter) or (
+            hasattr(rx_queue, 'put_nowait') and
+            hasattr(rx_queue, 'get_nowait') and hasattr(rx_queue, 'qsize'))
+
+    def create_queue(self):
+        return RingBuffer()
+
+    def _create_tx_queue(self):
+        return RingBuffer()
+
+    def _create_control(self):
+        return _WorkerControl(threading.Event)
+
+    def _create_worker(self, target, control):
+        return threading.Thread(target=target, args=(control, ), daemon=True)
+
+    def _invalidate_workers(self):
+        # the threads share our receivers
+        pass
+
+    def _align_device(self, device):
+        # the threads share our device
+        pass
+
+    def update_receiver(self, rx_queue, arb_ids=None, masks=None,
+                        predicate=None):
+        # the router is shared with the receiving thread, changes apply to
+        # the next frame
+        if rx_queue not in self._rx_queues:
+            raise ValueError('rx_queue not in dispatcher')
+        index = self._rx_queues.index(rx_queue)
+        if predicate is None:
+            predicate = self._predicate(index)
+        self._router.subscribe(index, self._receivers[index], arb_ids, masks,
+                               predicate)
+
+class MultiDispatcher(ThreadDispatcher):
+    """Dispatcher for several devices, served by a single thread
+
+    devices maps interface names to devices. Devices with a fileno method
+    are waited on together with selectors, received frames get the name of
+    their device in Frame.interface. A frame sent with an interface goes to
+    that device, one without goes to default_interface, which defaults to
+    the first device.
+
+    Devices without fileno, such as LogPlayer, cannot be waited on and get
+    a thread of their own that calls recv.
+    """
+
+    # seconds a device without fileno waits after recv returned nothing
+    IDLE_POLL = 0.01
+
+    def __init__(self, devices, default_interface=None):
+        devices = dict(devices)
+        if not devices:
+            raise ValueError('no devices')
+        if default_interface is None:
+            default_interface = next(iter(devices))
+        elif default_interface not in devices:
+            raise ValueError('unknown interface %s' % default_interface)
+        for device in devices.values():
+            self._check_device(device)
+
+        # _device is the default device, used by callers like IsotpInterface
+        super().__init__(devices[default_interface])
+        self._devices = devices
+        self.default_interface = default_interface
+        self._route_lock = threading.Lock()
+
+    @property
+    def interfaces(self):
+        return list(self._devices)
+
+    def device(self, interface):
+        return self._devices[interface]
+
+    def start(self):
+        if self.is_running:
+            raise Exception('dispatcher already running')
+
+        for device in self._devices.values():
+            device.start()
+        self._tx_queue = RingBuffer()
+        self._stop_event = threading.Event()
+        self._drain = True
+
+        # the send methods write to this pipe to wake the select loop
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+        self._poll_threads = []
+        for name, device in self._devices.items():
+            if hasattr(device, 'fileno'):
+                self._selector.register(device.fileno(), selectors.EVENT_READ,
+                                        (name, device))
+            else:
+                thread = threading.Thread(target=self._poll_loop,
+                                          args=(name, device), daemon=True)
+                self._poll_threads.append(thread)
+
+        self._select_thread = threading.Thread(target=self._select_loop,
+                                               daemon=True)
+        self._select_thread.start()
+        for thread in self._poll_threads:
+            thread.start()
+        self._running = True
+
+    def stop(self, drain=True, timeout=None):
+        """ Stop serving the devices, see Dispatcher.stop. Only frames
+        queued with send are drained, the devices are not read again. """
+        if not self.is_running:
+            raise Exception('dispatcher not running')
+        if timeout is None:
+            timeout = self.RECV_JOIN_TIMEOUT
+
+        self._drain = drain
+        self._stop_event.set()
+        self._wake()
+        self._select_thread.join(timeout)
+        for device in self._devices.values():
+            device.stop()
+        for thread in self._poll_threads:
+            thread.join(timeout)
+        self._selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        self._running = False
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            # the pipe is full, the loop is already due to wake up
+            pass
+
+    def _check_interface(self, frame):
+        interface = frame.interface
+        if interface is not None and interface not in self._devices:
+            raise ValueError('unknown interface %s' % interface)
+
+    def send(self, data):
+        if not self.is_running:
+            raise Exception('dispatcher not running')
+        self._check_interface(data)
+        self._tx_queue.put(data)
+        self._wake()
+
+    def send_batch(self, frames):
+        if not self.is_running:
+            raise Exception('dispatcher not running')
+        frames = list(frames)
+        for frame in frames:
+            self._check_interface(frame)
+        self._tx_queue.put(frames)
+        self._wake()
+
+    def _send_pending(self):
+        # group the queued frames by device, keeping their order
+        by_device = {}
         while True:
-            while not self._tx_queue.empty():
-                data = self._tx_queue.get()
-                self._device.send(data)
-            data = self._device.recv()
-            if data is not None:
-                for rx_queue in self._rx_queues:
-                    rx_queue.put_nowait(data)
+            try:
+                item = self._tx_queue.get_nowait()
+            except Empty:
+                break
+            for frame in (item if isinstance(item, list) else (item, )):
+                name = frame.interface
+                if name is None:
+                    name = self.default_interface
+                by_device.setdefault(name, []).append(frame)
+        for name, frames in by_device.items():
+            self._send_frames(frames, self._devices[name])
+
+    def _receive(self, name, frame):
+        # tag a copy, a device may share the frame it received with others
+        frame = can.Frame.from_raw(frame.arb_id, frame.payload, frame.flags,
+                                   frame.timestamp, name)
+        with self._route_lock:
+            self._router.route(frame)
+
+    def _read_device(self, name, device):
+        # a SocketCanDev hands over everything that is queued in one call
+        recv_batch = getattr(device, 'recv_batch', None)
+        if recv_batch is not None:
+            for frame in recv_batch(timeout=0):
+                self._receive(name, frame)
+        else:
+            frame = device.recv()
+            if frame is not None:
+                self._receive(name, frame)
+
+    def _select_loop(self):
+        stop_event = self._stop_event
+        while not stop_event.is_set():
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    try:
+                        os.read(self._wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    self._send_pending()
+                else:
+                    self._read_device(*key.data)
+        # frames queued before stop still go out, unless they are dropped
+        if self._drain:
+            self._send_pending()
+
+    def _poll_loop(self, name, device):
+        stop_event = self._stop_event
+        while not stop_event.is_set():
+            frame = device.recv()
+            if frame is None:
+                stop_event.wait(self.IDLE_POLL)
+            elif not stop_event.is_set():
+                self._receive(name, frame)
+
+
+class Subscription:
+    """ Frames routed to one receiver of an AsyncDispatcher
+
+    Iterate with async for, or await get. Iteration ends when the
+    subscription is closed or the dispatcher stops.
+    """
+
+    def __init__(self, dispatcher, rx_queue):
+        self._dispatcher = dispatcher
+        self.rx_queue = rx_queue
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.rx_queue.get()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    async def get(self, timeout=None):
+        """ Return the next frame, None once closed. Raises queue.Empty
+        after timeout seconds """
+        return await self.rx_queue.get(timeout=timeout)
+
+    def stats(self):
+        return self._dispatcher.stats(self.rx_queue)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._dispatcher.remove_receiver(self.rx_queue)
+            self.rx_queue.put_nowait(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+
+class AsyncDispatcher(Dispatcher):
+    """Dispatcher driven by an asyncio event loop
+
+    start and stop must be called from a coroutine. The device is read from
+    a loop.add_reader callback when it has a fileno method, or otherwise by
+    a thread of the loop's default executor, and frames are routed within
+    the event loop without copies. Receivers can be added and removed at any
+    time, subscribe returns one that can be iterated with async for.
+
+    send and send_batch pass frames straight to the device. The Block
+    overflow policy is not available, it would stall the event loop.
+    """
+
+    _STATIC_RECEIVERS = False
+
+    def __init__(self, device):
+        super().__init__(device)
+        self._loop = None
+        self._recv_future = None
+
+    def _is_valid_queue(self, rx_queue):
+        return (hasattr(rx_queue, 'put_nowait') and
+                hasattr(rx_queue, 'get_nowait') and hasattr(rx_queue, 'qsize'))
+
+    def create_queue(self):
+        return AsyncRingBuffer()
+
+    def add_receiver(self, rx_queue, arb_ids=None, masks=None,
+                     predicate=None, maxsize=0,
+                     overflow=Overflow.DropNewest):
+        if overflow == Overflow.Block:
+            raise ValueError('AsyncDispatcher cannot block on a receiver')
+        super().add_receiver(rx_queue, arb_ids, masks, predicate, maxsize,
+                             overflow)
+
+    def update_receiver(self, rx_queue, arb_ids=None, masks=None,
+                        predicate=None):
+        # routing happens in the event loop, changes apply to the next frame
+        if rx_queue not in self._rx_queues:
+            raise ValueError('rx_queue not in dispatcher')
+        index = self._rx_queues.index(rx_queue)
+        if predicate is None:
+            predicate = self._predicate(index)
+        self._router.subscribe(index, self._receivers[index], arb_ids, masks,
+                               predicate)
+
+    def subscribe(self, arb_ids=None, masks=None, predicate=None, maxsize=0,
+                  overflow=Overflow.DropNewest):
+        """ Add a receiver and return it as a Subscription, the arguments
+        are those of add_receiver """
+        rx_queue = self.create_queue()
+        self.add_receiver(rx_queue, arb_ids, masks, predicate, maxsize,
+                          overflow)
+        return Subscription(self, rx_queue)
+
+    def start(self):
+        if self.is_running:
+            raise Exception('dispatcher already running')
+
+        self._loop = asyncio.get_running_loop()
+        self._device.start()
+        self._running = True
+        if hasattr(self._device, 'fileno'):
+            self._loop.add_reader(self._device.fileno(), self._on_readable)
+        else:
+            self._recv_future = self._loop.run_in_executor(None,
+                                                           self._recv_loop)
+
+    def stop(self):
+        if not self.is_running:
+            raise Exception('dispatcher not running')
+
+        self._running = False
+        if self._recv_future is None:
+            self._loop.remove_reader(self._device.fileno())
+        self._recv_future = None
+        self._device.stop()
+        # end the iteration of every subscription
+        for rx_queue in self._rx_queues:
+            rx_queue.put_nowait(None)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        self.stop()
+
+    def send(self, data):
+        if not self.is_running:
+            raise Exception('dispatcher not running')
+        self._device.send(data)
+
+    def send_batch(self, frames):
+        if not self.is_running:
+            raise Exception('dispatcher not running')
+        self._send_frames(list(frames))
+
+    def _route(self, frame):
+        if self._running:
+            self._router.route(frame)
+
+    def _on_readable(self):
+        # a SocketCanDev hands over everything that is queued in one call
+        recv_batch = getattr(self._device, 'recv_batch', None)
+        if recv_batch is not None:
+            for frame in recv_batch(timeout=0):
+                self._router.route(frame)
+        else:
+            frame = self._device.recv()
+            if frame is not None:
+                self._router.route(frame)
+
+    def _recv_loop(self):
+        # runs on an executor thread for devices without fileno
+        while self._running:
+            frame = self._device.recv()
+            if frame is None:
+                time.sleep(MultiDispatcher.IDLE_POLL)
+            else:
+                self._loop.call_soon_threadsafe(self._route, frame)
@@ -0,0 +1,248 @@
+""" compression.py
+
+Transparent compression of log files.
+
+The codec of a file is chosen by its extension, or given explicitly.
+gzip, bz2 and xz come with Python, zstd needs the zstandard package and
+lz4 the lz4 package. Files are read and written as streams, a compressed
+log is never expanded in memory as a whole.
+
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# codec of each file extension
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zst': 'zstd',
+    '.lz4': 'lz4',
+}
+
+# codecs that can be used here, None stands for no compression
+CODECS = [None, 'gzip', 'bz2', 'xz']
+if zstandard is not None:
+    CODECS.append('zstd')
+if lz4 is not None:
+    CODECS.append('lz4')
+
+# bytes compressed at a time by each thread of a threaded writer
+BLOCK_SIZE = 1 << 20
+
+
+def codec_for(filename, codec=None):
+    """ Return the codec given, or the one of the extension of filename,
+    None for a plain file """
+    if codec is None:
+        codec = EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if codec not in CODECS:
+        if codec in EXTENSIONS.values():
+            raise ValueError('the %s codec needs the %s package' %
+                             (codec, 'zstandard' if codec == 'zstd'
+                              else codec))
+        raise ValueError('unknown codec %r' % codec)
+    return codec
+
+
+def split_extension(filename):
+    """ Split filename into a root and its extension, which includes
+    the compression extension: tmp.log.gz is ('tmp', '.log.gz') """
+    root, ext = os.path.splitext(filename)
+    if ext.lower() in EXTENSIONS:
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return root, ext
+
+
+def _gzip_block(data, level):
+    # a complete gzip member, members may be concatenated
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _xz_block(data, level):
+    return lzma.compress(data, preset=level)
+
+
+# compresses one block into a stream of its own, for the codecs whose
+# readers take concatenated streams as one
+_BLOCK_COMPRESSORS = {
+    'gzip': (_gzip_block, 6),
+    'bz2': (bz2.compress, 9),
+    'xz': (_xz_block, 6),
+}
+
+
+class BlockWriter:
+    """ Writes a compressed file from threads number of threads
+
+    Data is cut into blocks of block_size bytes, each compressed by a
+    thread pool into a stream of its own and written in order. The
+    compressors release the GIL, so the blocks are compressed in parallel.
+    """
+
+    def __init__(self, filename, codec, threads, level=None,
+                 block_size=BLOCK_SIZE):
+        self._compress, default_level = _BLOCK_COMPRESSORS[codec]
+        self._level = default_level if level is None else level
+        self._file = open(filename, 'wb')
+        self._pool = ThreadPoolExecutor(threads)
+        self._threads = threads
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._pending = []
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._pool.submit(self._compress, block,
+                                               self._level))
+        # a couple of blocks per thread are in flight, the rest wait
+        while len(self._pending) > self._threads * 2:
+            self._file.write(self._pending.pop(0).result())
+
+    def flush(self):
+        """ Compress and write everything written so far """
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._file.write(self._pending.pop(0).result())
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+            self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+
+class RewindingReader(io.RawIOBase):
+    """ Raw reader of a decompressed stream that can only be read forward
+
+    opener returns a new stream of the file. Seeking forward reads up to
+    the position, seeking back opens the stream again and reads from the
+    start, so wrapped in an io.BufferedReader the stream has readline, line
+    iteration and seek like the other codecs. Seeking from the end is not
+    supported.
+    """
+
+    def __init__(self, opener):
+        self._opener = opener
+        self._stream = opener()
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation(
+                'a compressed stream cannot seek from its end')
+        if offset < self._pos:
+            self._stream.close()
+            self._stream = self._opener()
+            self._pos = 0
+        while self._pos < offset:
+            data = self._stream.read(min(offset - self._pos, BLOCK_SIZE))
+            if not data:
+                break
+            self._pos += len(data)
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        io.RawIOBase.close(self)
+
+
+def open_file(filename, mode='rb', codec=None, level=None, threads=None):
+    """ Open filename for reading ('rb') or writing ('wb') as a binary
+    stream, compressed with codec or the codec of its extension.
+
+    level is the compression level of the codec. With threads, writing
+    compresses in that many threads: zstd compresses with threads of its
+    own, gzip, bz2 and xz files are written as a series of streams by a
+    BlockWriter. lz4 compresses in the calling thread only.
+
+    zstd and lz4 streams are read through a RewindingReader.
+    """
+    if mode not in ('rb', 'wb'):
+        raise ValueError('mode must be rb or wb')
+    codec = codec_for(filename, codec)
+    writing = mode == 'wb'
+
+    if codec is None:
+        return open(filename, mode)
+    if writing and threads and codec in _BLOCK_COMPRESSORS:
+        return BlockWriter(filename, codec, threads, level)
+    if codec == 'gzip':
+        return gzip.open(filename, mode,
+                         compresslevel=6 if level is None else level)
+    if codec == 'bz2':
+        return bz2.open(filename, mode,
+                        compresslevel=9 if level is None else level)
+    if codec == 'xz':
+        return lzma.open(filename, mode, preset=level if writing else None)
+    if codec == 'zstd':
+        if writing:
+            compressor = zstandard.ZstdCompressor(
+                level=3 if level is None else level, threads=threads or 0)
+            return zstandard.open(filename, mode, cctx=compressor)
+        return io.BufferedReader(RewindingReader(
+            lambda: zstandard.open(filename, mode)))
+    # lz4
+    if writing:
+        return lz4.frame.open(filename, mode,
+                              compression_level=level or 0)
+    return io.BufferedReader(RewindingReader(
+        lambda: lz4.frame.open(filename, mode)))
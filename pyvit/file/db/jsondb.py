@@ -11,7 +11,9 @@ class JsonDbParser():
             b = bus.Bus()
             for msg in db['messages']:
                 # create a message
-                m = bus.Message(msg['name'], int(msg['id'], 0))
+                arb_id = int(msg['id'], 0)
+                m = bus.Message(msg['name'], arb_id,
+                                msg.get('extended', arb_id > 0x7FF))
 
                 # iterate over signals
                 for start_bit, sig in msg['signals'].items():
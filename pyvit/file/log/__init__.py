@@ -1 +1,5 @@
+from .asc import AscFile
+from .blf import BlfFile
 from .candump import CandumpFile
+from .index import CandumpIndex
+from .trace import TraceReader, TraceWriter
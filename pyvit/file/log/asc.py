@@ -0,0 +1,171 @@
+""" asc.py
+
+Vector ASC trace files.
+
+An ASC trace is text: a header of keywords, then one event per line,
+starting with its time in seconds since the start of the measurement. Only
+CAN and CAN FD frames are read, other events are skipped.
+
+"""
+import binascii
+import time
+
+from pyvit import can
+from pyvit.file import compression
+from pyvit.file.log.stream import StreamFile
+
+# flags column of a CAN FD line
+ASC_FD_EDL = 0x1000
+ASC_FD_BRS = 0x2000
+ASC_FD_ESI = 0x4000
+
+
+def _parse_data(tokens, base):
+    if base == 16:
+        return binascii.unhexlify(b''.join(tokens))
+    return bytes(int(token) for token in tokens)
+
+
+def _event_to_fields(tokens, timestamp, base):
+    # parse the tokens of an event line to the arguments of
+    # can.Frame.from_raw, or None if it is not a frame
+    if tokens[1] == b'CANFD':
+        return _fd_event_to_fields(tokens, timestamp, base)
+    if len(tokens) < 5 or not tokens[1].isdigit():
+        return None
+    id_str = tokens[2]
+    flags = 0
+    if id_str.endswith(b'x'):
+        flags = can.FrameFlags.Extended
+        id_str = id_str[:-1]
+    try:
+        arb_id = int(id_str, base)
+    except ValueError:
+        # error frames, statistics and the like
+        return None
+
+    kind = tokens[4]
+    if kind == b'r':
+        flags |= can.FrameFlags.Remote
+        payload = b''
+    elif kind == b'd':
+        dlc = int(tokens[5], 16)
+        payload = _parse_data(tokens[6:6 + dlc], base)
+    else:
+        return None
+    return arb_id, payload, flags, timestamp, tokens[1].decode()
+
+
+def _fd_event_to_fields(tokens, timestamp, base):
+    # time CANFD channel dir id [name] brs esi dlc length data...
+    if len(tokens) < 5:
+        return None
+    channel, id_str, rest = tokens[2], tokens[4], tokens[5:]
+    if rest and not rest[0].isdigit():
+        # the symbolic name of the frame
+        rest = rest[1:]
+    if len(rest) < 4:
+        return None
+    flags = can.FrameFlags.FD
+    if id_str.endswith(b'x'):
+        flags |= can.FrameFlags.Extended
+        id_str = id_str[:-1]
+    if rest[0] == b'1':
+        flags |= can.FrameFlags.BitRateSwitch
+    if rest[1] == b'1':
+        flags |= can.FrameFlags.ErrorStateIndicator
+    length = int(rest[3])
+    return (int(id_str, base), _parse_data(rest[4:4 + length], base), flags,
+            timestamp, channel.decode())
+
+
+class AscFile(StreamFile):
+    """ Reads and writes Vector ASC traces
+
+    Traces are read as a stream, in constant memory, with decimal or hex
+    ids and absolute or relative timestamps. Traces are written in hex with
+    absolute timestamps. A compressed trace is read and written through
+    pyvit.file.compression, the codec is given or taken from the extension.
+    """
+
+    def __init__(self, filename, codec=None):
+        StreamFile.__init__(self, filename)
+        self.codec = compression.codec_for(filename, codec)
+
+    def iter_fields(self):
+        """ Yield the arguments of can.Frame.from_raw for each frame """
+        base = 16
+        relative = False
+        last = 0.0
+        with compression.open_file(self.filename, 'rb', self.codec) as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens) < 2:
+                    continue
+                if tokens[0] == b'base':
+                    base = 16 if tokens[1] == b'hex' else 10
+                    relative = b'relative' in tokens
+                    continue
+                try:
+                    timestamp = float(tokens[0])
+                except ValueError:
+                    # header and trigger block lines
+                    continue
+                if relative:
+                    # relative to the event before
+                    timestamp += last
+                    last = timestamp
+                fields = _event_to_fields(tokens, timestamp, base)
+                if fields is not None:
+                    yield fields
+
+    def _frame_to_str(self, frame, channels):
+        channel = self._channel(frame.interface, channels)
+        timestamp = frame.timestamp or 0.0
+        arb_id = ('%Xx' if frame.is_extended_id else '%X') % frame.arb_id
+        if frame.is_fd:
+            flags = ASC_FD_EDL
+            if frame.bitrate_switch:
+                flags |= ASC_FD_BRS
+            if frame.error_state_indicator:
+                flags |= ASC_FD_ESI
+            # a payload between the CAN FD lengths is padded to the next
+            length = can.fd_length(len(frame.payload))
+            payload = bytes(frame.payload).ljust(length, b'\0')
+            return ('%12.6f CANFD %3d Rx %10s %d %d %X %2d %s '
+                    '%8d %4d %8X %8d %8d %8d %8d %8d\n' %
+                    (timestamp, channel, arb_id,
+                     1 if frame.bitrate_switch else 0,
+                     1 if frame.error_state_indicator else 0,
+                     can.FD_LENGTHS.index(length), length,
+                     payload.hex(' ').upper(), 0, 0, flags, 0, 0, 0,
+                     0, 0))
+        if frame.frame_type == can.FrameType.RemoteFrame:
+            return '%12.6f %-2d %-15s Rx   r\n' % (timestamp, channel, arb_id)
+        data = frame.payload.hex(' ').upper()
+        return '%12.6f %-2d %-15s Rx   d %d%s\n' % (
+            timestamp, channel, arb_id, len(frame.payload),
+            ' ' + data if data else '')
+
+    def export_frames(self, frames, level=None, threads=None):
+        """ Write frames, any iterable of frames including a FrameBatch, to
+        the trace. level and threads are passed to compression.open_file.
+        """
+        date = time.strftime('%a %b %d %I:%M:%S.000 %p %Y')
+        with compression.open_file(self.filename, 'wb', self.codec, level,
+                                   threads) as f:
+            f.write(('date %s\n'
+                     'base hex  timestamps absolute\n'
+                     'internal events logged\n'
+                     'Begin Triggerblock %s\n'
+                     '   0.000000 Start of measurement\n'
+                     % (date, date)).encode())
+            channels = {}
+            lines = []
+            for frame in frames:
+                lines.append(self._frame_to_str(frame, channels))
+                if len(lines) >= 4096:
+                    f.write(''.join(lines).encode())
+                    lines = []
+            lines.append('End TriggerBlock\n')
+            f.write(''.join(lines).encode())
@@ -0,0 +1,292 @@
+""" blf.py
+
+Vector BLF (binary logging format) trace files.
+
+A BLF file is a file header followed by objects. Frames are stored as
+objects inside log container objects, which are usually zlib compressed,
+and an object may continue from one container into the next. Only CAN and
+CAN FD frames are read, other objects are skipped.
+
+"""
+import struct
+import time
+import zlib
+
+from pyvit import can
+from pyvit.file.log.stream import StreamFile
+
+FILE_SIGNATURE = b'LOGG'
+OBJ_SIGNATURE = b'LOBJ'
+
+# signature, header size, application id and version, binlog version,
+# file size, uncompressed size, object count, objects read, start and
+# stop time as SYSTEMTIME
+_FILE_HEADER = struct.Struct('<4sLBBBBBBBBQQLL8H8H')
+FILE_HEADER_SIZE = 144
+# signature, header size, header version, object size, object type
+_OBJ_HEADER_BASE = struct.Struct('<4sHHLL')
+# flags, client index, object version, timestamp
+_OBJ_HEADER_V1 = struct.Struct('<LHHQ')
+# flags, timestamp status, reserved, object version, timestamp, original
+# timestamp
+_OBJ_HEADER_V2 = struct.Struct('<LBBHQQ')
+# compression method, uncompressed size
+_LOG_CONTAINER = struct.Struct('<H6xL4x')
+# channel, flags, dlc, id, data
+_CAN_MSG = struct.Struct('<HBBL8s')
+# channel, flags, dlc, id, frame length, bit count, fd flags, valid data
+# bytes, data
+_CAN_FD_MSG = struct.Struct('<HBBLLBBB5x64s')
+# channel, dlc, valid data bytes, tx count, id, frame length, flags, bit
+# rate configurations, bit offsets, bit count, direction, extended data
+# offset, crc, followed by the data
+_CAN_FD_MSG_64 = struct.Struct('<BBBBLLLLLLLHBBL')
+
+
+class ObjectType:
+    """ Enumerates the object types read and written """
+    CAN_MESSAGE = 1
+    LOG_CONTAINER = 10
+    CAN_MESSAGE2 = 86
+    CAN_FD_MESSAGE = 100
+    CAN_FD_MESSAGE_64 = 101
+
+
+# compression methods of a log container
+NO_COMPRESSION = 0
+ZLIB_DEFLATE = 2
+
+# object header flags, the unit of the timestamp
+TIME_TEN_MICS = 0x1
+TIME_ONE_NANS = 0x2
+
+CAN_MSG_EXT = 0x80000000
+# flags of CAN_MESSAGE and CAN_FD_MESSAGE
+REMOTE_FLAG = 0x80
+# fd flags of CAN_FD_MESSAGE
+EDL = 0x1
+BRS = 0x2
+ESI = 0x4
+# flags of CAN_FD_MESSAGE_64
+REMOTE_FLAG_64 = 0x0010
+EDL_64 = 0x1000
+BRS_64 = 0x2000
+ESI_64 = 0x4000
+
+# bytes of objects collected before a container is written
+CONTAINER_SIZE = 128 * 1024
+
+
+def _systemtime(timestamp):
+    t = time.localtime(timestamp)
+    return (t.tm_year, t.tm_mon, (t.tm_wday + 1) % 7, t.tm_mday, t.tm_hour,
+            t.tm_min, t.tm_sec, int(timestamp % 1 * 1000))
+
+
+def _object_to_fields(data, pos, obj_type, header_size, header_version):
+    # decode the frame object at pos to the arguments of
+    # can.Frame.from_raw, or None if it is not a frame
+    header = pos + _OBJ_HEADER_BASE.size
+    if header_version == 1:
+        flags, _, _, timestamp = _OBJ_HEADER_V1.unpack_from(data, header)
+    elif header_version == 2:
+        flags, _, _, _, timestamp, _ = _OBJ_HEADER_V2.unpack_from(data,
+                                                                  header)
+    else:
+        return None
+    timestamp /= 100000 if flags == TIME_TEN_MICS else 1000000000
+    body = pos + header_size
+
+    if obj_type in (ObjectType.CAN_MESSAGE, ObjectType.CAN_MESSAGE2):
+        channel, msg_flags, dlc, arb_id, payload = _CAN_MSG.unpack_from(
+            data, body)
+        frame_flags = 0
+        if msg_flags & REMOTE_FLAG:
+            frame_flags = can.FrameFlags.Remote
+            payload = b''
+        else:
+            payload = payload[:min(dlc, 8)]
+    elif obj_type == ObjectType.CAN_FD_MESSAGE:
+        (channel, msg_flags, dlc, arb_id, _, _, fd_flags, length,
+         payload) = _CAN_FD_MSG.unpack_from(data, body)
+        frame_flags = 0
+        if fd_flags & EDL:
+            frame_flags = can.FrameFlags.FD
+            if fd_flags & BRS:
+                frame_flags |= can.FrameFlags.BitRateSwitch
+            if fd_flags & ESI:
+                frame_flags |= can.FrameFlags.ErrorStateIndicator
+            payload = payload[:length]
+        elif msg_flags & REMOTE_FLAG:
+            frame_flags = can.FrameFlags.Remote
+            payload = b''
+        else:
+            payload = payload[:min(dlc, 8)]
+    elif obj_type == ObjectType.CAN_FD_MESSAGE_64:
+        channel, dlc, length, _, arb_id, _, msg_flags = \
+            _CAN_FD_MSG_64.unpack_from(data, body)[:7]
+        start = body + _CAN_FD_MSG_64.size
+        frame_flags = 0
+        if msg_flags & EDL_64:
+            frame_flags = can.FrameFlags.FD
+            if msg_flags & BRS_64:
+                frame_flags |= can.FrameFlags.BitRateSwitch
+            if msg_flags & ESI_64:
+                frame_flags |= can.FrameFlags.ErrorStateIndicator
+            payload = bytes(data[start:start + length])
+        elif msg_flags & REMOTE_FLAG_64:
+            frame_flags = can.FrameFlags.Remote
+            payload = b''
+        else:
+            payload = bytes(data[start:start + min(length, 8)])
+    else:
+        return None
+
+    if arb_id & CAN_MSG_EXT:
+        frame_flags |= can.FrameFlags.Extended
+        arb_id &= ~CAN_MSG_EXT
+    return arb_id, payload, frame_flags, timestamp, str(channel)
+
+
+class BlfFile(StreamFile):
+    """ Reads and writes Vector BLF traces
+
+    Traces are read one container at a time, each is decompressed when it
+    is reached, so a trace of any size is read in constant memory. Frames
+    are written as CAN_MESSAGE and CAN_FD_MESSAGE objects in zlib
+    compressed containers of CONTAINER_SIZE bytes.
+
+    Timestamps are in seconds since the start of the measurement.
+    """
+
+    def iter_fields(self):
+        """ Yield the arguments of can.Frame.from_raw for each frame """
+        with open(self.filename, 'rb') as f:
+            header = f.read(_FILE_HEADER.size)
+            if (len(header) < _FILE_HEADER.size or
+                    header[:4] != FILE_SIGNATURE):
+                raise ValueError('%s is not a BLF file' % self.filename)
+            f.seek(_FILE_HEADER.unpack(header)[1])
+
+            tail = b''
+            while True:
+                base = f.read(_OBJ_HEADER_BASE.size)
+                if len(base) < _OBJ_HEADER_BASE.size:
+                    break
+                signature, _, _, obj_size, obj_type = \
+                    _OBJ_HEADER_BASE.unpack(base)
+                if signature != OBJ_SIGNATURE:
+                    raise ValueError('corrupt object at %d in %s' %
+                                     (f.tell() - len(base), self.filename))
+                data = f.read(obj_size - len(base))
+                padding = f.read(obj_size % 4)
+
+                if obj_type == ObjectType.LOG_CONTAINER:
+                    method, size = _LOG_CONTAINER.unpack_from(data)
+                    data = data[_LOG_CONTAINER.size:]
+                    if method == ZLIB_DEFLATE:
+                        data = zlib.decompress(data, 15, size)
+                    elif method != NO_COMPRESSION:
+                        raise ValueError('unknown compression method %d' %
+                                         method)
+                else:
+                    # an object outside of a container
+                    data = base + data + padding
+                tail = yield from self._parse_objects(tail + data)
+
+    def _parse_objects(self, data):
+        # yields the frames of the objects in data, returns the bytes of an
+        # object that continues in the next container
+        pos = 0
+        end = len(data)
+        while pos + _OBJ_HEADER_BASE.size <= end:
+            (signature, header_size, header_version, obj_size,
+             obj_type) = _OBJ_HEADER_BASE.unpack_from(data, pos)
+            if signature != OBJ_SIGNATURE:
+                raise ValueError('corrupt object in %s' % self.filename)
+            next_pos = pos + obj_size
+            if obj_type not in (ObjectType.CAN_FD_MESSAGE,
+                                ObjectType.CAN_FD_MESSAGE_64):
+                next_pos += obj_size % 4
+            if next_pos > end:
+                break
+            fields = _object_to_fields(data, pos, obj_type, header_size,
+                                       header_version)
+            if fields is not None:
+                yield fields
+            pos = next_pos
+        return data[pos:]
+
+    def _frame_to_object(self, frame, channels):
+        channel = self._channel(frame.interface, channels)
+        arb_id = frame.arb_id | (CAN_MSG_EXT if frame.is_extended_id else 0)
+        remote = frame.frame_type == can.FrameType.RemoteFrame
+        if frame.is_fd:
+            obj_type = ObjectType.CAN_FD_MESSAGE
+            fd_flags = EDL
+            if frame.bitrate_switch:
+                fd_flags |= BRS
+            if frame.error_state_indicator:
+                fd_flags |= ESI
+            # a payload between the CAN FD lengths is padded to the next,
+            # the struct pads it with zeros
+            length = can.fd_length(len(frame.payload))
+            body = _CAN_FD_MSG.pack(channel, 0, can.FD_LENGTHS.index(length),
+                                    arb_id, 0, 0, fd_flags, length,
+                                    frame.payload)
+        else:
+            obj_type = ObjectType.CAN_MESSAGE
+            body = _CAN_MSG.pack(channel, REMOTE_FLAG if remote else 0,
+                                 len(frame.payload), arb_id, frame.payload)
+        header_size = _OBJ_HEADER_BASE.size + _OBJ_HEADER_V1.size
+        return (_OBJ_HEADER_BASE.pack(OBJ_SIGNATURE, header_size, 1,
+                                      header_size + len(body), obj_type) +
+                _OBJ_HEADER_V1.pack(TIME_ONE_NANS, 0, 0,
+                                    round((frame.timestamp or 0.0) * 1e9)) +
+                body)
+
+    def _write_container(self, f, data, level):
+        if level:
+            method = ZLIB_DEFLATE
+            compressed = zlib.compress(data, level)
+        else:
+            method = NO_COMPRESSION
+            compressed = data
+        header_size = _OBJ_HEADER_BASE.size + _LOG_CONTAINER.size
+        obj_size = header_size + len(compressed)
+        f.write(_OBJ_HEADER_BASE.pack(OBJ_SIGNATURE, header_size, 1,
+                                      obj_size,
+                                      ObjectType.LOG_CONTAINER))
+        f.write(_LOG_CONTAINER.pack(method, len(data)))
+        f.write(compressed)
+        f.write(bytes(obj_size % 4))
+        return header_size + len(data) + obj_size % 4
+
+    def export_frames(self, frames, level=6):
+        """ Write frames, any iterable of frames including a FrameBatch, to
+        the trace. level is the zlib level of the containers, 0 writes
+        them uncompressed. """
+        start = time.time()
+        with open(self.filename, 'wb') as f:
+            f.write(bytes(FILE_HEADER_SIZE))
+            channels = {}
+            count = 0
+            uncompressed = FILE_HEADER_SIZE
+            container = bytearray()
+            for frame in frames:
+                container += self._frame_to_object(frame, channels)
+                count += 1
+                if len(container) >= CONTAINER_SIZE:
+                    uncompressed += self._write_container(f, container,
+                                                          level)
+                    container = bytearray()
+            if container:
+                uncompressed += self._write_container(f, container, level)
+
+            size = f.tell()
+            f.seek(0)
+            f.write(_FILE_HEADER.pack(FILE_SIGNATURE, FILE_HEADER_SIZE, 5,
+                                      0, 0, 0, 2, 6, 8, 1, size,
+                                      uncompressed, count, 0,
+                                      *_systemtime(start),
+                                      *_systemtime(time.time())))
@@ -1,62 +1,262 @@
-import re
+import binascii
+import collections
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 from pyvit import can
+from pyvit.batch import FrameBatch
+from pyvit.file import compression
+from pyvit.file.log.index import CandumpIndex
+
+# CAN FD flags digit of the '##' syntax
+CANFD_BRS = 0x1
+CANFD_ESI = 0x2
+
+
+def _fd_flags(fd_flags):
+    # convert the CAN FD flags digit to can.FrameFlags
+    flags = can.FrameFlags.FD
+    if fd_flags & CANFD_BRS:
+        flags |= can.FrameFlags.BitRateSwitch
+    if fd_flags & CANFD_ESI:
+        flags |= can.FrameFlags.ErrorStateIndicator
+    return flags
+
+
+def _line_to_fields(line):
+    # parse one candump line, as bytes, to the arguments of
+    # can.Frame.from_raw. Returns None for a blank line.
+    fields = line.split()
+    if len(fields) < 3:
+        if fields:
+            raise ValueError('invalid candump line %r' % line)
+        return None
+    timestamp, interface, frame = fields[:3]
+    arb_id_str, _, datastr = frame.partition(b'#')
+    arb_id = int(arb_id_str, 16)
+
+    flags = 0
+    if datastr.startswith(b'#'):
+        # CAN FD frame, '##' is followed by a hex digit of FD flags
+        flags = _fd_flags(int(datastr[1:2], 16))
+        datastr = datastr[2:]
+    elif datastr.startswith(b'R'):
+        # remote frame, optionally followed by its DLC
+        flags = can.FrameFlags.Remote
+        datastr = b''
+    if len(arb_id_str) > 3:
+        flags |= can.FrameFlags.Extended
+
+    return (arb_id, binascii.unhexlify(datastr), flags,
+            float(timestamp[1:-1]), interface.decode())
+
+
+def _fields_to_line(arb_id, payload, flags, timestamp, interface):
+    # format the arguments of can.Frame.from_raw as one candump line.
+    # Extended ids are written with 8 digits, as candump does.
+    if flags & can.FrameFlags.FD:
+        # CAN FD frames use '##' and a flags digit
+        data = '#%X%s' % (
+            (CANFD_BRS if flags & can.FrameFlags.BitRateSwitch else 0) |
+            (CANFD_ESI if flags & can.FrameFlags.ErrorStateIndicator else 0),
+            payload.hex().upper())
+    elif flags & can.FrameFlags.Remote:
+        # remote frames have no data
+        data = 'R'
+    else:
+        data = payload.hex().upper()
+    return '(%f) %s %s#%s\n' % (
+        timestamp, interface,
+        ('%08X' if flags & can.FrameFlags.Extended else '%03X') % arb_id,
+        data)
+
+
+def _parse_range(filename, start, end):
+    # runs in a worker process, parses the lines between two offsets
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        return _parse_block(f.read(end - start))
+
+
+def _parse_block(block):
+    # runs in a worker process, parses a block of whole lines
+    batch = FrameBatch()
+    CandumpFile._append_lines(batch, block.splitlines())
+    return batch
 
 
 class CandumpFile:
-    def __init__(self, filename):
+    """ Reads and writes logs in the format of candump -l
+
+    iter_frames and iter_batches read the log in blocks of chunk_size
+    bytes, so logs of any size are read in constant memory. Every field is
+    kept: timestamp, interface, extended and CAN FD flags.
+
+    iter_batches and import_batch take workers to parse blocks in that
+    many processes at once, the batches still come out in log order.
+
+    Logs compressed with a codec of pyvit.file.compression are read and
+    written as streams, the codec is given or taken from the extension.
+
+    index returns the CandumpIndex of a plain log, extract uses it to read
+    a time window without reading the log up to it.
+    """
+
+    # bytes read at a time
+    CHUNK_SIZE = 1 << 20
+    # bytes parsed by a worker process at a time
+    PARALLEL_CHUNK_SIZE = 16 << 20
+
+    def __init__(self, filename, codec=None):
         self.filename = filename
+        self.codec = compression.codec_for(filename, codec)
 
-    def _str_to_frame(self, string):
-        # split by whitespace
-        fields = re.split('\s+', string)
-        # arb_id is the part before '#' in the 3rd field, represented as hex
-        arb_id = int(fields[2].split('#')[0], 16)
-        # the data strig follows the '#'
-        datastr = fields[2].split('#')[1]
-
-        # iterate over the data string and collect the bytes
-        data = []
-        for i in range(0, len(datastr)):
-            if i % 2 == 0:
-                data.append(int(datastr[i:i+2], 16))
+    def _str_to_fields(self, string):
+        return _line_to_fields(string.encode())
 
+    def _str_to_frame(self, string):
         # assemble the frame
-        return can.Frame(arb_id, data=data)
+        return can.Frame.from_raw(*self._str_to_fields(string))
 
-    def _frame_to_str(self, frame):
-        string = ''
+    def _iter_lines(self, chunk_size=None):
+        # yields the lines of each block
+        for block in self._iter_blocks(chunk_size):
+            yield block.splitlines()
 
-        # insert timestamp if set
-        if frame.timestamp:
-            string += '(%f) ' % frame.timestamp
-        else:
-            string += '(0.0) '
+    def _iter_blocks(self, chunk_size=None):
+        # yields blocks of the log, a block ends on a line boundary
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        with compression.open_file(self.filename, 'rb', self.codec) as f:
+            rest = b''
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    break
+                if rest:
+                    block = rest + block
+                end = block.rfind(b'\n') + 1
+                rest = block[end:]
+                if end:
+                    yield block[:end]
+            if rest:
+                yield rest
 
-        # insert interface if set
-        if frame.interface:
-            string += '%s ' % frame.interface
-        else:
-            string += 'can0 '
+    def iter_frames(self, chunk_size=None):
+        """ Yield the frames of the log one at a time """
+        for lines in self._iter_lines(chunk_size):
+            for line in lines:
+                fields = _line_to_fields(line)
+                if fields is not None:
+                    yield can.Frame.from_raw(*fields)
 
-        # add ID and '#' character
-        string += ('%03X' % frame.arb_id) + '#'
+    def iter_batches(self, chunk_size=None, workers=None):
+        """ Yield the frames of the log as a FrameBatch for each block of
+        chunk_size bytes, parsed by workers processes if given """
+        if workers is not None and workers > 1:
+            yield from self._iter_parallel(chunk_size, workers)
+            return
+        for lines in self._iter_lines(chunk_size):
+            batch = FrameBatch()
+            self._append_lines(batch, lines)
+            if len(batch):
+                yield batch
 
-        # add data
-        for b in frame.data:
-            string += '%02X' % b
+    def _ranges(self, chunk_size):
+        # (start, end) offsets of blocks of about chunk_size bytes, each
+        # starting at the beginning of a line
+        size = os.path.getsize(self.filename)
+        offsets = [0]
+        with open(self.filename, 'rb') as f:
+            for pos in range(chunk_size, size, chunk_size):
+                # the line ending at or after pos - 1 ends the block
+                f.seek(pos - 1)
+                f.readline()
+                offset = f.tell()
+                if offsets[-1] < offset < size:
+                    offsets.append(offset)
+        offsets.append(size)
+        return list(zip(offsets, offsets[1:]))
 
-        string += '\n'
-        return string
+    def _iter_parallel(self, chunk_size, workers):
+        chunk_size = chunk_size or self.PARALLEL_CHUNK_SIZE
+        if self.codec is None:
+            # workers read their own part of a plain log
+            tasks = ((_parse_range, self.filename, start, end)
+                     for start, end in self._ranges(chunk_size))
+        else:
+            # a compressed log can only be read in order, blocks are
+            # decompressed here and parsed by the workers
+            tasks = ((_parse_block, block)
+                     for block in self._iter_blocks(chunk_size))
+        with ProcessPoolExecutor(workers) as pool:
+            # a few blocks per worker are in flight, the rest of the log is
+            # not read until they have been consumed
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.submit(*task))
+                if len(pending) >= workers * 2:
+                    batch = pending.popleft().result()
+                    if len(batch):
+                        yield batch
+            while pending:
+                batch = pending.popleft().result()
+                if len(batch):
+                    yield batch
+
+    @staticmethod
+    def _append_lines(batch, lines):
+        append_raw = batch.append_raw
+        for line in lines:
+            fields = _line_to_fields(line)
+            if fields is not None:
+                append_raw(*fields)
+
+    def _frame_to_str(self, frame):
+        return _fields_to_line(frame.arb_id, frame.payload, frame.flags,
+                               frame.timestamp or 0.0,
+                               frame.interface or 'can0')
 
     def import_frames(self):
-        frames = []
-        with open(self.filename, 'r') as f:
-            for line in f.readlines():
-                frames.append(self._str_to_frame(line))
-        return frames
-
-    def export_frames(self, frames):
-        with open(self.filename, 'w') as f:
+        return list(self.iter_frames())
+
+    def index(self, every_frames=CandumpIndex.EVERY_FRAMES,
+              every_seconds=None):
+        """ Return the index of the log, built or loaded from its cache,
+        see CandumpIndex.open """
+        return CandumpIndex.open(self.filename, every_frames, every_seconds)
+
+    def extract(self, start_time=None, end_time=None, index=None):
+        """ Return the frames logged from start_time to end_time as a
+        FrameBatch. The window is found with index, or the index of the log,
+        and only it is read, through a memory map. """
+        index = index or self.index()
+        start = 0 if start_time is None else index.find(start_time)
+        with open(self.filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if end_time is None else index.find(end_time, True)
+            if end <= start:
+                return FrameBatch()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                return _parse_block(log[start:end])
+
+    def import_batch(self, workers=None):
+        if workers is not None and workers > 1:
+            return FrameBatch.concat(self._iter_parallel(None, workers))
+        batch = FrameBatch()
+        for lines in self._iter_lines():
+            self._append_lines(batch, lines)
+        return batch
+
+    def export_frames(self, frames, level=None, threads=None):
+        """ Write frames, any iterable of frames including a FrameBatch, to
+        the log. level and threads are passed to compression.open_file. """
+        with compression.open_file(self.filename, 'wb', self.codec, level,
+                                   threads) as f:
+            lines = []
             for frame in frames:
-                f.write(self._frame_to_str(frame))
+                lines.append(self._frame_to_str(frame))
+                if len(lines) >= 4096:
+                    f.write(''.join(lines).encode())
+                    lines = []
+            f.write(''.join(lines).encode())
@@ -0,0 +1,259 @@
+""" index.py
+
+Sidecar index of a candump log, for seeking by time and id statistics.
+
+The index holds the byte offset and timestamp of every few frames of a log,
+and the number of frames, first and last timestamp of each id in it. It is
+built in one pass over the log and cached next to it, in the log filename
+with INDEX_SUFFIX appended, until the log changes.
+
+"""
+import bisect
+import collections
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from pyvit.file import compression
+
+MAGIC = b'PYVCDIDX'
+VERSION = 1
+INDEX_SUFFIX = '.idx'
+
+# magic, version, log size, log modification time in nanoseconds, frames
+# between entries, seconds between entries (NaN if none), frame count,
+# entry count and id count
+_HEADER = struct.Struct('<8sH6xQqQdQQQ')
+# arb_id, extended flag, count, first and last timestamp
+_ID = struct.Struct('<I?3xQdd')
+
+IdStats = collections.namedtuple('IdStats', ['count', 'first', 'last'])
+IdStats.__doc__ = """ Frame count, first and last timestamp of an id """
+
+
+def _to_bytes(values):
+    # arrays are stored little endian
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _line_timestamp(line):
+    return float(line[1:line.index(b')')])
+
+
+class CandumpIndex:
+    """ Offsets and id statistics of a candump log
+
+    An entry is recorded for the first frame, then after every_frames
+    frames or every_seconds seconds of log, whichever comes first. The log
+    is expected in time order, as candump writes it. Compressed logs cannot
+    be indexed, they are not read by byte offset.
+
+    Attributes:
+        log_filename (str): the log indexed
+        timestamps (array of float): timestamp of each entry
+        offsets (array of int): byte offset of the line of each entry
+        ids (dict): IdStats of each (arb_id, is_extended) in the log
+        frames (int): number of frames in the log
+    """
+
+    EVERY_FRAMES = 1000
+
+    def __init__(self, log_filename, every_frames=EVERY_FRAMES,
+                 every_seconds=None):
+        if compression.codec_for(log_filename) is not None:
+            raise ValueError('a compressed log cannot be indexed')
+        self.log_filename = log_filename
+        self.every_frames = every_frames
+        self.every_seconds = every_seconds
+        self.timestamps = array('d')
+        self.offsets = array('Q')
+        self.ids = {}
+        self.frames = 0
+        self._stat = None
+
+    @classmethod
+    def build(cls, log_filename, every_frames=EVERY_FRAMES,
+              every_seconds=None):
+        """ Index log_filename in one pass, without caching it """
+        index = cls(log_filename, every_frames, every_seconds)
+        index._build()
+        return index
+
+    @classmethod
+    def open(cls, log_filename, every_frames=EVERY_FRAMES,
+             every_seconds=None):
+        """ Return the cached index of log_filename, or build and cache it
+        if there is none for the log as it is now. Raises ValueError if a
+        file that is not an index is in the way of the cache. """
+        index = cls(log_filename, every_frames, every_seconds)
+        try:
+            if index._load():
+                return index
+        except (OSError, struct.error):
+            # an unreadable or truncated index is written again
+            pass
+        index._build()
+        try:
+            index.save()
+        except OSError:
+            # a log in a read only place is indexed every time
+            pass
+        return index
+
+    @property
+    def index_filename(self):
+        return self.log_filename + INDEX_SUFFIX
+
+    def _log_stat(self):
+        stat = os.stat(self.log_filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _build(self):
+        # the stat is taken first, so a log that grows meanwhile is not
+        # mistaken for the indexed one
+        self._stat = self._log_stat()
+        from pyvit.file.log.candump import CandumpFile
+
+        timestamps = self.timestamps
+        offsets = self.offsets
+        ids = {}
+        every_frames = self.every_frames
+        every_seconds = self.every_seconds
+        frames = 0
+        since = every_frames
+        next_time = None
+        offset = 0
+        for block in CandumpFile(self.log_filename)._iter_blocks():
+            for line in block.split(b'\n'):
+                start = offset
+                offset += len(line) + 1
+                if not line.strip():
+                    continue
+                timestamp = _line_timestamp(line)
+                if since >= every_frames or (next_time is not None and
+                                             timestamp >= next_time):
+                    timestamps.append(timestamp)
+                    offsets.append(start)
+                    since = 0
+                    if every_seconds is not None:
+                        next_time = timestamp + every_seconds
+                since += 1
+                frames += 1
+
+                # candump writes extended ids with 8 digits, standard ones
+                # with 3
+                id_str = line.split()[2].partition(b'#')[0]
+                key = (int(id_str, 16), len(id_str) > 3)
+                stats = ids.get(key)
+                if stats is None:
+                    ids[key] = [1, timestamp, timestamp]
+                else:
+                    stats[0] += 1
+                    stats[2] = timestamp
+            # a block ends with its newline, not a line of its own
+            offset -= 1
+
+        self.frames = frames
+        self.ids = {key: IdStats(*stats) for key, stats in ids.items()}
+
+    def save(self, filename=None):
+        """ Write the index to filename, the cache next to the log by
+        default """
+        size, mtime = self._stat
+        every_seconds = (float('nan') if self.every_seconds is None
+                         else self.every_seconds)
+        with open(filename or self.index_filename, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, size, mtime,
+                                 self.every_frames, every_seconds,
+                                 self.frames, len(self.timestamps),
+                                 len(self.ids)))
+            f.write(_to_bytes(self.timestamps))
+            f.write(_to_bytes(self.offsets))
+            f.write(b''.join(_ID.pack(arb_id, extended, *stats)
+                             for (arb_id, extended), stats
+                             in sorted(self.ids.items())))
+
+    def _load(self):
+        # read the cached index, False if it is missing or out of date
+        if not os.path.exists(self.index_filename):
+            return False
+        with open(self.index_filename, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError('%s is not a candump index' %
+                             self.index_filename)
+        (magic, version, size, mtime, every_frames, every_seconds, frames,
+         entries, id_count) = _HEADER.unpack_from(data)
+        if version != VERSION:
+            return False
+        if every_seconds != every_seconds:
+            every_seconds = None
+        if ((size, mtime) != self._log_stat() or
+                every_frames != self.every_frames or
+                every_seconds != self.every_seconds):
+            return False
+
+        pos = _HEADER.size
+        self.timestamps = _from_bytes('d', data[pos:pos + entries * 8])
+        pos += entries * 8
+        self.offsets = _from_bytes('Q', data[pos:pos + entries * 8])
+        pos += entries * 8
+        self.ids = {}
+        for arb_id, extended, count, first, last in _ID.iter_unpack(
+                data[pos:pos + id_count * _ID.size]):
+            self.ids[(arb_id, extended)] = IdStats(count, first, last)
+        self.frames = frames
+        self._stat = (size, mtime)
+        return True
+
+    @property
+    def first_timestamp(self):
+        return self.timestamps[0] if self.timestamps else None
+
+    @property
+    def last_timestamp(self):
+        return max((s.last for s in self.ids.values()), default=None)
+
+    def find(self, timestamp, after=False):
+        """ Return the byte offset of the first line logged at or after
+        timestamp, or after it if after is True. The log is memory mapped
+        and read from the entry before timestamp only. """
+        # the last entry logged before timestamp, every line before it is
+        # too
+        entry = (bisect.bisect_right if after else bisect.bisect_left)(
+            self.timestamps, timestamp) - 1
+        pos = self.offsets[entry] if entry >= 0 else 0
+
+        with open(self.log_filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                while pos < size:
+                    end = log.find(b'\n', pos)
+                    if end < 0:
+                        end = size
+                    line = log[pos:end]
+                    if line.strip():
+                        line_timestamp = _line_timestamp(line)
+                        if (line_timestamp > timestamp if after
+                                else line_timestamp >= timestamp):
+                            return pos
+                    pos = end + 1
+        return size
+
+    def __len__(self):
+        return self.frames
@@ -0,0 +1,77 @@
+""" stream.py
+
+Frame and batch interface shared by the logs that are read as a stream of
+frames.
+
+"""
+from abc import ABC, abstractmethod
+
+from pyvit import can
+from pyvit.batch import FrameBatch
+
+
+class StreamFile(ABC):
+    """ Base of the log formats read frame by frame from the start
+
+    Subclasses yield the arguments of can.Frame.from_raw from iter_fields
+    and write frames in export_frames. Interfaces are channel numbers in
+    these formats: frames are read with the channel number as interface,
+    and written with the number of their interface if it is one, or else a
+    channel numbered in order of appearance from 1.
+    """
+
+    # frames in each batch of iter_batches
+    BATCH_SIZE = 65536
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    @abstractmethod
+    def iter_fields(self):
+        """ Yield the arguments of can.Frame.from_raw for each frame """
+
+    def iter_frames(self):
+        """ Yield the frames of the log one at a time """
+        for fields in self.iter_fields():
+            yield can.Frame.from_raw(*fields)
+
+    def iter_batches(self, batch_size=None):
+        """ Yield the frames of the log as a FrameBatch of batch_size
+        frames at a time """
+        batch_size = batch_size or self.BATCH_SIZE
+        batch = FrameBatch()
+        for fields in self.iter_fields():
+            batch.append_raw(*fields)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = FrameBatch()
+        if len(batch):
+            yield batch
+
+    def import_frames(self):
+        return list(self.iter_frames())
+
+    def import_batch(self):
+        batch = FrameBatch()
+        for fields in self.iter_fields():
+            batch.append_raw(*fields)
+        return batch
+
+    @abstractmethod
+    def export_frames(self, frames):
+        """ Write frames, any iterable of frames, to the log """
+
+    @staticmethod
+    def _channel(interface, channels):
+        # channel number of interface, channels maps the names numbered so
+        # far
+        channel = channels.get(interface)
+        if channel is None:
+            if interface is not None and interface.isdigit():
+                channel = int(interface)
+            else:
+                channel = 1
+                while channel in channels.values():
+                    channel += 1
+            channels[interface] = channel
+        return channel
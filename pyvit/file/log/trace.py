@@ -0,0 +1,315 @@
+""" trace.py
+
+Binary CAN trace with an index, for random access to large captures.
+
+A trace is a file header, chunks of varint packed records and an index
+footer. The index holds, for each chunk, its position, record count, time
+range and a bitmap of the ids in it, so a reader only decodes the chunks
+that can hold the frames asked for.
+
+"""
+import mmap
+import struct
+
+from pyvit.batch import FrameBatch
+
+MAGIC = b'PYVTRACE'
+VERSION = 1
+# magic, version
+_FILE_HEADER = struct.Struct('<8sH6x')
+# offset, length, record count, first and last timestamp in microseconds
+# and the id bitmap of one chunk
+BITMAP_BITS = 2048
+_INDEX_ENTRY = struct.Struct('<QIIqq%ds' % (BITMAP_BITS // 8))
+# index offset, chunk count, interface table offset, magic
+_TRAILER = struct.Struct('<QQQ8s')
+
+# flag bit of a record without timestamp, above the can.FrameFlags bits
+NO_TIMESTAMP = 0x80
+
+# bytes of records collected before a chunk is written out
+CHUNK_SIZE = 256 * 1024
+
+
+def _id_bit(arb_id):
+    # standard ids have a bit each, extended ids share them
+    return (arb_id ^ (arb_id >> 11) ^ (arb_id >> 22)) & (BITMAP_BITS - 1)
+
+
+def _put_varint(buf, value):
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _get_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class TraceWriter:
+    """ Writes frames to a trace file
+
+    Frames should be written in time order, out of order frames are stored
+    but make the time ranges of their chunks wider. The index is written by
+    close, a trace that was not closed cannot be read.
+    """
+
+    def __init__(self, filename, chunk_size=CHUNK_SIZE):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self._file = open(filename, 'wb')
+        self._file.write(_FILE_HEADER.pack(MAGIC, VERSION))
+        self._index = []
+        self._interfaces = {None: 0}
+        self._new_chunk()
+
+    def _new_chunk(self):
+        self._chunk = bytearray()
+        self._count = 0
+        self._first = None
+        self._last = None
+        self._previous = 0
+        self._bitmap = bytearray(BITMAP_BITS // 8)
+
+    def write_raw(self, arb_id, payload, flags=0, timestamp=None,
+                  interface=None):
+        """ Add a frame from trusted values, see can.Frame.from_raw """
+        chunk = self._chunk
+        if timestamp is None:
+            chunk.append(flags | NO_TIMESTAMP)
+        else:
+            chunk.append(flags)
+            micros = round(timestamp * 1000000)
+            delta = micros - self._previous
+            # zigzag, so a frame older than the one before stays small
+            _put_varint(chunk, delta << 1 if delta >= 0 else
+                        (-delta << 1) - 1)
+            self._previous = micros
+            if self._first is None or micros < self._first:
+                self._first = micros
+            if self._last is None or micros > self._last:
+                self._last = micros
+        _put_varint(chunk, arb_id)
+        chunk.append(len(payload))
+        index = self._interfaces.get(interface)
+        if index is None:
+            index = self._interfaces[interface] = len(self._interfaces)
+        _put_varint(chunk, index)
+        chunk += payload
+
+        bit = _id_bit(arb_id)
+        self._bitmap[bit >> 3] |= 1 << (bit & 7)
+        self._count += 1
+        if len(chunk) >= self.chunk_size:
+            self._flush_chunk()
+
+    def write(self, frame):
+        self.write_raw(frame.arb_id, frame.payload, frame.flags,
+                       frame.timestamp, frame.interface)
+
+    def write_batch(self, frames):
+        # frames may be any iterable of frames, including a FrameBatch
+        for frame in frames:
+            self.write(frame)
+
+    def _flush_chunk(self):
+        if not self._count:
+            return
+        offset = self._file.tell()
+        self._file.write(self._chunk)
+        # a chunk of frames without timestamps matches any time range
+        first = self._first if self._first is not None else -(1 << 63)
+        last = self._last if self._last is not None else (1 << 63) - 1
+        self._index.append(_INDEX_ENTRY.pack(offset, len(self._chunk),
+                                             self._count, first, last,
+                                             bytes(self._bitmap)))
+        self._new_chunk()
+
+    def close(self):
+        if self._file is None:
+            return
+        self._flush_chunk()
+        index_offset = self._file.tell()
+        self._file.write(b''.join(self._index))
+        interfaces_offset = self._file.tell()
+        names = sorted(self._interfaces, key=self._interfaces.get)[1:]
+        table = bytearray()
+        _put_varint(table, len(names))
+        for name in names:
+            encoded = name.encode()
+            _put_varint(table, len(encoded))
+            table += encoded
+        self._file.write(table)
+        self._file.write(_TRAILER.pack(index_offset, len(self._index),
+                                       interfaces_offset, MAGIC))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+
+class TraceReader:
+    """ Reads a trace file written by TraceWriter
+
+    The file is memory mapped and only the chunks whose time range and id
+    bitmap match a query are decoded.
+
+    Attributes:
+        chunks (list of tuple): (offset, length, count, first, last, bitmap)
+                                of each chunk, times in microseconds
+        interfaces (list of str): interface names, None first
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            self._file.close()
+            raise ValueError('%s is not a trace file' % filename)
+        data = self._mmap
+
+        try:
+            if (len(data) < _FILE_HEADER.size or
+                    _FILE_HEADER.unpack_from(data, 0)[0] != MAGIC):
+                raise ValueError('%s is not a trace file' % filename)
+            version = _FILE_HEADER.unpack_from(data, 0)[1]
+            if version > VERSION:
+                raise ValueError('trace version %d is not supported'
+                                 % version)
+            if (len(data) < _FILE_HEADER.size + _TRAILER.size or
+                    data[-len(MAGIC):] != MAGIC):
+                raise ValueError('%s has no index, it was not closed'
+                                 % filename)
+        except ValueError:
+            self._mmap.close()
+            self._file.close()
+            raise
+        index_offset, count, interfaces_offset, _ = _TRAILER.unpack_from(
+            data, len(data) - _TRAILER.size)
+
+        self.chunks = list(_INDEX_ENTRY.iter_unpack(
+            data[index_offset:index_offset + count * _INDEX_ENTRY.size]))
+        self.interfaces = [None]
+        names, pos = _get_varint(data, interfaces_offset)
+        for _ in range(names):
+            length, pos = _get_varint(data, pos)
+            self.interfaces.append(data[pos:pos + length].decode())
+            pos += length
+
+    def __len__(self):
+        return sum(chunk[2] for chunk in self.chunks)
+
+    def matching_chunks(self, start_time=None, end_time=None, arb_ids=None):
+        """ Return the index entries of the chunks that may hold frames
+        from start_time to end_time with an id in arb_ids """
+        start = None if start_time is None else round(start_time * 1000000)
+        end = None if end_time is None else round(end_time * 1000000)
+        bits = None if arb_ids is None else [_id_bit(i) for i in arb_ids]
+
+        matches = []
+        for chunk in self.chunks:
+            _, _, _, first, last, bitmap = chunk
+            if start is not None and last < start:
+                continue
+            if end is not None and first > end:
+                continue
+            if bits is not None and not any(bitmap[bit >> 3] &
+                                            (1 << (bit & 7)) for bit in bits):
+                continue
+            matches.append(chunk)
+        return matches
+
+    def read(self, start_time=None, end_time=None, arb_ids=None):
+        """ Return the frames from start_time to end_time, with an id in
+        arb_ids if given, as a FrameBatch. Frames without timestamp only
+        match when there is no time range. """
+        batch = FrameBatch()
+        for _ in self._select(batch, start_time, end_time, arb_ids):
+            pass
+        return batch
+
+    def iter_batches(self, start_time=None, end_time=None, arb_ids=None):
+        """ Like read, but yield a FrameBatch for each matching chunk, so
+        a large range is never held in memory at once """
+        for batch in self._select(None, start_time, end_time, arb_ids):
+            if len(batch):
+                yield batch
+
+    def _select(self, batch, start_time, end_time, arb_ids):
+        # decodes the matching chunks into batch, or into a new batch each
+        # if batch is None, yielding the batch after each chunk
+        start = None if start_time is None else round(start_time * 1000000)
+        end = None if end_time is None else round(end_time * 1000000)
+        if arb_ids is not None:
+            arb_ids = frozenset(arb_ids)
+        for chunk in self.matching_chunks(start_time, end_time, arb_ids):
+            chunk_batch = FrameBatch() if batch is None else batch
+            self._decode(chunk, chunk_batch, start, end, arb_ids)
+            yield chunk_batch
+
+    def _decode(self, chunk, batch, start, end, arb_ids):
+        data = self._mmap
+        interfaces = self.interfaces
+        offset, length, count = chunk[:3]
+        pos = offset
+        micros = 0
+        timed = start is not None or end is not None
+        for _ in range(count):
+            flags = data[pos]
+            pos += 1
+            if flags & NO_TIMESTAMP:
+                flags &= ~NO_TIMESTAMP
+                timestamp = None
+            else:
+                delta, pos = _get_varint(data, pos)
+                micros += (delta >> 1) ^ -(delta & 1)
+                timestamp = micros / 1000000
+            arb_id, pos = _get_varint(data, pos)
+            dlc = data[pos]
+            interface, pos = _get_varint(data, pos + 1)
+            payload_start = pos
+            pos += dlc
+
+            if arb_ids is not None and arb_id not in arb_ids:
+                continue
+            if timed:
+                if timestamp is None:
+                    continue
+                if start is not None and micros < start:
+                    continue
+                if end is not None and micros > end:
+                    continue
+            batch.append_raw(arb_id, data[payload_start:pos], flags,
+                             timestamp, interfaces[interface])
+
+    def __iter__(self):
+        return iter(self.read())
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
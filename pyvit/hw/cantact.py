@@ -10,6 +10,10 @@ class CantactDev:
         # opening the serial connection with the device in attribute ser
         self.ser = serial.Serial(port, baudrate)
 
+    def fileno(self):
+        # the serial port can be waited on with select
+        return self.ser.fileno()
+
     def _dev_write(self, string):
         self.ser.write(string.encode())
 
@@ -89,22 +93,21 @@ class CantactDev:
             dlc = int(rx_str[4])
             data_offset = 5
 
-        # create the frame
-        frame = can.Frame(arb_id, extended=ext_id)
+        # create the frame from the data bytes
+        flags = 0
+        if ext_id:
+            flags |= can.FrameFlags.Extended
         if remote:
-            frame.frame_type = can.FrameType.RemoteFrame
-
-        # parse the data bytes
-        data = []
-        for i in range(0, dlc):
-            data.append(int(rx_str[data_offset+i*2:(data_offset+2)+i*2], 16))
-            frame.data = data
+            flags |= can.FrameFlags.Remote
+        frame = can.Frame.from_raw(
+            arb_id, bytes.fromhex(rx_str[data_offset:data_offset + dlc * 2]),
+            flags)
 
         if self.debug:
             print("RECV: %s" % frame)
         return frame
 
-    def send(self, frame):
+    def _frame_to_str(self, frame):
         # add type, id, and dlc to string
         if frame.is_extended_id:
             tx_str = "T%08X%d" % (frame.arb_id, frame.dlc)
@@ -112,17 +115,24 @@ class CantactDev:
             tx_str = "t%03X%d" % (frame.arb_id, frame.dlc)
 
         # add data bytes to string
-        for i in range(0, frame.dlc):
-            tx_str = tx_str + ("%02X" % frame.data[i])
+        tx_str = tx_str + frame.payload.hex().upper()
 
         # add newline (\r) to string
-        tx_str = tx_str + '\r'
+        return tx_str + '\r'
 
+    def send(self, frame):
         # send it
-        self._dev_write(tx_str)
+        self._dev_write(self._frame_to_str(frame))
         if self.debug:
             print("SENT: %s" % frame)
 
+    def send_batch(self, frames):
+        # the commands of all frames go out in a single serial write
+        self._dev_write(''.join(self._frame_to_str(frame) for frame in frames))
+        if self.debug:
+            for frame in frames:
+                print("SENT: %s" % frame)
+
     def set_filter_id(self, filter_id):
         # set CAN filter identifier
         self._dev_write('F%X\r' % filter_id)
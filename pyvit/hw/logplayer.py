@@ -1,22 +1,105 @@
+import contextlib
+import os
 import time
 from .. import can
+from ..batch import FrameBatch
+from ..file import compression
+from ..file.log.asc import AscFile
+from ..file.log.blf import BlfFile
+from ..file.log.candump import _line_to_fields
+from ..file.log.index import CandumpIndex
+
+# trace formats played through their reader, by extension
+READERS = {
+    '.asc': AscFile,
+    '.blf': BlfFile,
+}
 
 
 class LogPlayer:
+    """ Device that plays back a candump log
+
+    With realtime, frames are returned at the pace they were logged,
+    divided by speed: speed=10 plays ten times faster. Frames are scheduled
+    against a monotonic clock from the first frame played, so late wake ups
+    do not add up, and frames due within SLEEP_GRANULARITY of each other
+    are returned without sleeping in between. Without realtime, frames are
+    returned as fast as they are read.
+
+    start_time and end_time limit playback to a window of log timestamps.
+    With loop, playback starts over at the end of the log or window, and
+    the timestamps of each pass carry on from those of the last: the first
+    frame of a pass follows the last of the one before after the mean
+    period of the pass, or LOOP_GAP seconds if the pass is a single frame.
+
+    Compressed logs are decompressed as they are played, the codec is given
+    or taken from the extension, see pyvit.file.compression.
+
+    Vector ASC and BLF traces, found by their extension, are played from
+    the frames of their reader in READERS. They are read from the start
+    to seek.
+
+    With index, a plain candump log seeks through its CandumpIndex, which
+    is built on the first start and cached next to the log.
+    """
+
     running = False
     debug = False
 
-    def __init__(self, log_filename, realtime=True):
+    # frames due this close together are returned without sleeping
+    SLEEP_GRANULARITY = 0.001
+    # seconds between passes of a loop over a single frame
+    LOOP_GAP = 1.0
+    # seek reads the log line by line once it is this close to the target
+    SEEK_SCAN = 65536
+
+    def __init__(self, log_filename, realtime=True, speed=1.0, loop=False,
+                 start_time=None, end_time=None, codec=None, index=False):
+        if speed <= 0:
+            raise ValueError('speed must be positive')
         self.log_filename = log_filename
+        self.codec = compression.codec_for(log_filename, codec)
+        root, ext = os.path.splitext(log_filename)
+        if ext.lower() in compression.EXTENSIONS:
+            ext = os.path.splitext(root)[1]
+        reader = READERS.get(ext.lower())
+        if reader is BlfFile:
+            # BLF compresses its own containers
+            self._reader = BlfFile(log_filename)
+        elif reader is not None:
+            self._reader = reader(log_filename, codec)
+        else:
+            self._reader = None
         self.realtime = realtime
+        self.speed = speed
+        self.loop = loop
+        self.start_time = start_time
+        self.end_time = end_time
+        self.index = index
+        self._index = None
 
     def start(self):
         assert not self.running, 'cannot start, already running'
 
-        self.logfile = open(self.log_filename, 'r')
+        if self._reader is not None:
+            self.logfile = None
+            self._fields = self._reader_fields(self.start_time)
+        else:
+            self.logfile = self._open()
+            if self.index and self.codec is None:
+                self._index = CandumpIndex.open(self.log_filename)
         self.start_timestamp = None
         self.running = True
         self.linenumber = 0
+        self._anchor = None
+        self._loop_offset = 0.0
+        self._first_timestamp = None
+        self._last_timestamp = None
+        self._pass_frames = 0
+        self._window_offset = 0
+        if self.start_time is not None and self._reader is None:
+            self.seek(self.start_time)
+            self._window_offset = self.logfile.tell()
 
     def __enter__(self):
         self.start()
@@ -24,7 +107,10 @@ class LogPlayer:
 
     def stop(self):
         self.running = False
-        self.logfile.close()
+        if self._reader is not None:
+            self._fields.close()
+        else:
+            self.logfile.close()
 
     def __exit__(self, exception_type, exception_value, traceback):
         self.stop()
@@ -33,62 +119,189 @@ class LogPlayer:
         if self.debug:
             print("DEV SEND: %s " % data)
 
+    def _open(self):
+        return compression.open_file(self.log_filename, 'rb', self.codec)
+
+    def _reader_fields(self, timestamp):
+        # the frames of the reader logged at or after timestamp
+        with contextlib.closing(self._reader.iter_fields()) as frames:
+            for fields in frames:
+                if timestamp is not None:
+                    if fields[3] < timestamp:
+                        continue
+                    timestamp = None
+                yield fields
+
+    def seek(self, timestamp):
+        """ Continue playback from the first frame logged at or after
+        timestamp. The log is expected in time order, as candump writes
+        it. A compressed log is read from the start up to timestamp. """
+        assert self.running, 'not running'
+        if self._reader is not None:
+            self._fields.close()
+            self._fields = self._reader_fields(timestamp)
+        else:
+            self.logfile.seek(self._find(self.logfile, timestamp))
+        # the next frame is played straight away
+        self._anchor = None
+
+    def _find(self, logfile, timestamp):
+        if self._index is not None:
+            return self._index.find(timestamp)
+        # binary search over byte offsets, lo is always at the start of a
+        # line logged before timestamp, or of the log. Seeking a compressed
+        # log means decompressing up to the offset, it is scanned instead.
+        lo, hi = 0, 0
+        if self.codec is None:
+            logfile.seek(0, os.SEEK_END)
+            hi = logfile.tell()
+        while hi - lo > self.SEEK_SCAN:
+            mid = (lo + hi) // 2
+            logfile.seek(mid)
+            logfile.readline()
+            pos = logfile.tell()
+            line = logfile.readline()
+            while line and not line.strip():
+                pos = logfile.tell()
+                line = logfile.readline()
+            if not line or self._log_timestamp(line) >= timestamp:
+                hi = mid
+            else:
+                lo = pos
+
+        logfile.seek(lo)
+        while True:
+            pos = logfile.tell()
+            line = logfile.readline()
+            if not line or (line.strip() and
+                            self._log_timestamp(line) >= timestamp):
+                return pos
+
+    def _read_fields(self):
+        # fields of the next frame in the log, or None at its end
+        if self._reader is not None:
+            return next(self._fields, None)
+        while True:
+            line = self.logfile.readline()
+            self.linenumber = self.linenumber + 1
+            if line == b'':
+                return None
+            if line.strip():
+                return self._log_to_fields(line)
+            # seems to be an empty line, just go for next one
+
+    def _rewind(self):
+        # back to the start of the log or window
+        if self._reader is not None:
+            self._fields.close()
+            self._fields = self._reader_fields(self.start_time)
+        else:
+            self.logfile.seek(self._window_offset)
+
+    def _next_fields(self):
+        # fields of the next frame to play, with the loop offset applied,
+        # or None at the end of the log or window
+        while True:
+            fields = self._read_fields()
+            if (fields is not None and self.end_time is not None and
+                    fields[3] > self.end_time):
+                fields = None
+            if fields is None:
+                if not self.loop or self._last_timestamp is None:
+                    # out of frames
+                    return None
+                # the next pass starts one period after this one ended
+                span = self._last_timestamp - self._first_timestamp
+                if self._pass_frames > 1:
+                    gap = span / (self._pass_frames - 1)
+                else:
+                    gap = self.LOOP_GAP
+                self._loop_offset += span + gap
+                self._first_timestamp = None
+                self._pass_frames = 0
+                self._rewind()
+                continue
+
+            arb_id, payload, flags, timestamp, interface = fields
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+            self._last_timestamp = timestamp
+            self._pass_frames += 1
+            return (arb_id, payload, flags, timestamp + self._loop_offset,
+                    interface)
+
     def recv(self):
         assert self.running, 'not running'
 
-        line = self.logfile.readline()
-        self.linenumber = self.linenumber + 1
-        if line == '':
-            # out of frames
+        fields = self._next_fields()
+        if fields is None:
             return None
-        if line in ['\n', '\n\r']:
-            # seams to be an empty line, just go for next one
-            return self.recv()
-
-        # convert line to frame
-        frame = self._log_to_frame(line)
+        frame = can.Frame.from_raw(*fields)
 
-        # make the first frame's timestamp now
-        if self.start_timestamp is None:
-            self.start_timestamp = time.time() - frame.timestamp
-        # sleep until message occurs
         if self.realtime:
-            time.sleep(max((self.start_timestamp - time.time() +
-                            frame.timestamp), 0))
+            now = time.monotonic()
+            if self._anchor is None:
+                # the first frame, or the first after seek, plays now
+                self._anchor = (now, frame.timestamp)
+                self.start_timestamp = time.time() - frame.timestamp
+            clock, timestamp = self._anchor
+            # sleep until message occurs
+            delay = clock + (frame.timestamp - timestamp) / self.speed - now
+            if delay > self.SLEEP_GRANULARITY:
+                time.sleep(delay)
         if self.debug:
             print("DEV RECV: %s " % frame)
         return frame
 
     def recv_all(self):
-        frames = []
+        return list(self.recv_batch())
 
-        line = self.logfile.readline()
-        while line != '':
-            frame = self._log_to_frame(line)
-            frames.append(frame)
-            line = self.logfile.readline()
-
-        return frames
-
-    def _log_to_frame(self, line):
-        fields = line.split(' ')
+    def recv_batch(self, max_frames=None):
+        """ Read the remaining frames, or up to max_frames, as a FrameBatch
+        without any realtime delay """
+        if self.loop and max_frames is None:
+            raise ValueError('a looping log has no end, give max_frames')
+        batch = FrameBatch()
 
-        arb_id_str = fields[2].split('#')[0]
-        arb_id = int(arb_id_str, 16)
+        while max_frames is None or len(batch) < max_frames:
+            fields = self._next_fields()
+            if fields is None:
+                break
+            batch.append_raw(*fields)
 
-        extended_id = len(arb_id_str) > 3
-        frame = can.Frame(arb_id, extended=extended_id)
+        return batch
 
-        frame.timestamp = float(fields[0][1:-1])
+    def extract(self, start_time=None, end_time=None):
+        """ Return the frames logged from start_time to end_time as a
+        FrameBatch, without disturbing playback """
+        batch = FrameBatch()
+        if self._reader is not None:
+            with contextlib.closing(self._reader_fields(start_time)) as frames:
+                for fields in frames:
+                    if end_time is not None and fields[3] > end_time:
+                        break
+                    batch.append_raw(*fields)
+            return batch
+        with self._open() as logfile:
+            if start_time is not None:
+                logfile.seek(self._find(logfile, start_time))
+            for line in logfile:
+                if not line.strip():
+                    continue
+                fields = self._log_to_fields(line)
+                if end_time is not None and fields[3] > end_time:
+                    break
+                batch.append_raw(*fields)
+        return batch
 
-        datastr = fields[2].split('#')[1]
-        dlc = int(len(datastr) / 2)
+    def _log_timestamp(self, line):
+        return float(line[1:line.index(b')')])
 
-        frame.data = []
-        for i in range(0, dlc):
-            frame.data.append(int(datastr[i*2:i*2+2], 16))
+    def _log_to_fields(self, line):
+        return _line_to_fields(line)
 
-        return frame
+    def _log_to_frame(self, line):
+        return can.Frame.from_raw(*self._log_to_fields(line))
 
     def set_bitrate(self, value):
-        pass
\ No newline at end of file
+        pass
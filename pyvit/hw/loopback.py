@@ -1,10 +1,35 @@
-from multiprocessing import Queue
+import collections
+import os
+import select
+import threading
+import time
+from multiprocessing import Queue, Value
+from queue import Empty
+
+from .. import can
+from ..utils.ringbuffer import RingBuffer
 
 
 class LoopbackDev:
+    """ Device that receives the frames sent to it, from this process or
+    one forked from it
+
+    A byte is written to a wake pipe for each frame sent and read back for
+    each frame received, so the pipe is readable while frames are waiting,
+    for fileno and poll. Frames sent while the pipe is full are counted
+    instead, and taken back before the bytes in the pipe are.
+    """
+
+    debug = False
+
     def __init__(self):
         self._queue = Queue()
         self.running = False
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        # frames sent without a byte in the pipe
+        self._unsignalled = Value('L', 0)
 
     def start(self):
         if self.running:
@@ -18,17 +43,294 @@ class LoopbackDev:
 
         self.running = False
 
+    def fileno(self):
+        # readable once a frame is waiting in the queue
+        return self._wake_r
+
+    def poll(self, timeout=0):
+        """ Wait up to timeout seconds for a frame, True once one is
+        waiting """
+        return bool(select.select([self._wake_r], [], [], timeout)[0])
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            # the pipe is full, it is readable already
+            with self._unsignalled.get_lock():
+                self._unsignalled.value += 1
+
+    def _unwake(self):
+        # take back the byte of a frame received. Frames counted while the
+        # pipe was full go first, so the pipe stays readable for the rest.
+        if self._unsignalled.value:
+            with self._unsignalled.get_lock():
+                if self._unsignalled.value:
+                    self._unsignalled.value -= 1
+                    return
+        os.read(self._wake_r, 1)
+
     def send(self, data):
         if not self.running:
             raise Exception('device not started')
         if self.debug:
             print("SENT: %s" % data)
+        # the byte goes first, so it is there by the time the frame is
+        # received
+        self._wake()
         self._queue.put(data)
 
+    def send_batch(self, frames):
+        for frame in frames:
+            self.send(frame)
+
+    def recv(self):
+        if not self.running:
+            raise Exception('device not started')
+        # wake up now and then, so a reader in another thread of this
+        # process returns None once the device is stopped
+        while True:
+            try:
+                dt = self._queue.get(timeout=0.1)
+                break
+            except Empty:
+                if not self.running:
+                    return None
+        self._unwake()
+        if self.debug:
+            print("RECV: %s" % dt)
+        return dt
+
+
+def frame_bits(frame, data_phase=False):
+    """ Return the number of bits frame takes on the wire, without stuff
+    bits. With data_phase, only those sent at the data bitrate of a CAN FD
+    frame with bitrate switch, otherwise all the others. """
+    dlc = frame.dlc
+    if frame.is_fd:
+        # ESI, DLC, data, stuff count with parity and CRC delimiter, then
+        # the CRC
+        data = 1 + 4 + dlc * 8 + 4 + 1 + (17 if dlc <= 16 else 21)
+        if frame.bitrate_switch:
+            if data_phase:
+                return data
+            data = 0
+        elif data_phase:
+            return 0
+        # SOF, id, r1 or SRR and IDE and extension, IDE or r1, FDF, res,
+        # BRS, then ACK, ACK delimiter, EOF and intermission
+        arbitration = 1 + 11 + (20 if frame.is_extended_id else 1) + 4
+        return arbitration + data + 2 + 7 + 3
+    if data_phase:
+        return 0
+    if frame.frame_type == can.FrameType.RemoteFrame:
+        dlc = 0
+    # SOF, id, RTR, IDE, r0, DLC, data, CRC and delimiter, ACK and
+    # delimiter, EOF and intermission
+    header = 1 + 11 + 1 + 1 + 1 + 4
+    if frame.is_extended_id:
+        # SRR, IDE and the 18 bit extension move RTR and r0 along
+        header += 20
+    return header + dlc * 8 + 16 + 2 + 7 + 3
+
+
+def _arbitration_key(frame):
+    # the bits a node sends during arbitration, in order, a dominant 0
+    # wins. A standard frame beats an extended one with the same base id,
+    # its RTR and IDE bits meet the SRR and IDE bits of the extended frame.
+    remote = int(frame.frame_type == can.FrameType.RemoteFrame)
+    if frame.is_extended_id:
+        return (frame.arb_id >> 18, 1, 1, frame.arb_id & 0x3FFFF, remote)
+    return (frame.arb_id, remote, 0, 0, 0)
+
+
+def _copy(frame, timestamp):
+    return can.Frame.from_raw(frame.arb_id, frame.payload, frame.flags,
+                              timestamp, frame.interface)
+
+
+class VirtualBus:
+    """ CAN bus between VirtualDev endpoints of the same process
+
+    Each frame sent by a node is delivered to every other started node, and
+    to the sender as well if it was attached with receive_own.
+
+    Without a bitrate, frames are delivered as soon as they are sent. With a
+    bitrate, a bus thread sends one frame at a time: when the bus goes
+    idle, the first frame queued by each node takes part in arbitration and
+    the lowest id wins, as on a real bus. The frame is delivered after it
+    has been on the wire for frame_bits(frame) bits, the data phase of CAN
+    FD frames with bitrate switch at data_bitrate, and stamped with the bus
+    time in seconds since the bus was created. A frame waiting for the bus
+    starts when the frame before it ends, so frames queued while the bus is
+    busy are stamped exactly frame_bits apart. A frame sent to an idle bus
+    starts when it is sent, so its timestamp depends on the clock as well.
+
+    Each receiver gets a copy of its own, so a receiver that changes a
+    frame, say by setting its interface, does not change it for the others
+    or the sender.
+
+    The nodes are threads of one process, use ThreadDispatcher,
+    MultiDispatcher or AsyncDispatcher with them.
+    """
+
+    def __init__(self, bitrate=None, data_bitrate=None):
+        self.bitrate = bitrate
+        self.data_bitrate = data_bitrate or bitrate
+        self._nodes = []
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+        # (frame, receive buffers, end time) of the frame on the wire
+        self._sending = None
+        self._epoch = time.monotonic()
+        self._idle_at = self._epoch
+
+    def attach(self, receive_own=False):
+        """ Return a new VirtualDev on this bus """
+        return VirtualDev(self, receive_own)
+
+    def _update_peers(self):
+        # runs when a node starts or stops, each node keeps the receive
+        # buffers its frames go to
+        with self._lock:
+            running = [node for node in self._nodes if node.running]
+            for node in self._nodes:
+                node._peers = tuple(peer._rx for peer in running
+                                    if peer is not node or node.receive_own)
+
+    def duration(self, frame):
+        """ Seconds frame is on the wire at the bitrate of the bus """
+        seconds = frame_bits(frame) / self.bitrate
+        if frame.is_fd and frame.bitrate_switch:
+            seconds += frame_bits(frame, True) / self.data_bitrate
+        return seconds
+
+    def _queue(self, node, frames):
+        with self._queued:
+            if self._closed:
+                raise Exception('bus closed')
+            node._tx.extend(frames)
+            if self._sending is None:
+                # the bus is idle, the frame goes out now
+                self._arbitrate(time.monotonic())
+                self._queued.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+
+    def _arbitrate(self, now):
+        # called with the lock held whenever the bus goes idle
+        contenders = [node for node in self._nodes if node._tx]
+        if not contenders:
+            self._sending = None
+            return
+        sender = min(contenders,
+                     key=lambda node: _arbitration_key(node._tx[0]))
+        frame = sender._tx.popleft()
+        start = max(self._idle_at, now)
+        self._sending = (frame, sender._peers, start + self.duration(frame))
+
+    def _run(self):
+        while True:
+            with self._queued:
+                while self._sending is None and not self._closed:
+                    self._queued.wait()
+                if self._closed:
+                    return
+                frame, peers, end = self._sending
+
+            delay = end - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            timestamp = end - self._epoch
+            for rx in peers:
+                rx.put_nowait(_copy(frame, timestamp))
+
+            with self._queued:
+                # the next frame starts from the scheduled end of this one,
+                # so sleeping late does not slow the bus down
+                self._idle_at = end
+                self._arbitrate(end)
+
+    def close(self):
+        """ Stop the bus thread, frames still queued are dropped """
+        with self._queued:
+            self._closed = True
+            self._queued.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class VirtualDev:
+    """ Node of a VirtualBus, created with VirtualBus.attach """
+
+    debug = False
+
+    def __init__(self, bus, receive_own=False):
+        self.bus = bus
+        self.receive_own = receive_own
+        self.running = False
+        self._rx = RingBuffer()
+        self._tx = collections.deque()
+        self._peers = ()
+        with bus._lock:
+            bus._nodes.append(self)
+
+    def start(self):
+        if self.running:
+            raise Exception('device already started')
+
+        self.running = True
+        self.bus._update_peers()
+
+    def stop(self):
+        if not self.running:
+            raise Exception('device not started')
+
+        self.running = False
+        self.bus._update_peers()
+
+    def poll(self, timeout=0):
+        """ Wait up to timeout seconds for a frame, True once one is
+        waiting """
+        return self._rx.wait(timeout)
+
+    def send(self, data):
+        if not self.running:
+            raise Exception('device not started')
+        if self.debug:
+            print("SENT: %s" % data)
+        if self.bus.bitrate is None:
+            for rx in self._peers:
+                rx.put_nowait(_copy(data, data.timestamp))
+        else:
+            self.bus._queue(self, (data, ))
+
+    def send_batch(self, frames):
+        if not self.running:
+            raise Exception('device not started')
+        if self.bus.bitrate is None:
+            frames = list(frames)
+            for rx in self._peers:
+                rx.put_batch([_copy(frame, frame.timestamp)
+                              for frame in frames])
+        else:
+            self.bus._queue(self, frames)
+
     def recv(self):
         if not self.running:
             raise Exception('device not started')
-        dt = self._queue.get()
+        # like LoopbackDev, return None once stopped from another thread
+        while True:
+            try:
+                dt = self._rx.get(timeout=0.1)
+                break
+            except Empty:
+                if not self.running:
+                    return None
         if self.debug:
             print("RECV: %s" % dt)
         return dt
@@ -166,8 +166,8 @@ class OBDLinkSXDev:
             return None
         arb_id = withoutNewLine[:3]
         # skip one position because it contains the dlc
-        data = [int(withoutNewLine[i:i+2], 16) for i in range(4, len(withoutNewLine), 2)]
-        frame = can.Frame(int(arb_id, 16), data)
+        data = bytes.fromhex(withoutNewLine[4:])
+        frame = can.Frame.from_raw(int(arb_id, 16), data)
         if self.debug:
             print("RECV: %s" % frame)
         return frame
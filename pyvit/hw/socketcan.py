@@ -1,64 +1,512 @@
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
 import struct
 import socket
 import time
 
 from .. import can
+from ..batch import FrameBatch
+
+# struct can_frame: 32 bit id with flags, dlc, 3 padding bytes, 8 data bytes
+_can_frame = struct.Struct("=IB3x8s")
+# struct canfd_frame: 32 bit id with flags, length, flags, 2 reserved bytes,
+# 64 data bytes
+_canfd_frame = struct.Struct("=IBBxx64s")
+
+# canfd_frame flags from <linux/can.h>
+CANFD_BRS = 0x01
+CANFD_ESI = 0x02
+
+# struct can_filter: id and mask
+_can_filter = struct.Struct("=II")
+
+# recvmmsg flag from <sys/socket.h>, not exported by the socket module
+MSG_WAITFORONE = 0x10000
+# socket option from <linux/can/raw.h>, not exported by the socket module
+CAN_RAW_ERR_FILTER = 2
+
+# timestamping options from <asm-generic/socket.h> and
+# <linux/net_tstamp.h>, not exported by the socket module
+SO_TIMESTAMPNS = 35
+SO_TIMESTAMPING = 37
+SOF_TIMESTAMPING_RX_HARDWARE = 1 << 2
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_RAW_HARDWARE = 1 << 6
+
+# struct timespec, and struct scm_timestamping which holds three of them
+_timespec = struct.Struct("@ll")
+_scm_timestamping = struct.Struct("@llllll")
+# struct cmsghdr: length, level, type
+_cmsghdr = struct.Struct("@Nii")
+# room for one SCM_TIMESTAMPING message
+_CONTROL_SIZE = 64
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def _load_recvmmsg():
+    # recvmmsg is Linux specific, fall back to one recv per frame without it
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                         ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+
+def _load_sendmmsg():
+    # sendmmsg is Linux specific, fall back to one send per frame without it
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                         ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+_recvmmsg = _load_recvmmsg()
+_sendmmsg = _load_sendmmsg()
+
+
+def _split_id(arb_id):
+    # split the flag bits of a SocketCAN id from the identifier
+    flags = 0
+    if arb_id & 0x80000000:
+        flags |= can.FrameFlags.Extended
+    if arb_id & 0x40000000:
+        flags |= can.FrameFlags.Remote
+    if arb_id & 0x20000000:
+        flags |= can.FrameFlags.Error
+    if flags & (can.FrameFlags.Extended | can.FrameFlags.Error):
+        return arb_id & 0x1FFFFFFF, flags
+    return arb_id & 0x7FF, flags
+
+
+def _decode_frame(frame_raw):
+    # returns (arb_id, data, flags) of a can_frame or canfd_frame, told
+    # apart by their size
+    if len(frame_raw) == _canfd_frame.size:
+        arb_id, length, fd_flags, data = _canfd_frame.unpack(frame_raw)
+        arb_id, flags = _split_id(arb_id)
+        flags |= can.FrameFlags.FD
+        if fd_flags & CANFD_BRS:
+            flags |= can.FrameFlags.BitRateSwitch
+        if fd_flags & CANFD_ESI:
+            flags |= can.FrameFlags.ErrorStateIndicator
+        return arb_id, data[:length], flags
+
+    arb_id, dlc, data = _can_frame.unpack(frame_raw)
+    arb_id, flags = _split_id(arb_id)
+    # select the data bytes up to the DLC value
+    return arb_id, data[:dlc], flags
+
+
+def _encode_frame(frame):
+    # returns the can_frame or canfd_frame struct of a Frame
+    arb_id = frame.arb_id
+    # set the extended bit if a extended id is used
+    if frame.is_extended_id:
+        arb_id |= 0x80000000
+    if frame.frame_type == can.FrameType.RemoteFrame:
+        arb_id |= 0x40000000
+
+    # data is zero padded to 8 or 64 bytes by the struct
+    if frame.is_fd:
+        fd_flags = 0
+        if frame.bitrate_switch:
+            fd_flags |= CANFD_BRS
+        if frame.error_state_indicator:
+            fd_flags |= CANFD_ESI
+        return _canfd_frame.pack(arb_id, frame.dlc, fd_flags, frame.payload)
+    return _can_frame.pack(arb_id, frame.dlc, frame.payload)
+
+
+def _cmsg_align(length):
+    # control messages are aligned to the size of a size_t
+    align = ctypes.sizeof(ctypes.c_size_t)
+    return (length + align - 1) & ~(align - 1)
+
+
+def _parse_control(data):
+    # split raw control data into (level, type, data) tuples, as recvmsg does
+    messages = []
+    offset = 0
+    while offset + _cmsghdr.size <= len(data):
+        length, level, cmsg_type = _cmsghdr.unpack_from(data, offset)
+        if length < _cmsghdr.size:
+            break
+        messages.append((level, cmsg_type,
+                         bytes(data[offset + _cmsghdr.size:offset + length])))
+        offset += _cmsg_align(length)
+    return messages
+
+
+class _RecvBuffer:
+    """ Preallocated receive buffer with one iovec per frame slot, and
+    optionally one control message buffer per slot """
+
+    def __init__(self, slots, frame_size, control_size=0):
+        self.slots = slots
+        self.control_size = control_size
+        self.buffer = bytearray(slots * frame_size)
+        self._c_buffer = (ctypes.c_char * len(self.buffer)).from_buffer(
+            self.buffer)
+        base = ctypes.addressof(self._c_buffer)
+        self.control = bytearray(slots * control_size)
+        if control_size:
+            self._c_control = (ctypes.c_char * len(self.control)).from_buffer(
+                self.control)
+            control_base = ctypes.addressof(self._c_control)
+        self.iovecs = (_iovec * slots)()
+        self.msgs = (_mmsghdr * slots)()
+        for i in range(slots):
+            self.iovecs[i].iov_base = base + i * frame_size
+            self.iovecs[i].iov_len = frame_size
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+            if control_size:
+                self.msgs[i].msg_hdr.msg_control = (control_base +
+                                                    i * control_size)
+
+    def reset_control(self, count):
+        # the kernel shrinks msg_controllen to the length it used
+        for i in range(count):
+            self.msgs[i].msg_hdr.msg_controllen = self.control_size
+
+    def control_messages(self, index):
+        length = self.msgs[index].msg_hdr.msg_controllen
+        start = index * self.control_size
+        return _parse_control(memoryview(self.control)[start:start + length])
 
 
 class SocketCanDev:
-    def __init__(self, ndev):
+    """ SocketCAN device
+
+    With fd=True the socket also receives and sends CAN FD frames, which
+    requires an FD capable interface.
+
+    timestamping selects the source of Frame.timestamp, always in seconds
+    since start(), whose time.monotonic() is kept in started_at:
+        None: taken in Python after the frame is read (default)
+        'kernel': taken by the kernel when the frame arrived (SO_TIMESTAMPNS)
+        'hardware': taken by the CAN controller where the driver supports it,
+                    otherwise by the kernel (SO_TIMESTAMPING)
+
+    The kernel stamps frames on the realtime clock. They are moved to the
+    monotonic clock by an offset sampled at start() and again every
+    CLOCK_SYNC_INTERVAL seconds, so a step of the realtime clock (NTP, a
+    changed date) only skews kernel timestamps until the next sample.
+    """
+
+    # seconds between samples of the realtime to monotonic clock offset
+    CLOCK_SYNC_INTERVAL = 1.0
+
+    def __init__(self, ndev, timestamping=None, fd=False):
         self.running = False
 
         if not hasattr(socket, 'PF_CAN') or not hasattr(socket, 'CAN_RAW'):
             print("Python 3.3 or later is needed for native SocketCan")
             raise SystemExit(1)
 
+        if timestamping not in (None, 'kernel', 'hardware'):
+            raise ValueError('invalid timestamping mode %s' % timestamping)
+
         self.socket = socket.socket(socket.PF_CAN, socket.SOCK_RAW,
                                     socket.CAN_RAW)
         self.ndev = ndev
+        self.timestamping = timestamping
+        self.fd = fd
+        self._mtu = _canfd_frame.size if fd else _can_frame.size
+        self._recv_buffer = None
+        self._filter_id = 0
+        self._filter_mask = 0
+        # (arb_id, mask) filters added by each user of the device
+        self._shared_filters = collections.Counter()
+        self._bound = False
 
     def start(self):
-        self.socket.bind((self.ndev,))
-        self.start_time = time.time()
+        if self.fd:
+            self.socket.setsockopt(socket.SOL_CAN_RAW,
+                                   socket.CAN_RAW_FD_FRAMES, 1)
+        # stop leaves the socket open, a restart keeps the binding
+        if not self._bound:
+            self.socket.bind((self.ndev,))
+            self._bound = True
+        self._enable_timestamping()
+        self._start_clocks()
         self.running = True
 
+    def _start_clocks(self, started_at=None):
+        # started_at is the time.monotonic() timestamps count from
+        self.started_at = (time.monotonic() if started_at is None
+                           else started_at)
+        self._hardware_base = None
+        self._sync_clocks()
+
+    def align_clock(self, started_at):
+        """ Count timestamps from started_at, the time.monotonic() of a
+        start() made by a copy of this device in another process """
+        self._start_clocks(started_at)
+
+    def _sync_clocks(self):
+        # a realtime kernel timestamp minus _kernel_base is the monotonic
+        # time since start()
+        now = time.monotonic()
+        self._kernel_base = time.time() - now + self.started_at
+        self._next_sync = now + self.CLOCK_SYNC_INTERVAL
+
+    def _enable_timestamping(self):
+        if self.timestamping == 'kernel':
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        elif self.timestamping == 'hardware':
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING,
+                                   SOF_TIMESTAMPING_RX_HARDWARE |
+                                   SOF_TIMESTAMPING_RAW_HARDWARE |
+                                   SOF_TIMESTAMPING_RX_SOFTWARE |
+                                   SOF_TIMESTAMPING_SOFTWARE)
+
     def stop(self):
         pass
 
+    def fileno(self):
+        return self.socket.fileno()
+
+    def _software_timestamp(self):
+        return time.monotonic() - self.started_at
+
+    def _kernel_timestamp(self, ancdata):
+        # returns the timestamp carried by the control messages, or the
+        # software timestamp if there is none
+        if time.monotonic() >= self._next_sync:
+            self._sync_clocks()
+        for level, cmsg_type, data in ancdata:
+            if level != socket.SOL_SOCKET:
+                continue
+            if cmsg_type == SO_TIMESTAMPNS:
+                sec, nsec = _timespec.unpack_from(data)
+                return sec - self._kernel_base + nsec * 1e-9
+            if cmsg_type == SO_TIMESTAMPING:
+                (sw_sec, sw_nsec, _, _, hw_sec,
+                 hw_nsec) = _scm_timestamping.unpack_from(data)
+                software = sw_sec - self._kernel_base + sw_nsec * 1e-9
+                if not hw_sec and not hw_nsec:
+                    return software
+                # the controller clock has its own epoch, align it with the
+                # kernel clock on the first frame
+                hardware = hw_sec + hw_nsec * 1e-9
+                if self._hardware_base is None:
+                    self._hardware_base = hardware - software
+                return hardware - self._hardware_base
+        return self._software_timestamp()
+
     def recv(self):
         assert self.running, 'device not running'
-        frame_format = "=IB3xBBBBBBBB"
-        frame_size = struct.calcsize(frame_format)
 
-        frame_raw = self.socket.recv(frame_size)
-        arb_id, dlc, d0, d1, d2, d3, d4, d5, d6, d7 = (
-            struct.unpack(frame_format, frame_raw))
+        if self.timestamping:
+            frame_raw, ancdata, _, _ = self.socket.recvmsg(self._mtu,
+                                                           _CONTROL_SIZE)
+            timestamp = self._kernel_timestamp(ancdata)
+        else:
+            frame_raw = self.socket.recv(self._mtu)
+            timestamp = self._software_timestamp()
+
+        return can.Frame.from_raw(*_decode_frame(frame_raw),
+                                  timestamp=timestamp)
+
+    def recv_batch(self, max_frames=64, timeout=None):
+        """ Receive up to max_frames frames that are queued on the socket
+
+        Waits up to timeout seconds (forever if None) for the first frame,
+        then collects the frames already queued by the kernel, with a single
+        recvmmsg call where available. Returns a FrameBatch, which is empty
+        if the timeout expired.
+        """
+        assert self.running, 'device not running'
+        batch = FrameBatch()
+
+        if timeout is not None:
+            readable, _, _ = select.select([self.socket], [], [], timeout)
+            if not readable:
+                return batch
+
+        control_size = _CONTROL_SIZE if self.timestamping else 0
+        mtu = self._mtu
+        buf = self._recv_buffer
+        if (buf is None or buf.slots < max_frames or
+                buf.control_size != control_size):
+            buf = self._recv_buffer = _RecvBuffer(max_frames, mtu,
+                                                  control_size)
+
+        if _recvmmsg is not None:
+            buf.reset_control(max_frames)
+            # block for the first frame unless we already know one is queued
+            flags = socket.MSG_DONTWAIT if timeout is not None else 0
+            count = _recvmmsg(self.socket.fileno(), buf.msgs, max_frames,
+                              flags | MSG_WAITFORONE, None)
+            if count < 0:
+                err = ctypes.get_errno()
+                if err != errno.EAGAIN:
+                    raise OSError(err, os.strerror(err))
+                count = 0
+            lengths = [buf.msgs[i].msg_len for i in range(count)]
+            if self.timestamping:
+                timestamps = [self._kernel_timestamp(buf.control_messages(i))
+                              for i in range(count)]
+        else:
+            view = memoryview(buf.buffer)
+            count = 0
+            lengths = []
+            timestamps = []
+            flags = socket.MSG_DONTWAIT if timeout is not None else 0
+            while count < max_frames:
+                try:
+                    length, ancdata, _, _ = self.socket.recvmsg_into(
+                        [view[count * mtu:(count + 1) * mtu]],
+                        control_size, flags)
+                except BlockingIOError:
+                    break
+                lengths.append(length)
+                if self.timestamping:
+                    timestamps.append(self._kernel_timestamp(ancdata))
+                count += 1
+                flags = socket.MSG_DONTWAIT
+
+        if not self.timestamping:
+            # frames queued together share the time they were read at
+            timestamps = [self._software_timestamp()] * count
+
+        view = memoryview(buf.buffer)
+        if not self.fd:
+            # every slot holds a classic can_frame, unpack them in one pass
+            for (raw_id, dlc, data), timestamp in zip(
+                    _can_frame.iter_unpack(view[:count * mtu]), timestamps):
+                arb_id, frame_flags = _split_id(raw_id)
+                batch.append_raw(arb_id, data[:dlc], frame_flags, timestamp)
+        else:
+            for i in range(count):
+                batch.append_raw(*_decode_frame(
+                    view[i * mtu:i * mtu + lengths[i]]),
+                    timestamp=timestamps[i])
+        return batch
+
+    def set_filters(self, filters):
+        """ Set the acceptance filters applied by the kernel
 
-        # adjust the id and set the extended id flag
-        is_extended = False
-        if arb_id & 0x80000000:
-            arb_id &= 0x7FFFFFFF
-            is_extended = True
+        filters is a list of (arb_id, mask) tuples. A frame is received if
+        frame_id & mask == arb_id & mask for any of them. None (or a single
+        filter with a mask of 0) receives every frame, an empty list
+        receives none.
+        """
+        if filters is None:
+            filters = [(0, 0)]
+        packed = b''.join(_can_filter.pack(arb_id, mask)
+                          for arb_id, mask in filters)
+        self.socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER,
+                               packed)
 
-        frame = can.Frame(arb_id, extended=is_extended)
-        # select the data bytes up to the DLC value
-        frame.data = [d0, d1, d2, d3, d4, d5, d6, d7][0:dlc]
-        frame.timestamp = time.time() - self.start_time
+    def set_error_filter(self, mask):
+        """ Select the error frame classes to receive, as a CAN_ERR_* mask.
+        Error frames are not received by default, socket.CAN_ERR_MASK
+        receives all of them. """
+        self.socket.setsockopt(socket.SOL_CAN_RAW, CAN_RAW_ERR_FILTER,
+                               struct.pack("=I", mask))
 
-        return frame
+    def set_filter_id(self, filter_id):
+        # single id/mask filter, same interface as CantactDev
+        self._filter_id = filter_id
+        self.set_filters([(self._filter_id, self._filter_mask)])
+
+    def set_filter_mask(self, filter_mask):
+        self._filter_mask = filter_mask
+        self.set_filters([(self._filter_id, self._filter_mask)])
+
+    def add_filter(self, arb_id, mask):
+        """ Add an (arb_id, mask) filter shared with the other users of the
+        device. The kernel receives the frames of any filter added and not
+        removed, or every frame while there are none. """
+        self._shared_filters[(arb_id, mask)] += 1
+        self._push_shared_filters()
+
+    def remove_filter(self, arb_id, mask):
+        """ Remove a filter added with add_filter, the other users keep
+        theirs """
+        key = (arb_id, mask)
+        if not self._shared_filters[key]:
+            raise ValueError('no filter %#x/%#x was added' % key)
+        self._shared_filters[key] -= 1
+        if not self._shared_filters[key]:
+            del self._shared_filters[key]
+        self._push_shared_filters()
+
+    def _push_shared_filters(self):
+        self.set_filters(sorted(self._shared_filters) or None)
 
     def send(self, frame):
         assert self.running, 'device not running'
-        frame_format = "=IBBBBBBBBBBBB"
-
-        # set the extended bit if a extended id is used
-        arb_id = frame.arb_id
-        if frame.is_extended_id:
-            arb_id |= 0x80000000
-
-        # get data, padded to 8 bytes
-        data = frame.data + [0] * (8 - len(frame.data))
-        packet = struct.pack(frame_format, arb_id, frame.dlc, 0xff, 0xff, 0xff,
-                             data[0], data[1], data[2], data[3],
-                             data[4], data[5], data[6], data[7])
-        self.socket.send(packet)
+        self.socket.send(_encode_frame(frame))
+
+    def send_batch(self, frames):
+        """ Send several frames, in order, with a single sendmmsg call where
+        available """
+        assert self.running, 'device not running'
+        raw_frames = [_encode_frame(frame) for frame in frames]
+        if _sendmmsg is None:
+            for frame_raw in raw_frames:
+                self.socket.send(frame_raw)
+            return
+
+        count = len(raw_frames)
+        if not count:
+            return
+        buffer = ctypes.create_string_buffer(b''.join(raw_frames))
+        base = ctypes.addressof(buffer)
+        iovecs = (_iovec * count)()
+        msgs = (_mmsghdr * count)()
+        offset = 0
+        for i, frame_raw in enumerate(raw_frames):
+            iovecs[i].iov_base = base + offset
+            iovecs[i].iov_len = len(frame_raw)
+            msgs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+            msgs[i].msg_hdr.msg_iovlen = 1
+            offset += len(frame_raw)
+
+        # sendmmsg may stop early, e.g. when the socket buffer fills up,
+        # carry on from the first message it did not send
+        sent = 0
+        while sent < count:
+            result = _sendmmsg(self.socket.fileno(),
+                               ctypes.pointer(msgs[sent]), count - sent, 0)
+            if result < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, os.strerror(err))
+            sent += result
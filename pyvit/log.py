@@ -1,50 +1,227 @@
-from . import can
+import os
+import queue
+import threading
 import time
 
+from . import can
+from .batch import FrameBatch
+from .file import compression
+from .file.log.candump import _fields_to_line
+
 
 class Logger:
-    def __init__(self, filename, if_name='can0'):
+    """ Writes frames to a candump log
+
+    Frames are formatted by the calling thread and collected until
+    BUFFER_SIZE bytes are pending, or FLUSH_INTERVAL seconds passed. The
+    collected lines are then written as one block by a writer thread, so
+    logging never waits for the disk unless MAX_PENDING blocks are already
+    queued.
+
+    Frames are logged with their own timestamp, or the time since start if
+    they have none, and with their own interface, or if_name.
+
+    The log is rotated before a block would take it past max_bytes, or
+    before the first block written after it has been open for max_seconds.
+    A rotated log is renamed with a number before the extension, counting
+    up from 1: tmp.log becomes tmp.1.log, tmp.2.log and so on, and logging
+    carries on in a new tmp.log.
+
+    The log is compressed with codec, or the codec of its extension, by the
+    writer thread. level and threads are passed to
+    compression.open_file. max_bytes counts the bytes of text logged, not
+    those written to a compressed log.
+    """
+
+    # bytes of formatted lines collected before they are written
+    BUFFER_SIZE = 256 * 1024
+    # seconds collected lines wait at most before they are written
+    FLUSH_INTERVAL = 0.5
+    # blocks waiting for the writer thread before logging blocks
+    MAX_PENDING = 16
+
+    def __init__(self, filename, if_name='can0', max_bytes=None,
+                 max_seconds=None, codec=None, level=None, threads=None):
         self.if_name = if_name
         self.filename = filename
+        self.codec = compression.codec_for(filename, codec)
+        self.level = level
+        self.threads = threads
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
         self.started = False
+        self.rotated = []
 
     def start(self):
         self.start_timestamp = time.time()
+        self._lines = []
+        self._size = 0
+        self._lock = threading.Lock()
+        # held by the writer thread while it writes lines that were not
+        # queued as a block, so flush can wait for them
+        self._writing = threading.Lock()
+        self._blocks = queue.Queue(self.MAX_PENDING)
+        self._error = None
+        self._file = self._open()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
         self.started = True
-        self._file = open(self.filename, 'w')
+        self._writer.start()
 
     def __enter__(self):
         self.start()
         return self
 
     def stop(self):
+        if not self.started:
+            return
+        self._hand_over()
         self.started = False
+        self._blocks.put(None)
+        self._writer.join()
         self._file.close()
+        self._raise_error()
 
     def __exit__(self, exception_type, exception_value, traceback):
         self.stop()
 
     def log_frame(self, frame):
         assert isinstance(frame, can.Frame), 'invalid frame'
+        self._log([self._format(frame.arb_id, frame.payload, frame.flags,
+                                frame.timestamp, frame.interface)])
+
+    def log_batch(self, frames):
+        """ Log a FrameBatch, or any iterable of frames, in order """
+        if isinstance(frames, FrameBatch):
+            # format straight from the columns, without building frames
+            lines = []
+            timestamps = frames.timestamps
+            arb_ids = frames.arb_ids
+            flags = frames.flags
+            interfaces = frames.interfaces
+            names = frames.interface_names
+            for i in range(len(frames)):
+                timestamp = timestamps[i]
+                lines.append(self._format(
+                    arb_ids[i], frames.payload(i), flags[i],
+                    None if timestamp != timestamp else timestamp,
+                    names[interfaces[i]]))
+        else:
+            lines = [self._format(f.arb_id, f.payload, f.flags, f.timestamp,
+                                  f.interface) for f in frames]
+        self._log(lines)
+
+    def _format(self, arb_id, payload, flags, timestamp, interface):
+        if timestamp is None:
+            timestamp = time.time() - self.start_timestamp
+        return _fields_to_line(arb_id, payload, flags, timestamp,
+                               interface or self.if_name)
 
+    def _check_started(self):
         if not self.started:
             raise Exception('logger not started')
 
-        ts = time.time() - self.start_timestamp
-
-        line = ("(%f) %s %03X#%02X%02X%02X%02X%02X%02X%02X%02X\n" %
-                (ts,
-                 self.if_name,
-                 frame.arb_id,
-                 frame.data[0],
-                 frame.data[1],
-                 frame.data[2],
-                 frame.data[3],
-                 frame.data[4],
-                 frame.data[5],
-                 frame.data[6],
-                 frame.data[7]))
-        self._file.write(line)
+    def _log(self, lines):
+        self._check_started()
+        self._raise_error()
+
+        with self._lock:
+            self._lines.extend(lines)
+            self._size += sum(map(len, lines))
+            full = self._size >= self.BUFFER_SIZE
+        if full:
+            self._hand_over()
+
+    def _hand_over(self):
+        # pass the collected lines to the writer thread as one block. The
+        # block is queued under the lock, so blocks stay in logging order.
+        with self._lock:
+            if self._lines:
+                self._blocks.put(self._take_block())
+
+    def _take_block(self):
+        block = ''.join(self._lines).encode()
+        self._lines = []
+        self._size = 0
+        return block
+
+    def flush(self):
+        """ Write out every frame logged so far """
+        self._check_started()
+        self._hand_over()
+        self._blocks.join()
+        with self._writing:
+            pass
+        self._raise_error()
 
     def clear(self):
-        self._buffer = []
+        """ Drop the frames logged since the last block was written """
+        self._check_started()
+        with self._lock:
+            self._lines = []
+            self._size = 0
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _open(self):
+        self._opened = time.monotonic()
+        self._written = 0
+        return compression.open_file(self.filename, 'wb', self.codec,
+                                     self.level, self.threads)
+
+    def _rotated_name(self, number):
+        root, ext = compression.split_extension(self.filename)
+        return '%s.%d%s' % (root, number, ext)
+
+    def _rotate(self):
+        self._file.close()
+        name = self._rotated_name(len(self.rotated) + 1)
+        os.replace(self.filename, name)
+        self.rotated.append(name)
+        self._file = self._open()
+
+    def _due_rotation(self, size):
+        if not self._written:
+            return False
+        if (self.max_bytes is not None and
+                self._written + size > self.max_bytes):
+            return True
+        return (self.max_seconds is not None and
+                time.monotonic() - self._opened >= self.max_seconds)
+
+    def _write_loop(self):
+        while True:
+            try:
+                block = self._blocks.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                # nothing filled a block in time, write what there is unless
+                # a block was queued meanwhile. Logging carries on while the
+                # block is written.
+                with self._writing:
+                    with self._lock:
+                        block = None
+                        if self._lines and self._blocks.empty():
+                            block = self._take_block()
+                    if block is not None:
+                        self._write(block)
+                continue
+            if block is None:
+                self._blocks.task_done()
+                return
+            self._write(block)
+            self._blocks.task_done()
+
+    def _write(self, block):
+        try:
+            if self._due_rotation(len(block)):
+                self._rotate()
+            self._file.write(block)
+            self._written += len(block)
+            if self._blocks.empty():
+                # caught up, make what was logged readable
+                self._file.flush()
+        except OSError as e:
+            # raised to the next caller instead of ending the thread
+            self._error = e
@@ -1,21 +1,39 @@
+import asyncio
 import time
-from multiprocessing import Queue
 from queue import Empty
 
 from .. import can
 
 
+class _GetFrame:
+    """ Yielded by the IsotpInterface step generators for the next received
+    frame, waiting up to timeout seconds. The frame is sent back, or Empty
+    is thrown in if none came. """
+    __slots__ = ('timeout', )
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+
 class IsotpInterface:
     debug = False
+    # set once the receive queue is registered with the dispatcher
+    _subscribed = False
+    # most consecutive frames passed to the dispatcher in one send_batch
+    max_burst = 64
+    # (arb_id, mask) filter this session added to a device with add_filter
+    _filter = None
 
     # From standard 15765-3 default padding value should be 0x55
-    def __init__(self, dispatcher, tx_arb_id, rx_arb_id = False, padding=0x55, extended_id=False, rx_filter_func=False):
+    # tx_dl is the CAN frame data length used to transmit, 8 for classic CAN, one of the CAN FD lengths above 8 for CAN FD
+    def __init__(self, dispatcher, tx_arb_id, rx_arb_id = False, padding=0x55, extended_id=False, rx_filter_func=False,
+                 tx_dl=8, bitrate_switch=True):
 
         self._dispatcher = dispatcher
         self.tx_arb_id = tx_arb_id
         self.rx_arb_id = rx_arb_id
         self.padding_value = padding
-        self._recv_queue = Queue()
+        self._recv_queue = dispatcher.create_queue()
         self.block_size_counter = 0
         self.extended_id = extended_id
         self.rx_filter_func = rx_filter_func
@@ -25,11 +43,45 @@ class IsotpInterface:
         # depending of the addressing type the data len limit for using a single frame may change, in most cases is 7
         self.sf_data_len_limit = 7
 
-        self._dispatcher.add_receiver(self._recv_queue)
+        if tx_dl not in can.FD_LENGTHS or tx_dl < 8:
+            raise ValueError('tx_dl must be 8 or a CAN FD data length')
+        self.tx_dl = tx_dl
+        self.bitrate_switch = bitrate_switch
+
+        # only frames on rx_arb_id reach our queue, the rest of
+        # filter_received_frame is applied as they are read
+        self._dispatcher.add_receiver(self._recv_queue,
+                                      arb_ids=self._subscribed_arb_ids())
+        self._subscribed = True
+
+    @property
+    def rx_arb_id(self):
+        return self.__rx_arb_id
+
+    @rx_arb_id.setter
+    def rx_arb_id(self, value):
+        self.__rx_arb_id = value
+        if self._subscribed:
+            self._dispatcher.update_receiver(self._recv_queue,
+                                             arb_ids=self._subscribed_arb_ids())
+
+    def _subscribed_arb_ids(self):
+        # without a rx_arb_id every frame is a candidate
+        if self.rx_arb_id:
+            return (self.rx_arb_id, )
+        return None
 
     def _pad_data(self, data):
-        # pad data to 8 bytes
-        return data + ([self.padding_value] * (8 - len(data)))
+        # pad data to 8 bytes, or to the next valid CAN FD length
+        length = max(can.fd_length(len(data)), 8)
+        return data + ([self.padding_value] * (length - len(data)))
+
+    def _new_frame(self, data, is_extended_id=None):
+        # frames longer than 8 bytes can only be sent as CAN FD
+        if is_extended_id is None:
+            is_extended_id = self.extended_id
+        return can.Frame(self.tx_arb_id, data=self._pad_data(data), extended=is_extended_id,
+                         fd=self.tx_dl > 8, bitrate_switch=self.tx_dl > 8 and self.bitrate_switch)
 
     def _start_msg(self, arb_id=0):
         # initialize reading of a message
@@ -46,19 +98,37 @@ class IsotpInterface:
         return tmp
 
     def set_filter(self,arb_id, mask):
-        if (hasattr(self._dispatcher._device, "set_filter_id") and
-                hasattr(self._dispatcher._device, "set_filter_mask")):
-            self._dispatcher._device.set_filter_id(arb_id)
-            self._dispatcher._device.set_filter_mask(mask)
+        device = self._dispatcher._device
+        if hasattr(device, "add_filter"):
+            # the device is shared with other sessions, replace only our own
+            # filter
+            if self._filter == (arb_id, mask):
+                return
+            self.unset_filter()
+            device.add_filter(arb_id, mask)
+            self._filter = (arb_id, mask)
+        elif (hasattr(device, "set_filter_id") and
+                hasattr(device, "set_filter_mask")):
+            device.set_filter_id(arb_id)
+            device.set_filter_mask(mask)
 
     def unset_filter(self):
-        if (hasattr(self._dispatcher._device, "set_filter_id") and
-                hasattr(self._dispatcher._device, "set_filter_mask")):
-            self._dispatcher._device.set_filter_mask(0)
+        device = self._dispatcher._device
+        if hasattr(device, "add_filter"):
+            if self._filter is not None:
+                device.remove_filter(*self._filter)
+                self._filter = None
+        elif (hasattr(device, "set_filter_id") and
+                hasattr(device, "set_filter_mask")):
+            device.set_filter_mask(0)
 
     def _set_filter(self):
         if (self.rx_arb_id):
-            self.set_filter(self.rx_arb_id, 0xFFF)
+            # match every bit of the id, extended ids have 29 of them
+            if self.rx_arb_id > 0x7FF:
+                self.set_filter(self.rx_arb_id, 0x1FFFFFFF)
+            else:
+                self.set_filter(self.rx_arb_id, 0xFFF)
 
     def _unset_filter(self):
         self.unset_filter()
@@ -82,15 +152,25 @@ class IsotpInterface:
 
             # data length is lower nybble for first byte
             sf_dl = frame.data[0] & 0xF
+            data_offset = 1
+
+            # frames longer than a classic CAN frame (less the addressing byte) are CAN FD
+            if sf_dl == 0 and len(frame.data) > self.sf_data_len_limit + 1:
+                # CAN FD escape sequence, data length is the second byte
+                sf_dl = frame.data[1]
+                data_offset = 2
+                sf_data_len_limit = len(frame.data) - 2
+            else:
+                sf_data_len_limit = self.sf_data_len_limit
 
             # check that the data length is valid for a SF, the max length can change depending on addressing type
-            if not (sf_dl > 0 and sf_dl <= self.sf_data_len_limit):
+            if not (sf_dl > 0 and sf_dl <= sf_data_len_limit):
                 raise ValueError('invalid SF_DL parameter for single frame %s', frame)
 
             self.data_len = sf_dl
 
             # get data bytes from this frame
-            self.data = frame.data[1:sf_dl+1]
+            self.data = frame.data[data_offset:sf_dl+data_offset]
 
             # single frame, we're done!
             return self._end_msg()
@@ -102,11 +182,17 @@ class IsotpInterface:
 
             # data length is lower nybble of byte 0 and byte 1
             ff_dl = ((frame.data[0] & 0xF) << 8) + frame.data[1]
+            data_offset = 2
+
+            if ff_dl == 0:
+                # escape sequence, data length is a 32 bit value in bytes 2 to 5
+                ff_dl = int.from_bytes(bytes(frame.data[2:6]), 'big')
+                data_offset = 6
 
             self.data_len = ff_dl
 
             # retrieve data bytes from first frame
-            for i in range(2, min(ff_dl+2, 8)):
+            for i in range(data_offset, min(ff_dl+data_offset, len(frame.data))):
                 self.data.append(frame.data[i])
                 self.data_byte_count = self.data_byte_count + 1
 
@@ -132,7 +218,7 @@ class IsotpInterface:
             bytes_remaining = self.data_len - self.data_byte_count
 
             # grab data bytes from this message
-            for i in range(1, min(bytes_remaining, 7) + 1):
+            for i in range(1, min(bytes_remaining, len(frame.data) - 1) + 1):
                 self.data.append(frame.data[i])
                 self.data_byte_count = self.data_byte_count + 1
 
@@ -160,10 +246,8 @@ class IsotpInterface:
                 # need to send flow control
                 self._send_control_frame(frame.is_extended_id)
 
-    def recv(self, timeout=1, bs=0, st_min=0):
+    def _start_recv(self, bs, st_min):
         self.last_arb_id = None
-        data = None
-        start = time.time()
 
         self._set_filter()
 
@@ -174,10 +258,28 @@ class IsotpInterface:
                 "st_min must be beween 0x00 and 0x7F or 0xF1 and 0xF9")
         self.st_min = st_min
 
+    def _accept_frame(self, rx_frame):
+        # returns the message once rx_frame completes it
+        if self.filter_received_frame(rx_frame):
+            if self.debug:
+                print("ISOTP RECV: %s" % rx_frame)
+            return self.parse_frame(rx_frame)
+        return None
+
+    def _recv_steps(self, timeout, bs, st_min):
+        """
+        Receives a message, as a generator so that recv and recv_async share it, see _drive. Returns the message, or
+        None on timeout
+        """
+        data = None
+        start = time.time()
+
+        self._start_recv(bs, st_min)
+
         while data is None:
             # attempt to get data, returning None if we timeout
             try:
-                rx_frame = self._recv_queue.get(timeout=timeout)
+                rx_frame = yield _GetFrame(timeout)
             except Empty:
                 if self.debug:
                     print ('timeout NO FRAME')
@@ -186,10 +288,7 @@ class IsotpInterface:
             if rx_frame is None:
                 return None
 
-            if self.filter_received_frame(rx_frame):
-                if self.debug:
-                    print("ISOTP RECV: %s" % rx_frame)
-                data = self.parse_frame(rx_frame)
+            data = self._accept_frame(rx_frame)
             # check timeout, since we may be receiving messages that do not
             # pass the receiving filter criterion
             if time.time() - start > timeout:
@@ -200,22 +299,125 @@ class IsotpInterface:
         self._unset_filter()
         return data
 
+    def recv(self, timeout=1, bs=0, st_min=0):
+        return self._drive(self._recv_steps(timeout, bs, st_min))
+
+    async def recv_async(self, timeout=1, bs=0, st_min=0):
+        """ recv for use with an AsyncDispatcher """
+        return await self._drive_async(self._recv_steps(timeout, bs, st_min))
+
     def send(self, data):
-        if len(data) > 4095:
+        self._drive(self._send_steps(data))
+
+    async def send_async(self, data):
+        """ send for use with an AsyncDispatcher """
+        await self._drive_async(self._send_steps(data))
+
+    def _drive(self, steps):
+        # runs a step generator, getting frames from the receive queue and
+        # sleeping as it asks, and returns what it returns
+        reply = None
+        error = None
+        while True:
+            try:
+                if error is None:
+                    request = steps.send(reply)
+                else:
+                    request = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            reply = error = None
+            if isinstance(request, _GetFrame):
+                try:
+                    reply = self._recv_queue.get(timeout=request.timeout)
+                except Empty as e:
+                    error = e
+            else:
+                time.sleep(request)
+
+    async def _drive_async(self, steps):
+        # _drive for use with an AsyncDispatcher
+        reply = None
+        error = None
+        while True:
+            try:
+                if error is None:
+                    request = steps.send(reply)
+                else:
+                    request = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            reply = error = None
+            if isinstance(request, _GetFrame):
+                try:
+                    reply = await self._recv_queue.get(
+                        timeout=request.timeout)
+                except Empty as e:
+                    error = e
+            else:
+                await asyncio.sleep(request)
+
+    def _flow_control(self, rx_frame):
+        # returns (block size, separation time) if rx_frame is our flow control frame
+        if (self.filter_received_frame(rx_frame) and
+                rx_frame.data[0] == 0x30):
+            if self.debug:
+                print(rx_frame)
+            return rx_frame.data[1], rx_frame.data[2]
+        return None
+
+    def _flow_control_steps(self):
+        # waits for a flow control frame and returns its (block size, separation time), see _drive
+        # Just in case, theoretically, since we've already started comunicating, we should never go timeout
+        timeout = 10
+        start = time.time()
+
+        while True:
+            try:
+                rx_frame = yield _GetFrame(timeout)
+            except Empty:
+                if self.debug:
+                    print('timeout NO FRAME waiting CONTROL frame')
+                raise TimeoutError("No control frame received")
+
+            flow_control = self._flow_control(rx_frame)
+            if flow_control is not None:
+                return flow_control
+            # check timeout, since we may be receiving messages that are not control frame
+            if time.time() - start > timeout:
+                if self.debug:
+                    print('timeout ISOTP waiting CONTROL frame')
+                raise TimeoutError("No control frame received")
+
+    def _send_steps(self, data):
+        """
+        Sends data, as a generator so that send and send_async share it, see _drive. It yields a _GetFrame while it
+        waits for a flow control frame, or a number of seconds to wait before the next frame
+        """
+        # lengths above 4095 bytes need the FF escape sequence, only used with CAN FD
+        if self.tx_dl == 8 and len(data) > 4095:
             raise ValueError('ISOTP data must be <= 4095 bytes long')
+        elif len(data) > 0xFFFFFFFF:
+            raise ValueError('ISOTP data must be <= 4294967295 bytes long')
 
         self._set_filter()
 
-        if len(data) <= self.sf_data_len_limit:
-            # message is less than sf_data_len_limit bytes, use single frame
+        # room for data in a frame, after the addressing bytes
+        frame_space = self.tx_dl - len(self.get_base_frame_data())
 
-            sf = can.Frame(self.tx_arb_id, extended = self.extended_id)
+        if len(data) <= self.sf_data_len_limit or len(data) <= frame_space - 2:
+            # message fits in a single frame
 
             frame_data = self.get_base_frame_data()
-            # first byte is data length, remainder is data
-            frame_data.append(len(data))
+            if len(data) <= self.sf_data_len_limit:
+                # first byte is data length, remainder is data
+                frame_data.append(len(data))
+            else:
+                # CAN FD escape sequence, first byte is 0 and second byte is data length
+                frame_data.append(0)
+                frame_data.append(len(data))
             frame_data = frame_data + data
-            sf.data = self._pad_data(frame_data)
+            sf = self._new_frame(frame_data)
 
             if self.debug:
                 print("ISOTP SEND: %s " % sf)
@@ -225,80 +427,70 @@ class IsotpInterface:
             # message must be composed of FF and CF
 
             # first frame
-            ff = can.Frame(self.tx_arb_id, extended = self.extended_id)
-
             frame_data = self.get_base_frame_data()
-            # FF pci type and msb of length
-            frame_data.append(0x10 + (len(data) >> 8))
-            # lower byte of data
-            frame_data.append(len(data) & 0xFF)
-            # first 6 bytes of data
-            frame_data = frame_data + data[0:6]
-
-            ff.data = self._pad_data(frame_data)
+            if len(data) <= 4095:
+                # FF pci type and msb of length
+                frame_data.append(0x10 + (len(data) >> 8))
+                # lower byte of data
+                frame_data.append(len(data) & 0xFF)
+                ff_data_len = frame_space - 2
+            else:
+                # escape sequence, 0 length followed by 32 bit length
+                frame_data = frame_data + [0x10, 0x00] + list(len(data).to_bytes(4, 'big'))
+                ff_data_len = frame_space - 6
+            # fill the rest of the frame with data
+            frame_data = frame_data + data[0:ff_data_len]
+
+            ff = self._new_frame(frame_data)
             if self.debug:
                 print("ISOTP SEND: %s " % ff)
             self._dispatcher.send(ff)
 
-            bytes_sent = 6
+            bytes_sent = ff_data_len
             sequence_number = 1
 
             # force to wait for a flow control frame
             fc_bs = 1
 
+            # consecutive frames without a separation time are sent a block at a time
+            burst = []
+
             while bytes_sent < len(data):
                 if fc_bs > 0:
                     fc_bs -= 1
                     if fc_bs == 0:
+                        # the receiver answers once it has the whole block
+                        self._send_burst(burst)
                         # must wait for a flow control frame
-                        # Just in case, theoretically, since we've already started comunicating, we should never go timeout
-                        timeout = 10
-                        start = time.time()
-
-                        while True:
-                            try:
-                                rx_frame = self._recv_queue.get(timeout=timeout)
-                            except Empty:
-                                if self.debug:
-                                    print('timeout NO FRAME waiting CONTROL frame')
-                                raise TimeoutError("No control frame received")
-
-                            if (self.filter_received_frame(rx_frame) and
-                                    rx_frame.data[0] == 0x30):
-                                if self.debug:
-                                    print(rx_frame)
-                                # flow control frame received, get parameters
-                                fc_bs = rx_frame.data[1]
-                                fc_stmin = rx_frame.data[2]
-                                break
-                            # check timeout, since we may be receiving messages that are not control frame
-                            if time.time() - start > timeout:
-                                if self.debug:
-                                    print('timeout ISOTP waiting CONTROL frame')
-                                raise TimeoutError("No control frame received")
+                        fc_bs, fc_stmin = yield from self._flow_control_steps()
 
                 # wait for fc_stmin ms/us
+                time_to_wait = 0
                 if fc_stmin < 0x80:
                     # fc_stmin equal to ms to wait
                     time_to_wait = fc_stmin/1000.0
-                    time.sleep(time_to_wait)
                 elif fc_stmin >= 0xF1 and fc_stmin <= 0xF9:
                     # fc_stmin equal to 100 - 900 us to wait
                     time_to_wait = (fc_stmin-0xF0)/1000000.0
-                    time.sleep(time_to_wait)
+                if time_to_wait:
+                    yield time_to_wait
 
-                cf = can.Frame(self.tx_arb_id, extended = self.extended_id)
-                data_bytes_in_msg = min(len(data) - bytes_sent, self.sf_data_len_limit)
+                data_bytes_in_msg = min(len(data) - bytes_sent, frame_space - 1)
 
                 frame_data = self.get_base_frame_data()
                 frame_data.append(0x20 + sequence_number)
                 frame_data = (frame_data +
                               data[bytes_sent:bytes_sent+data_bytes_in_msg])
-                cf.data = self._pad_data(frame_data)
+                cf = self._new_frame(frame_data)
 
                 if self.debug:
                     print("ISOTP SEND: %s " % cf)
-                self._dispatcher.send(cf)
+                if time_to_wait == 0 and hasattr(self._dispatcher, 'send_batch'):
+                    burst.append(cf)
+                    if len(burst) >= self.max_burst:
+                        self._send_burst(burst)
+                else:
+                    self._dispatcher.send(cf)
 
                 sequence_number = sequence_number + 1
                 # wrap around when sequence number reaches 0xF
@@ -307,12 +499,19 @@ class IsotpInterface:
 
                 bytes_sent = bytes_sent + data_bytes_in_msg
 
+            self._send_burst(burst)
+
         self._unset_filter()
 
+    def _send_burst(self, burst):
+        # send the consecutive frames collected so far with one dispatcher call
+        if burst:
+            self._dispatcher.send_batch(burst)
+            del burst[:]
+
     def _send_control_frame(self, is_extended_id):
         data = [0x30, self.block_size, self.st_min]
-        fc = can.Frame(self.tx_arb_id, data=self._pad_data(data),
-                       extended=is_extended_id)
+        fc = self._new_frame(data, is_extended_id)
         if self.debug:
             print("ISOTP Control Frame: %s" % fc)
         self._dispatcher.send(fc)
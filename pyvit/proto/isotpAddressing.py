@@ -2,6 +2,7 @@
 Details on how addressing works for ISOTP can be seen in ISO 15765-2
 """
 
+from pyvit import can
 from pyvit.proto.isotp import IsotpInterface
 from abc import ABC, abstractmethod
 from enum import Enum
@@ -123,7 +124,8 @@ class IsotpMixedAddressing (IsotpAddressing):
 
     def parse_frame(self, frame):
         # In case of mixed addressing first byte of data is the remote address
-        frame.data.pop(0)
+        # the frame may be shared with other receivers, so it is not modified
+        frame = can.Frame.from_raw(frame.arb_id, frame.payload[1:], frame.flags, frame.timestamp, frame.interface)
         return super(IsotpMixedAddressing, self).parse_frame(frame)
 
     def get_base_frame_data(self):
@@ -148,7 +150,8 @@ class IsotpExtendedAddressing (IsotpAddressing):
 
     def parse_frame(self, frame):
         # In case of extended addressing first byte of data is the target address
-        frame.data.pop(0)
+        # the frame may be shared with other receivers, so it is not modified
+        frame = can.Frame.from_raw(frame.arb_id, frame.payload[1:], frame.flags, frame.timestamp, frame.interface)
         return super(IsotpExtendedAddressing, self).parse_frame(frame)
 
     def get_base_frame_data(self):
@@ -1461,6 +1461,20 @@ class UDSInterface:
         else:
             raise Exception("Unknown N_TAtype")
 
+    async def request_async(self, service, timeout=0.5):
+        """ request for use with an AsyncDispatcher """
+        await self.transport_layer.send_async(service.encode())
+        if self.transport_layer.N_TAtype == N_TAtype.physical:
+            try:
+                return await self.decode_response_async(timeout=timeout)
+            except ResponsePendingException as e:
+                # If I get a response pending exception means that I have a new timeout to consider
+                return await self.decode_response_async(timeout=e.timeout)
+        elif self.transport_layer.N_TAtype == N_TAtype.functional:
+            return await self.decode_responses_async(timeout)
+        else:
+            raise Exception("Unknown N_TAtype")
+
     def response(self, service):
         self.transport_layer.send(service.encode())
 
@@ -1479,6 +1493,13 @@ class UDSInterface:
 
     def decode_response(self, timeout=0.5):
         data = self.transport_layer.recv(timeout=timeout)
+        return self._decode_response_data(data)
+
+    async def decode_response_async(self, timeout=0.5):
+        data = await self.transport_layer.recv_async(timeout=timeout)
+        return self._decode_response_data(data)
+
+    def _decode_response_data(self, data):
         if data is None:
             return None
 
@@ -1499,12 +1520,35 @@ class UDSInterface:
         :param functional_timeout:
         :return:
         """
-
+        steps = self._responses_steps()
+        try:
+            next(steps)
+            while True:
+                steps.send(self.transport_layer.recv(timeout=timeout))
+        except StopIteration as stop:
+            return stop.value
+
+    async def decode_responses_async(self, timeout):
+        """ decode_responses for use with an AsyncDispatcher """
+        steps = self._responses_steps()
+        try:
+            next(steps)
+            while True:
+                steps.send(await self.transport_layer.recv_async(
+                    timeout=timeout))
+        except StopIteration as stop:
+            return stop.value
+
+    def _responses_steps(self):
+        # collects the responses of decode_responses, as a generator so that the sync and async versions share it.
+        # It is sent the data of each message received, or None
         resps = {}
         start = time.time()
         while time.time() - start <= self.functional_timeout:
+            data = yield
+            resp = None
             try:
-                resp = self.decode_response(timeout)
+                resp = self._decode_response_data(data)
             except ResponsePendingException as e:
                 # If I get a response pending exception means that I have a new timeout to consider
                 self.functional_timeout = e.timeout
@@ -7,50 +7,52 @@ except ImportError:
 
 import time
 
+from ..dispatch import Dispatcher
+
 
 class CanQueue:
+    """ Sends and receives the frames of a device from worker processes
+
+    The workers belong to a Dispatcher with recv_queue as its only receiver.
+    They are started by the first start and kept while stopped, see
+    Dispatcher.stop for drain and timeout, close ends them.
+    """
+
     def __init__(self, can_dev):
         self.can_dev = can_dev
-        self.recv_process = multiprocessing.Process(target=self.recv_task)
-        self.send_process = multiprocessing.Process(target=self.send_task)
         self.recv_queue = multiprocessing.Queue()
-        self.send_queue = multiprocessing.Queue()
+        self._dispatcher = Dispatcher(can_dev)
+        self._dispatcher.add_receiver(self.recv_queue)
+
+    @property
+    def running(self):
+        return self._dispatcher.is_running
 
     def start(self):
-        self.can_dev.start()
-        self.recv_process.start()
-        self.send_process.start()
+        self._dispatcher.start()
 
-    def stop(self):
-        self.recv_process.terminate()
-        self.send_process.terminate()
-        self.can_dev.stop()
+    def stop(self, drain=True, timeout=None):
+        self._dispatcher.stop(drain, timeout)
+
+    def close(self, timeout=None):
+        self._dispatcher.close(timeout)
 
     def send(self, msg):
-        self.send_queue.put(msg)
+        self._dispatcher.send(msg)
 
     def recv(self, timeout=1, arb_id=None):
         try:
-            start_time = time.time()
+            deadline = time.monotonic() + timeout
             while True:
-                msg = self.recv_queue.get(timeout=timeout)
-                if not arb_id:
+                msg = self.recv_queue.get(
+                    timeout=max(0, deadline - time.monotonic()))
+                if arb_id is None:
                     return msg
-                elif arb_id == msg.id:
+                elif arb_id == msg.arb_id:
                     return msg
                 # ensure we haven't gone over the timeout
-                if time.time() - start_time > timeout:
+                if time.monotonic() > deadline:
                     return None
 
         except queue.Empty:
             return None
-
-    def recv_task(self):
-        while True:
-            msg = self.can_dev.recv()
-            self.recv_queue.put(msg)
-
-    def send_task(self):
-        while True:
-            msg = self.send_queue.get()
-            self.can_dev.send(msg)
@@ -0,0 +1,139 @@
+import asyncio
+import collections
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class RingBuffer:
+    """ Single consumer frame buffer for use between threads
+
+    Has the same put_nowait/get interface as queue.Queue and
+    multiprocessing.Queue, so it can be used wherever pyvit takes a receive
+    queue, but items are stored by reference and producers never take a
+    lock: deque.append and deque.popleft are atomic. The event is only
+    touched to wake a consumer that is waiting.
+
+    maxlen bounds the buffer, the oldest items are dropped once it is full.
+    """
+
+    def __init__(self, maxlen=None):
+        self._deque = collections.deque(maxlen=maxlen)
+        self._event = threading.Event()
+
+    def put_nowait(self, item):
+        self._deque.append(item)
+        if not self._event.is_set():
+            self._event.set()
+
+    def put(self, item, block=True, timeout=None):
+        self.put_nowait(item)
+
+    def put_batch(self, items):
+        """ Add several items, waking the consumer once """
+        self._deque.extend(items)
+        if not self._event.is_set():
+            self._event.set()
+
+    def wait(self, timeout=None):
+        """ Wait until an item is available without taking it, True if
+        there is one """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._deque:
+            self._event.clear()
+            if self._deque:
+                break
+            if deadline is None:
+                self._event.wait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._event.wait(remaining):
+                    return bool(self._deque)
+        return True
+
+    def get(self, block=True, timeout=None):
+        try:
+            return self._deque.popleft()
+        except IndexError:
+            if not block:
+                raise queue.Empty
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # clear before checking again, so an item added after the check
+            # sets the event and ends the wait
+            self._event.clear()
+            try:
+                return self._deque.popleft()
+            except IndexError:
+                pass
+
+            if deadline is None:
+                self._event.wait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._event.wait(remaining):
+                    try:
+                        return self._deque.popleft()
+                    except IndexError:
+                        raise queue.Empty
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return len(self._deque)
+
+    def empty(self):
+        return not self._deque
+
+
+class AsyncRingBuffer:
+    """ Single consumer frame buffer for use within one asyncio event loop
+
+    The asyncio counterpart of RingBuffer: put_nowait and get_nowait are
+    plain methods, get is a coroutine. Every method must be called from the
+    thread running the event loop.
+    """
+
+    def __init__(self, maxlen=None):
+        self._deque = collections.deque(maxlen=maxlen)
+        self._waiter = None
+
+    def put_nowait(self, item):
+        self._deque.append(item)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def put(self, item):
+        self.put_nowait(item)
+
+    async def get(self, timeout=None):
+        """ Wait for an item, raising queue.Empty after timeout seconds """
+        while not self._deque:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                if not self._deque:
+                    raise queue.Empty
+            finally:
+                self._waiter = None
+        return self._deque.popleft()
+
+    def get_nowait(self):
+        try:
+            return self._deque.popleft()
+        except IndexError:
+            raise queue.Empty
+
+    def qsize(self):
+        return len(self._deque)
+
+    def empty(self):
+        return not self._deque
@@ -0,0 +1,236 @@
+""" shmring.py
+
+Fixed-record ring of CAN frames in shared memory, written by one process
+and read by any number of others.
+
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+
+from .. import can
+from ..batch import FrameBatch, FD_WIDTH
+
+# write count, capacity and record size, padded to a cache line
+_HEADER = struct.Struct('=QQQ')
+HEADER_SIZE = 64
+
+# sequence, timestamp, arb_id, flags and dlc, followed by the payload
+_SEQ = struct.Struct('=Q')
+_RECORD = struct.Struct('=dIBB2x')
+RECORD_SIZE = _SEQ.size + _RECORD.size + FD_WIDTH
+
+
+def _attach(name):
+    # only the writer may unlink the ring. Before Python 3.13 attaching
+    # registers the segment with the resource tracker, which would unlink it
+    # when this process exits
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class RingWriter:
+    """ Creates a ring of capacity frames and writes frames into it
+
+    The writer never waits: once the ring is full each frame replaces the
+    oldest, and readers that fell that far behind skip ahead. It can be
+    given to Dispatcher.add_receiver, the frames are then written by the
+    receiving process without being pickled. close unlinks the ring,
+    readers that are attached keep their mapping.
+
+    Attributes:
+        name (str): name readers attach to
+        capacity (int): number of frames the ring holds
+    """
+
+    def __init__(self, capacity=4096, name=None):
+        if capacity < 2:
+            raise ValueError('ring must hold at least 2 frames')
+        self._shm = shared_memory.SharedMemory(
+            name, create=True, size=HEADER_SIZE + capacity * RECORD_SIZE)
+        self._buf = self._shm.buf
+        self.name = self._shm.name
+        self.capacity = capacity
+        self._seq = 0
+        _HEADER.pack_into(self._buf, 0, 0, capacity, RECORD_SIZE)
+
+    def put_raw(self, arb_id, payload, flags=0, timestamp=None):
+        """ Write a frame from trusted values, see can.Frame.from_raw """
+        dlc = len(payload)
+        if dlc > FD_WIDTH:
+            raise ValueError('payload of %d bytes does not fit in the ring'
+                             % dlc)
+        buf = self._buf
+        seq = self._seq
+        offset = HEADER_SIZE + (seq % self.capacity) * RECORD_SIZE
+        # a reader that sees the sequence change while it copies the record
+        # knows it was overwritten. Relies on stores reaching memory in
+        # program order, as they do on x86.
+        _SEQ.pack_into(buf, offset, 0)
+        _RECORD.pack_into(buf, offset + _SEQ.size,
+                          float('nan') if timestamp is None else timestamp,
+                          arb_id, flags, dlc)
+        start = offset + _SEQ.size + _RECORD.size
+        buf[start:start + dlc] = payload
+        seq += 1
+        _SEQ.pack_into(buf, offset, seq)
+        _SEQ.pack_into(buf, 0, seq)
+        self._seq = seq
+
+    def put(self, frame):
+        self.put_raw(frame.arb_id, frame.payload, frame.flags,
+                     frame.timestamp)
+
+    put_nowait = put
+
+    def put_batch(self, frames):
+        for frame in frames:
+            self.put_raw(frame.arb_id, frame.payload, frame.flags,
+                         frame.timestamp)
+
+    def qsize(self):
+        # readers have cursors of their own, the writer never waits for them
+        return 0
+
+    @property
+    def written(self):
+        """ Number of frames written since the ring was created """
+        return self._seq
+
+    def close(self):
+        if self._buf is not None:
+            self._buf = None
+            self._shm.close()
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        raise TypeError('a RingWriter is shared with forked processes only, '
+                        'attach a RingReader by name instead')
+
+
+class RingReader:
+    """ Reads the frames of a ring created by a RingWriter
+
+    Each reader has its own cursor and starts with the next frame written,
+    or with the oldest one still in the ring if oldest is True. A reader
+    that falls more than the capacity of the ring behind loses frames, they
+    are counted in lost.
+
+    Frames are copied out of the ring as they are read, no pickling is
+    involved. recv_batch copies straight into a FrameBatch.
+    """
+
+    # seconds between checks of an empty ring
+    POLL_INTERVAL = 0.0002
+
+    def __init__(self, name, oldest=False, interface=None):
+        self._shm = _attach(name)
+        self._buf = self._shm.buf
+        self.name = name
+        self.interface = interface
+        written, self.capacity, record_size = _HEADER.unpack_from(self._buf, 0)
+        if record_size != RECORD_SIZE:
+            raise ValueError('%s is not a frame ring' % name)
+        self.lost = 0
+        self._next = max(0, written - self.capacity + 1) if oldest \
+            else written
+
+    def pending(self):
+        """ Number of frames written that this reader has not read yet """
+        return _SEQ.unpack_from(self._buf, 0)[0] - self._next
+
+    def _read(self):
+        # returns (timestamp, arb_id, flags, payload) of the next frame, or
+        # None when the writer has not written it yet
+        buf = self._buf
+        capacity = self.capacity
+        while True:
+            written = _SEQ.unpack_from(buf, 0)[0]
+            seq = self._next
+            if seq >= written:
+                return None
+            if written - seq >= capacity:
+                self._skip(written)
+                continue
+
+            offset = HEADER_SIZE + (seq % capacity) * RECORD_SIZE
+            if _SEQ.unpack_from(buf, offset)[0] != seq + 1:
+                self._skip(written)
+                continue
+            timestamp, arb_id, flags, dlc = _RECORD.unpack_from(
+                buf, offset + _SEQ.size)
+            start = offset + _SEQ.size + _RECORD.size
+            payload = bytes(buf[start:start + min(dlc, FD_WIDTH)])
+            if _SEQ.unpack_from(buf, offset)[0] != seq + 1:
+                self._skip(written)
+                continue
+
+            self._next = seq + 1
+            if timestamp != timestamp:
+                timestamp = None
+            return timestamp, arb_id, flags, payload
+
+    def _skip(self, written):
+        # the writer lapped us, move to the oldest frame it cannot be
+        # overwriting right now
+        oldest = written - self.capacity + 1
+        if oldest > self._next:
+            self.lost += oldest - self._next
+            self._next = oldest
+
+    def _wait(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending() <= 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLL_INTERVAL)
+        return True
+
+    def recv(self, timeout=None):
+        """ Return the next frame, waiting up to timeout seconds (forever if
+        None) for one. Returns None if the timeout expired. """
+        while self._wait(timeout):
+            record = self._read()
+            if record is not None:
+                timestamp, arb_id, flags, payload = record
+                return can.Frame.from_raw(arb_id, payload, flags, timestamp,
+                                          self.interface)
+        return None
+
+    def recv_batch(self, max_frames=64, timeout=None):
+        """ Return up to max_frames frames as a FrameBatch, waiting up to
+        timeout seconds for the first. The batch is empty if the timeout
+        expired. """
+        batch = FrameBatch()
+        if not self._wait(timeout):
+            return batch
+        while len(batch) < max_frames:
+            record = self._read()
+            if record is None:
+                break
+            timestamp, arb_id, flags, payload = record
+            batch.append_raw(arb_id, payload, flags, timestamp,
+                             self.interface)
+        return batch
+
+    def close(self):
+        if self._buf is not None:
+            self._buf = None
+            self._shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
@@ -10,6 +10,11 @@ setup(
         'pyserial>=3.2.1'
     ],
 
+    extras_require={
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+    },
+
     test_suite='test',
 
     author='Eric Evenchick',
@@ -0,0 +1,66 @@
+import pickle
+import unittest
+
+from pyvit import can
+from pyvit.batch import FrameBatch
+
+
+class FrameBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.frames = [can.Frame(0x100, [1, 2, 3], timestamp=1.0,
+                                 interface='can0'),
+                       can.Frame(0x1ABCDEF, [0xFF] * 8, extended=True,
+                                 timestamp=2.0, interface='can1'),
+                       can.Frame(0x101, timestamp=3.0, interface='can0'),
+                       can.Frame(0x200, [4, 5])]
+        self.batch = FrameBatch.from_frames(self.frames)
+
+    def test_roundtrip(self):
+        """ Test frames read back from a batch match the originals """
+        self.assertEqual(len(self.batch), 4)
+        self.assertEqual(list(self.batch), self.frames)
+        self.assertEqual(self.batch[1].interface, 'can1')
+        self.assertEqual(self.batch[-1].timestamp, None)
+        self.assertEqual(self.batch.payload(0), b'\x01\x02\x03')
+
+    def test_slice(self):
+        """ Test slicing a batch """
+        self.assertEqual(list(self.batch[1:3]), self.frames[1:3])
+        self.assertEqual(list(self.batch[::2]), self.frames[::2])
+        self.assertEqual(list(self.batch[::-1]), self.frames[::-1])
+        self.assertEqual(list(self.batch[3:0:-2]), self.frames[3:0:-2])
+        self.assertEqual([f.interface for f in self.batch[::-1]],
+                         [None, 'can0', 'can1', 'can0'])
+
+    def test_filter(self):
+        """ Test filtering a batch by id set and by id/mask """
+        self.assertEqual(list(self.batch.filter_ids([0x100, 0x200])),
+                         [self.frames[0], self.frames[3]])
+        self.assertEqual(list(self.batch.filter_mask(0x100, 0x7FE)),
+                         self.frames[0::2][:1] + [self.frames[2]])
+
+    def test_concat(self):
+        """ Test joining batches keeps order and interfaces """
+        other = FrameBatch.from_frames([can.Frame(0x300, interface='can2')])
+        joined = self.batch + other
+        self.assertEqual(list(joined), self.frames + list(other))
+        self.assertEqual(joined[4].interface, 'can2')
+
+    def test_pickle(self):
+        """ Test batches can be sent between processes """
+        self.assertEqual(list(pickle.loads(pickle.dumps(self.batch))),
+                         self.frames)
+
+    def test_fd(self):
+        """ Test adding a CAN FD frame widens the batch """
+        fd_frame = can.Frame(0x300, list(range(64)), fd=True,
+                             bitrate_switch=True)
+        self.batch.append(fd_frame)
+        self.assertEqual(self.batch.width, 64)
+        self.assertEqual(list(self.batch), self.frames + [fd_frame])
+
+        with self.assertRaises(ValueError):
+            self.batch.append_raw(0x1, b'\x00' * 65)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from pyvit import bus
+from pyvit import can
+
+
+class BusTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = bus.Bus()
+        self.msg = bus.Message('speed', 0x100)
+        self.msg.add_signal(bus.Signal('kph', 16, factor=0.5), 0)
+        self.ext_msg = bus.Message('ext', 0x100, extended=True)
+        self.ext_msg.add_signal(bus.Signal('value', 8), 8)
+        self.bus.add_messages([self.msg, self.ext_msg])
+
+    def test_buses_are_separate(self):
+        """ Test messages are not shared between Bus instances """
+        self.assertIsNone(bus.Bus().get_message(0x100))
+        bus.Bus().add_message(bus.Message('speed', 0x100))
+
+    def test_duplicate(self):
+        """ Test adding a message with an existing id fails """
+        with self.assertRaises(ValueError):
+            self.bus.add_message(bus.Message('dup', 0x100))
+
+    def test_remove(self):
+        """ Test removing a message removes it from the index """
+        self.bus.remove_message(self.msg)
+        self.assertIsNone(self.bus.parse_frame(can.Frame(0x100, [1, 2])))
+        with self.assertRaises(ValueError):
+            self.bus.remove_message(self.msg)
+
+    def test_decode_frame(self):
+        """ Test decoding selects by extended flag and leaves signals
+        untouched """
+        result = self.bus.decode_frame(can.Frame(0x100, [0x10, 0x00, 0x07],
+                                                 timestamp=1.0))
+        self.assertEqual(result.name, 'speed')
+        self.assertEqual(result.timestamp, 1.0)
+        self.assertEqual(result.signals, (('kph', 8.0), ))
+        self.assertEqual(self.msg._signals[0].value, 0)
+
+        result = self.bus.decode_frame(can.Frame(0x100, [0x10, 0x07],
+                                                 extended=True))
+        self.assertEqual(result.signals, (bus.SignalValue('value', 7), ))
+
+        self.assertIsNone(self.bus.decode_frame(can.Frame(0x200)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import pyvit.can as can
+import pickle
 import unittest
 
 
@@ -77,5 +78,28 @@ class CanTest(unittest.TestCase):
         self.assertEqual(frame.arb_id, 0x1234)
         self.assertTrue(frame.is_extended_id)
 
+    def test_from_raw(self):
+        """ Test trusted frame construction and the list data view """
+        frame = can.Frame.from_raw(0x1234, b'\x01\x02\x03',
+                                   can.FrameFlags.Extended, 1.5)
+        self.assertEqual(frame.arb_id, 0x1234)
+        self.assertTrue(frame.is_extended_id)
+        self.assertEqual(frame.timestamp, 1.5)
+        self.assertEqual(frame.dlc, 3)
+        self.assertEqual(frame.payload, b'\x01\x02\x03')
+        self.assertEqual(frame, can.Frame(0x1234, [1, 2, 3], extended=True))
+
+        # changes made through the list view are reflected in the payload
+        frame.data.pop(0)
+        self.assertEqual(frame.payload, b'\x02\x03')
+
+        remote = can.Frame.from_raw(0x1, flags=can.FrameFlags.Remote)
+        self.assertEqual(remote.frame_type, can.FrameType.RemoteFrame)
+
+    def test_pickle(self):
+        """ Test frames with memoryview payloads can be pickled """
+        frame = can.Frame.from_raw(0x1, memoryview(b'\xAA\xBB'))
+        self.assertEqual(pickle.loads(pickle.dumps(frame)), frame)
+
 if __name__ == '__main__':
     unittest.main()
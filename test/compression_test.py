@@ -0,0 +1,123 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+
+from pyvit import can
+from pyvit.file import compression, log
+from pyvit.hw.logplayer import LogPlayer
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data = b''.join(b'(%d.000000) can0 123#%08X\n' % (i, i)
+                             for i in range(50000))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_codec_for(self):
+        self.assertEqual(compression.codec_for('a.log'), None)
+        self.assertEqual(compression.codec_for('a.log.gz'), 'gzip')
+        self.assertEqual(compression.codec_for('a.LOG.XZ'), 'xz')
+        self.assertEqual(compression.codec_for('a.log', 'bz2'), 'bz2')
+        with self.assertRaises(ValueError):
+            compression.codec_for('a.log', 'rar')
+
+    def test_split_extension(self):
+        self.assertEqual(compression.split_extension('a/tmp.log.gz'),
+                         ('a/tmp', '.log.gz'))
+        self.assertEqual(compression.split_extension('tmp.log'),
+                         ('tmp', '.log'))
+
+    def test_round_trip(self):
+        for codec in compression.CODECS:
+            for threads in (None, 2):
+                name = self.path('%s-%s.log' % (codec, threads))
+                with compression.open_file(name, 'wb', codec,
+                                           threads=threads) as f:
+                    # written in pieces, so block writers cut several blocks
+                    for i in range(0, len(self.data), 100000):
+                        f.write(self.data[i:i + 100000])
+                with compression.open_file(name, 'rb', codec) as f:
+                    self.assertEqual(f.read(), self.data,
+                                     (codec, threads))
+                if codec is not None:
+                    self.assertLess(os.path.getsize(name), len(self.data))
+
+    def test_block_writer(self):
+        name = self.path('blocks.log.gz')
+        with compression.BlockWriter(name, 'gzip', 2,
+                                     block_size=65536) as f:
+            f.write(self.data)
+            f.flush()
+            f.write(b'end\n')
+        with compression.open_file(name) as f:
+            self.assertEqual(f.read(), self.data + b'end\n')
+
+    def test_rewinding_reader(self):
+        name = self.path('rewind.log.gz')
+        with gzip.open(name, 'wb') as f:
+            f.write(self.data)
+
+        f = io.BufferedReader(compression.RewindingReader(
+            lambda: gzip.open(name, 'rb')))
+        with f:
+            first = f.readline()
+            self.assertEqual(first, self.data[:self.data.index(b'\n') + 1])
+            self.assertEqual(f.tell(), len(first))
+            f.seek(100000)
+            self.assertEqual(f.read(10), self.data[100000:100010])
+            f.seek(5)
+            self.assertEqual(f.read(10), self.data[5:15])
+            f.seek(0)
+            self.assertEqual(b''.join(f), self.data)
+            with self.assertRaises(io.UnsupportedOperation):
+                f.seek(0, io.SEEK_END)
+
+
+class OptionalCodecTest(unittest.TestCase):
+    """ Logs compressed with the codecs that need another package """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.frames = [can.Frame(i & 0x7FF, [i & 0xFF], timestamp=i / 100,
+                                 interface='1') for i in range(1000)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def check_codec(self, ext):
+        name = os.path.join(self.dir.name, 'tmp.log' + ext)
+        cdf = log.CandumpFile(name)
+        cdf.export_frames(self.frames)
+        self.assertEqual(cdf.import_frames(), self.frames)
+
+        with LogPlayer(name, realtime=False, start_time=5.0, end_time=5.1,
+                       loop=True) as lp:
+            self.assertEqual([f.arb_id for f in lp.recv_batch(15)],
+                             list(range(500, 511)) + list(range(500, 504)))
+            lp.seek(2.0)
+            self.assertEqual(lp.recv().arb_id, 200)
+
+        name = os.path.join(self.dir.name, 'tmp.asc' + ext)
+        asc = log.AscFile(name)
+        asc.export_frames(self.frames)
+        self.assertEqual(asc.import_frames(), self.frames)
+
+    @unittest.skipUnless('zstd' in compression.CODECS,
+                         'zstandard is not installed')
+    def test_zstd(self):
+        self.check_codec('.zst')
+
+    @unittest.skipUnless('lz4' in compression.CODECS, 'lz4 is not installed')
+    def test_lz4(self):
+        self.check_codec('.lz4')
+
+if __name__ == '__main__':
+    unittest.main()
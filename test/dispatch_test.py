@@ -1,16 +1,54 @@
+import time
 import unittest
 from multiprocessing import Queue
 
-from pyvit.dispatch import Dispatcher
-from pyvit.hw.loopback import LoopbackDev
+from pyvit.dispatch import (Dispatcher, ThreadDispatcher, MultiDispatcher,
+                            AsyncDispatcher, Router, Overflow)
+from pyvit.hw.loopback import LoopbackDev, VirtualBus
 from pyvit import can
 
 
+class _BlockingDev:
+    """ Device without fileno whose recv does not return for a while """
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def send(self, frame):
+        pass
+
+    def recv(self):
+        time.sleep(5)
+        return None
+
+
+class _ClockDev(LoopbackDev):
+    """ Stamps frames with the time it was started at, the base SocketCanDev
+    counts its timestamps from """
+    def start(self):
+        LoopbackDev.start(self)
+        self.started_at = time.monotonic()
+
+    def align_clock(self, started_at):
+        self.started_at = started_at
+
+    def recv(self):
+        frame = LoopbackDev.recv(self)
+        if frame is not None:
+            frame.timestamp = self.started_at
+        return frame
+
+
 class DispatchTest(unittest.TestCase):
     def setUp(self):
         dev = LoopbackDev()
         self.disp = Dispatcher(dev)
 
+    def tearDown(self):
+        self.disp.close()
+
     def test_dispatcher_single(self):
         rx = Queue()
         self.disp.add_receiver(rx)
@@ -44,5 +82,362 @@ class DispatchTest(unittest.TestCase):
         self.assertEqual(rx2, tx2)
         self.assertEqual(rx3, tx3)
 
+    def test_send_batch(self):
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx)
+
+        frames = [can.Frame(i, data=[i]) for i in range(100)]
+        self.disp.start()
+        self.disp.send(frames[0])
+        self.disp.send_batch(frames[1:])
+        received = [rx.get(timeout=5) for _ in frames]
+        self.disp.stop()
+
+        self.assertEqual(received, frames)
+
+    def _overflow(self, overflow):
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx, maxsize=3, overflow=overflow)
+        # a second receiver tells us when each frame has been routed. The
+        # frames go one at a time, a multiprocessing queue only gives up
+        # its oldest frame once it has reached the pipe.
+        routed = self.disp.create_queue()
+        self.disp.add_receiver(routed)
+
+        self.disp.start()
+        for i in range(6):
+            self.disp.send(can.Frame(i))
+            routed.get(timeout=5)
+        stats = self.disp.stats(rx)
+        received = [rx.get(timeout=5).arb_id for _ in range(3)]
+        self.disp.stop()
+        return stats, received
+
+    def test_drop_newest(self):
+        stats, received = self._overflow(Overflow.DropNewest)
+        self.assertEqual(received, [0, 1, 2])
+        self.assertEqual(stats.enqueued, 3)
+        self.assertEqual(stats.dropped, 3)
+        self.assertEqual(stats.high_watermark, 3)
+
+    def test_drop_oldest(self):
+        stats, received = self._overflow(Overflow.DropOldest)
+        self.assertEqual(received, [3, 4, 5])
+        self.assertEqual(stats.enqueued, 6)
+        self.assertEqual(stats.dropped, 3)
+        self.assertEqual(stats.high_watermark, 3)
+
+    def test_block(self):
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx, maxsize=2, overflow=Overflow.Block)
+
+        self.disp.start()
+        self.disp.send_batch([can.Frame(i) for i in range(10)])
+        received = []
+        for _ in range(10):
+            received.append(rx.get(timeout=5).arb_id)
+            time.sleep(0.001)
+        stats = self.disp.stats()[0]
+        self.disp.stop()
+
+        self.assertEqual(received, list(range(10)))
+        self.assertEqual(stats.dropped, 0)
+        self.assertEqual(stats.enqueued, 10)
+        self.assertLessEqual(stats.high_watermark, 2)
+
+    def test_invalid_overflow(self):
+        with self.assertRaises(ValueError):
+            self.disp.add_receiver(self.disp.create_queue(), maxsize=1,
+                                   overflow='drop-everything')
+
+    def test_routing(self):
+        by_id = self.disp.create_queue()
+        by_mask = self.disp.create_queue()
+        everything = self.disp.create_queue()
+        self.disp.add_receiver(by_id, arb_ids=[2])
+        self.disp.add_receiver(by_mask, masks=[(0x100, 0x700)])
+        self.disp.add_receiver(everything)
+
+        self.disp.start()
+        for arb_id in (1, 2, 0x123, 3):
+            self.disp.send(can.Frame(arb_id))
+        received = [everything.get(timeout=5).arb_id for _ in range(4)]
+        self.assertEqual(by_id.get(timeout=5).arb_id, 2)
+        self.assertEqual(by_mask.get(timeout=5).arb_id, 0x123)
+
+        # change a subscription while running
+        self.disp.update_receiver(by_id, arb_ids=[3])
+        self.disp.send(can.Frame(2))
+        self.disp.send(can.Frame(3))
+        self.assertEqual(by_id.get(timeout=5).arb_id, 3)
+        self.disp.stop()
+
+        self.assertEqual(received, [1, 2, 0x123, 3])
+        self.assertTrue(by_mask.empty())
+
+    def test_update_keeps_predicate(self):
+        """ Test a running update without a predicate keeps the one the
+        receiver has, in the receiving process as well """
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx, arb_ids=[1],
+                               predicate=lambda f: f.data[0] == 0x30)
+
+        self.disp.start()
+        self.disp.update_receiver(rx, arb_ids=[2])
+        self.assertIsNotNone(self.disp._predicate(0))
+        self.disp.send(can.Frame(2, data=[0x10]))
+        self.disp.send(can.Frame(2, data=[0x30]))
+        f = rx.get(timeout=1)
+        self.disp.stop()
+
+        self.assertEqual(f.data, [0x30])
+        self.assertTrue(rx.empty())
+
+    def test_stop_drains(self):
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx)
+
+        frames = [can.Frame(i & 0x7FF, data=[i & 0xFF]) for i in range(1000)]
+        self.disp.start()
+        self.disp.send_batch(frames)
+        self.disp.stop()
+
+        # every frame queued before stop was sent, looped back and routed
+        received = [rx.get(timeout=5) for _ in frames]
+        self.assertEqual(received, frames)
+        self.assertEqual(self.disp.stats(rx).enqueued, 1000)
+
+    def test_warm_restart(self):
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx)
+
+        self.disp.start()
+        workers = list(self.disp._workers)
+        for i in range(5):
+            start = time.monotonic()
+            self.disp.stop()
+            stopped = time.monotonic()
+            self.disp.start()
+            started = time.monotonic()
+            self.assertLess(stopped - start, 0.5)
+            self.assertLess(started - stopped, 0.1)
+
+            self.disp.send(can.Frame(i))
+            self.assertEqual(rx.get(timeout=5).arb_id, i)
+        self.disp.stop(drain=False)
+
+        # the workers were kept, not started again
+        self.assertEqual(self.disp._workers, workers)
+        self.assertTrue(rx.empty())
+
+    def test_restart_clock(self):
+        """ Test a restarted device counts time from the new start in the
+        workers as well """
+        disp = self.disp.__class__(_ClockDev())
+        rx = disp.create_queue()
+        disp.add_receiver(rx)
+        for _ in range(2):
+            disp.start()
+            disp.send(can.Frame(1))
+            self.assertEqual(rx.get(timeout=5).timestamp,
+                             disp._device.started_at)
+            disp.stop()
+            time.sleep(0.01)
+        disp.close()
+
+    def test_stop_timeout(self):
+        disp = self.disp.__class__(_BlockingDev())
+        disp.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        disp.stop(timeout=0.2)
+        self.assertLess(time.monotonic() - start, 1)
+        # the stuck workers were ended and are replaced by the next start
+        self.assertEqual(disp._workers, [])
+        disp.start()
+        self.assertEqual(len(disp._workers), 1 if disp._single_process else 2)
+        disp.close(timeout=0.2)
+
+
+class SingleProcessDispatchTest(DispatchTest):
+    def setUp(self):
+        dev = LoopbackDev()
+        self.disp = Dispatcher(dev, single_process=True)
+
+
+class ThreadDispatchTest(DispatchTest):
+    def setUp(self):
+        dev = LoopbackDev()
+        self.disp = ThreadDispatcher(dev)
+
+    def test_fan_out_shares_frames(self):
+        rx_queues = [self.disp.create_queue() for _ in range(5)]
+        for rx in rx_queues:
+            self.disp.add_receiver(rx)
+
+        self.disp.start()
+        f = can.Frame(0x123, data=[1, 2, 3])
+        self.disp.send(f)
+        received = [rx.get(timeout=1) for rx in rx_queues]
+        self.disp.stop()
+
+        # every receiver gets the same object, nothing is copied
+        for f2 in received:
+            self.assertIs(f2, received[0])
+            self.assertEqual(f, f2)
+
+    def test_predicate(self):
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx, predicate=lambda f: f.data[0] == 0x30)
+
+        self.disp.start()
+        self.disp.send(can.Frame(1, data=[0x10]))
+        self.disp.send(can.Frame(1, data=[0x30]))
+        f = rx.get(timeout=1)
+        self.disp.stop()
+
+        self.assertEqual(f.data, [0x30])
+        self.assertTrue(rx.empty())
+
+    def test_invalid_receiver(self):
+        with self.assertRaises(ValueError):
+            self.disp.add_receiver([])
+
+
+class _ListDev:
+    """ Device without fileno that replays a list of frames """
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def send(self, frame):
+        pass
+
+    def recv(self):
+        if self.frames:
+            return self.frames.pop(0)
+        return None
+
+
+class MultiDispatchTest(unittest.TestCase):
+    def setUp(self):
+        self.disp = MultiDispatcher({'can0': LoopbackDev(),
+                                     'can1': LoopbackDev()})
+
+    def test_interfaces(self):
+        rx = self.disp.create_queue()
+        self.disp.add_receiver(rx)
+
+        self.disp.start()
+        self.disp.send(can.Frame(1, interface='can1'))
+        f = rx.get(timeout=5)
+        self.assertEqual((f.arb_id, f.interface), (1, 'can1'))
+        # frames without an interface go to the default device
+        self.disp.send_batch([can.Frame(2), can.Frame(3, interface='can1')])
+        received = sorted((f.arb_id, f.interface)
+                          for f in (rx.get(timeout=5), rx.get(timeout=5)))
+        self.disp.stop()
+
+        self.assertEqual(received, [(2, 'can0'), (3, 'can1')])
+
+    def test_unknown_interface(self):
+        self.disp.start()
+        try:
+            with self.assertRaises(ValueError):
+                self.disp.send(can.Frame(1, interface='can9'))
+        finally:
+            self.disp.stop()
+
+    def test_device_without_fileno(self):
+        frames = [can.Frame(i) for i in range(3)]
+        disp = MultiDispatcher([('can0', LoopbackDev()),
+                                ('log', _ListDev(frames))])
+        rx = disp.create_queue()
+        disp.add_receiver(rx, arb_ids=[0, 1, 2])
+
+        disp.start()
+        received = [rx.get(timeout=5) for _ in frames]
+        disp.stop()
+
+        self.assertEqual(received, frames)
+        self.assertEqual({f.interface for f in received}, {'log'})
+
+    def test_shared_frames(self):
+        # both nodes receive what the third sends, each tagged on its own
+        bus = VirtualBus()
+        sender = bus.attach()
+        disp = MultiDispatcher({'a': bus.attach(), 'b': bus.attach()})
+        rx = disp.create_queue()
+        disp.add_receiver(rx)
+
+        disp.start()
+        sender.start()
+        f = can.Frame(1)
+        sender.send(f)
+        received = [rx.get(timeout=5), rx.get(timeout=5)]
+        sender.stop()
+        disp.stop()
+
+        self.assertEqual(sorted(f.interface for f in received), ['a', 'b'])
+        self.assertIsNone(f.interface)
+
+
+class AsyncDispatchTest(unittest.IsolatedAsyncioTestCase):
+    async def test_subscription(self):
+        disp = AsyncDispatcher(LoopbackDev())
+        async with disp:
+            sub = disp.subscribe(arb_ids=[2, 3])
+            disp.send_batch([can.Frame(i) for i in range(5)])
+            received = [await sub.get(timeout=5) for _ in range(2)]
+            sub.close()
+            # iteration ends once the subscription is closed
+            self.assertEqual([f async for f in sub], [])
+
+        self.assertEqual([f.arb_id for f in received], [2, 3])
+
+    async def test_iteration_ends_on_stop(self):
+        disp = AsyncDispatcher(LoopbackDev())
+        disp.start()
+        sub = disp.subscribe()
+        disp.send(can.Frame(1))
+        f = await sub.get(timeout=5)
+        disp.stop()
+        self.assertEqual(f.arb_id, 1)
+        self.assertEqual([f async for f in sub], [])
+
+    async def test_device_without_fileno(self):
+        frames = [can.Frame(i) for i in range(3)]
+        async with AsyncDispatcher(_ListDev(frames)) as disp:
+            sub = disp.subscribe()
+            received = [await sub.get(timeout=5) for _ in frames]
+        self.assertEqual(received, frames)
+
+    def test_no_block(self):
+        disp = AsyncDispatcher(LoopbackDev())
+        with self.assertRaises(ValueError):
+            disp.subscribe(maxsize=1, overflow=Overflow.Block)
+
+
+class RouterTest(unittest.TestCase):
+    def test_lookup(self):
+        router = Router()
+        router.subscribe(0, 'a', arb_ids=[1, 2])
+        router.subscribe(1, 'b', masks=[(0x18DAF100, 0x1FFFFF00)])
+        router.subscribe(2, 'c')
+        self.assertEqual([q for q, _ in router.lookup(1)], ['a', 'c'])
+        self.assertEqual([q for q, _ in router.lookup(0x18DAF1F1)],
+                         ['b', 'c'])
+        self.assertEqual([q for q, _ in router.lookup(3)], ['c'])
+
+        # the cached result is dropped when a subscription changes
+        router.unsubscribe(2)
+        self.assertEqual(router.lookup(3), ())
+
+
 if __name__ == '__main__':
     unittest.main()
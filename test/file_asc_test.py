@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+import pyvit.can as can
+from pyvit.batch import FrameBatch
+from pyvit.file import log
+from pyvit.file.log.stream import StreamFile
+
+SAMPLE = b'''date Wed Mar 6 10:00:00.000 am 2024
+base dec  timestamps relative
+internal events logged
+// version 9.0.0
+Begin Triggerblock Wed Mar 6 10:00:00.000 am 2024
+   0.000000 Start of measurement
+   0.010000 1  291             Rx   d 3 1 2 255  Length = 0 BitCount = 0
+   0.010000 2  ErrorFrame
+   0.000000 CANFD   2
+   0.005000 1  2015x           Tx   r
+   0.005000 CANFD   2 Rx        256  EngineData                       1 0 9 12 0 1 2 3 4 5 6 7 8 9 10 11        0    0     3000        0        0        0        0        0
+End TriggerBlock
+'''
+
+
+class FileAscTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        frames = [can.Frame(i & 0x7FF, [i & 0xFF] * (i % 9), timestamp=i,
+                            interface='%d' % (i % 2 + 1))
+                  for i in range(100)]
+        frames.append(can.Frame(0x1ABCDEF, [1, 2], extended=True,
+                                timestamp=200.0, interface='1'))
+        frames.append(can.Frame(0x7DF, frame_type=can.FrameType.RemoteFrame,
+                                timestamp=201.0, interface='2'))
+        frames.append(can.Frame(0x123, list(range(64)), fd=True,
+                                error_state_indicator=True,
+                                timestamp=202.0, interface='1'))
+
+        for name in ('trace.asc', 'trace.asc.gz'):
+            asc = log.AscFile(os.path.join(self.dir.name, name))
+            asc.export_frames(frames)
+            frames2 = asc.import_frames()
+            self.assertEqual(frames2, frames)
+            self.assertEqual([(f.timestamp, f.interface) for f in frames2],
+                             [(f.timestamp, f.interface) for f in frames])
+            self.assertEqual(frames2[-1].error_state_indicator, True)
+            batches = list(asc.iter_batches(batch_size=40))
+            self.assertEqual([len(b) for b in batches], [40, 40, 23])
+            self.assertEqual(list(FrameBatch.concat(batches)), frames)
+
+    def test_channels(self):
+        frames = [can.Frame(1, interface='can0'),
+                  can.Frame(2, interface='can1'),
+                  can.Frame(3, interface='can0')]
+        asc = log.AscFile(os.path.join(self.dir.name, 'trace.asc'))
+        asc.export_frames(frames)
+        self.assertEqual([f.interface for f in asc.iter_frames()],
+                         ['1', '2', '1'])
+
+    def test_padded_fd(self):
+        """ Test an FD payload between the valid lengths is padded """
+        frame = can.Frame.from_raw(0x123, bytes(range(1, 11)),
+                                   can.FrameFlags.FD, 1.0, '1')
+        asc = log.AscFile(os.path.join(self.dir.name, 'trace.asc'))
+        asc.export_frames([frame])
+        self.assertEqual(asc.import_frames()[0].payload,
+                         bytes(range(1, 11)) + bytes(2))
+
+    def test_abstract_base(self):
+        """ Test a format has to read and write frames """
+        with self.assertRaises(TypeError):
+            StreamFile('trace')
+
+    def test_read(self):
+        file_name = os.path.join(self.dir.name, 'sample.asc')
+        with open(file_name, 'wb') as f:
+            f.write(SAMPLE)
+
+        frames = log.AscFile(file_name).import_frames()
+
+        self.assertEqual(len(frames), 3)
+        self.assertEqual((frames[0].arb_id, frames[0].data,
+                          frames[0].timestamp, frames[0].interface),
+                         (291, [1, 2, 255], 0.01, '1'))
+        self.assertEqual((frames[1].arb_id, frames[1].is_extended_id,
+                          frames[1].frame_type),
+                         (2015, True, can.FrameType.RemoteFrame))
+        self.assertAlmostEqual(frames[1].timestamp, 0.025)
+        self.assertEqual((frames[2].arb_id, frames[2].is_fd,
+                          frames[2].bitrate_switch, frames[2].data,
+                          frames[2].interface),
+                         (256, True, True, list(range(12)), '2'))
+
+if __name__ == '__main__':
+    unittest.main()
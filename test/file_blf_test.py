@@ -0,0 +1,82 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import pyvit.can as can
+from pyvit.file import log
+from pyvit.file.log import blf
+
+
+class FileBlfTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.dir.name, 'trace.blf')
+        self.frames = [can.Frame(i & 0x7FF, [i & 0xFF] * (i % 9),
+                                 timestamp=i / 1000,
+                                 interface='%d' % (i % 2 + 1))
+                       for i in range(5000)]
+        self.frames.append(can.Frame(0x1ABCDEF, [1, 2], extended=True,
+                                     timestamp=6.0, interface='1'))
+        self.frames.append(can.Frame(0x7DF,
+                                     frame_type=can.FrameType.RemoteFrame,
+                                     timestamp=7.0, interface='2'))
+        self.frames.append(can.Frame(0x123, list(range(48)), fd=True,
+                                     bitrate_switch=True, timestamp=8.0,
+                                     interface='1'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        for level in (6, 0):
+            blf_file = log.BlfFile(self.file_name)
+            blf_file.export_frames(self.frames, level)
+            frames = blf_file.import_frames()
+            self.assertEqual(frames, self.frames)
+            self.assertEqual([(f.timestamp, f.interface) for f in frames],
+                             [(f.timestamp, f.interface)
+                              for f in self.frames])
+            self.assertEqual(frames[-1].bitrate_switch, True)
+
+        with open(self.file_name, 'rb') as f:
+            header = f.read(blf.FILE_HEADER_SIZE)
+        fields = blf._FILE_HEADER.unpack_from(header)
+        self.assertEqual(fields[0], b'LOGG')
+        self.assertEqual(fields[10], os.path.getsize(self.file_name))
+        self.assertEqual(fields[12], len(self.frames))
+
+    def test_split_objects(self):
+        """ Test objects continued in the next container are read """
+        blf_file = log.BlfFile(self.file_name)
+        objects = b''.join(blf_file._frame_to_object(frame, {})
+                           for frame in self.frames)
+        with open(self.file_name, 'wb') as f:
+            f.write(bytes(blf.FILE_HEADER_SIZE))
+            for i in range(0, len(objects), 1001):
+                blf_file._write_container(f, objects[i:i + 1001], 6)
+            f.seek(0)
+            f.write(b'LOGG' + struct.pack('<L', blf.FILE_HEADER_SIZE))
+
+        batches = list(blf_file.iter_batches(batch_size=1000))
+        self.assertEqual(len(batches), 6)
+        self.assertEqual([f.arb_id for b in batches for f in b],
+                         [f.arb_id for f in self.frames])
+
+    def test_padded_fd(self):
+        """ Test an FD payload between the valid lengths is padded """
+        frame = can.Frame.from_raw(0x123, bytes(range(1, 11)),
+                                   can.FrameFlags.FD, 1.0, '1')
+        blf_file = log.BlfFile(self.file_name)
+        blf_file.export_frames([frame])
+        self.assertEqual(blf_file.import_frames()[0].payload,
+                         bytes(range(1, 11)) + bytes(2))
+
+    def test_invalid(self):
+        with open(self.file_name, 'wb') as f:
+            f.write(b'(0.0) can0 123#\n')
+        with self.assertRaises(ValueError):
+            log.BlfFile(self.file_name).import_frames()
+
+if __name__ == '__main__':
+    unittest.main()
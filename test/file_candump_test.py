@@ -1,6 +1,7 @@
 import tempfile
 
 import pyvit.can as can
+from pyvit.batch import FrameBatch
 from pyvit.file import log
 
 import unittest
@@ -55,5 +56,124 @@ class FileCanDumpTest(unittest.TestCase):
         for i in range(0, len(frames)):
             self.assertEqual(frames[i], frames2[i])
 
+    def test_batch(self):
+        """ Test write & readback of candump file through a FrameBatch """
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        file_name = temp_file.name
+
+        cdf = log.CandumpFile(file_name)
+
+        frames = [can.Frame(0x123, [1, 2, 3, 4, 5, 6, 7, 8]),
+                  can.Frame(0x0),
+                  can.Frame(0x1, [0xFF] * 8)]
+
+        cdf.export_frames(FrameBatch.from_frames(frames))
+        batch = cdf.import_batch()
+
+        temp_file.close()
+
+        self.assertEqual(list(batch), frames)
+
+    def test_fd(self):
+        """ Test write & readback of CAN FD frames with the '##' syntax """
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        file_name = temp_file.name
+
+        cdf = log.CandumpFile(file_name)
+
+        frames = [can.Frame(0x123, list(range(64)), fd=True),
+                  can.Frame(0x124, [1, 2, 3], fd=True, bitrate_switch=True),
+                  can.Frame(0x125, [0xFF] * 12, fd=True, bitrate_switch=True,
+                            error_state_indicator=True),
+                  can.Frame(0x126, [1, 2, 3])]
+
+        cdf.export_frames(frames)
+        with open(file_name) as f:
+            self.assertIn('124##1010203', f.read())
+        frames2 = cdf.import_frames()
+
+        temp_file.close()
+
+        self.assertEqual(frames, frames2)
+
+    def test_streaming(self):
+        """ Test reading in small blocks keeps every field """
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        file_name = temp_file.name
+
+        cdf = log.CandumpFile(file_name)
+
+        frames = [can.Frame(i & 0x7FF, [i & 0xFF] * (i % 9), timestamp=i / 8,
+                            interface='can%d' % (i % 2))
+                  for i in range(100)]
+        frames.append(can.Frame(0x1ABCDEF, [1, 2], extended=True,
+                                timestamp=20.0, interface='vcan0'))
+        frames.append(can.Frame(0x7DF, frame_type=can.FrameType.RemoteFrame,
+                                timestamp=21.0, interface='vcan0'))
+        cdf.export_frames(frames)
+        with open(file_name, 'a') as f:
+            f.write('\n\n')
+
+        frames2 = list(cdf.iter_frames(chunk_size=64))
+        batches = list(cdf.iter_batches(chunk_size=1024))
+
+        temp_file.close()
+
+        self.assertEqual(frames2, frames)
+        self.assertEqual([(f.timestamp, f.interface) for f in frames2],
+                         [(f.timestamp, f.interface) for f in frames])
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(len(b) for b in batches), len(frames))
+        self.assertEqual(list(FrameBatch.concat(batches)), frames)
+
+    def test_parallel(self):
+        """ Test parsing in worker processes gives the frames in order """
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        file_name = temp_file.name
+
+        cdf = log.CandumpFile(file_name)
+
+        frames = [can.Frame(i & 0x7FF, [i & 0xFF] * (i % 9), timestamp=i)
+                  for i in range(500)]
+        cdf.export_frames(frames)
+
+        # blocks are cut after the line that crosses the block size
+        ranges = cdf._ranges(64)
+        batches = list(cdf.iter_batches(chunk_size=1000, workers=2))
+        batch = cdf.import_batch(workers=2)
+
+        temp_file.close()
+
+        with open(file_name, 'rb') as f:
+            data = f.read()
+        for start, end in ranges:
+            self.assertEqual(data[end - 1:end], b'\n')
+        self.assertEqual([start for start, _ in ranges[1:]],
+                         [end for _, end in ranges[:-1]])
+        self.assertGreater(len(batches), 2)
+        self.assertEqual(list(FrameBatch.concat(batches)), frames)
+        self.assertEqual(list(batch.timestamps), list(range(500)))
+
+    def test_compressed(self):
+        """ Test a compressed log reads back like a plain one """
+        temp_dir = tempfile.TemporaryDirectory()
+        file_name = temp_dir.name + '/tmp.log.gz'
+
+        cdf = log.CandumpFile(file_name)
+
+        frames = [can.Frame(i & 0x7FF, [i & 0xFF] * (i % 9), timestamp=i)
+                  for i in range(500)]
+        cdf.export_frames(frames, threads=2)
+        with open(file_name, 'rb') as f:
+            magic = f.read(2)
+        frames2 = list(cdf.iter_frames(chunk_size=256))
+        batch = cdf.import_batch(workers=2)
+
+        temp_dir.cleanup()
+
+        self.assertEqual(magic, b'\x1f\x8b')
+        self.assertEqual(frames2, frames)
+        self.assertEqual(list(batch), frames)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import time
+import unittest
+
+import pyvit.can as can
+from pyvit.file import log
+from pyvit.hw.logplayer import LogPlayer
+
+
+class FileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.dir.name, 'tmp.log')
+        # frame i is logged at i / 100 seconds, ids 0x100 to 0x109
+        self.frames = [can.Frame(0x100 + i % 10, [i & 0xFF],
+                                 timestamp=i / 100, interface='can0')
+                       for i in range(1000)]
+        self.cdf = log.CandumpFile(self.file_name)
+        self.cdf.export_frames(self.frames)
+        with open(self.file_name, 'ab') as f:
+            f.write(b'\n\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_build(self):
+        index = log.CandumpIndex.build(self.file_name, every_frames=64)
+
+        self.assertEqual(len(index), 1000)
+        self.assertEqual(len(index.timestamps), 16)
+        self.assertEqual(index.first_timestamp, 0.0)
+        self.assertEqual(index.last_timestamp, 9.99)
+        self.assertEqual(sorted(index.ids),
+                         [(i, False) for i in range(0x100, 0x10A)])
+        self.assertEqual(index.ids[(0x103, False)], (100, 0.03, 9.93))
+        with open(self.file_name, 'rb') as f:
+            data = f.read()
+        for timestamp, offset in zip(index.timestamps, index.offsets):
+            line = data[offset:data.index(b'\n', offset)]
+            self.assertTrue(line.startswith(b'(%f)' % timestamp))
+
+        index = log.CandumpIndex.build(self.file_name, every_seconds=0.5)
+        self.assertEqual(len(index.timestamps), 20)
+
+    def test_extended_ids(self):
+        """ Test a standard and an extended id of the same value are
+        counted apart, and cached apart """
+        with open(self.file_name, 'ab') as f:
+            f.write(b'(10.000000) can0 00000103#01\n'
+                    b'(10.010000) can0 00000103#02\n')
+        index = self.cdf.index()
+        self.assertEqual(index.ids[(0x103, False)], (100, 0.03, 9.93))
+        self.assertEqual(index.ids[(0x103, True)], (2, 10.0, 10.01))
+        self.assertEqual(self.cdf.index().ids, index.ids)
+
+    def test_find(self):
+        index = log.CandumpIndex.build(self.file_name, every_frames=64)
+        with open(self.file_name, 'rb') as f:
+            data = f.read()
+
+        self.assertEqual(index.find(-1.0), 0)
+        self.assertEqual(index.find(100.0), len(data))
+        for timestamp in (0.0, 0.635, 0.64, 5.0, 9.99):
+            offset = index.find(timestamp)
+            self.assertEqual(data[offset - 1:offset], b'\n' if offset
+                             else b'')
+            expected = ('(%f)' % (round(timestamp * 100 + 0.4999) / 100))
+            self.assertTrue(data[offset:].startswith(expected.encode()))
+        after = index.find(5.0, after=True)
+        self.assertTrue(data[after:].startswith(b'(5.010000)'))
+
+    def test_cache(self):
+        index = self.cdf.index()
+        index_name = self.file_name + '.idx'
+        self.assertTrue(os.path.exists(index_name))
+        mtime = os.stat(index_name).st_mtime_ns
+
+        cached = self.cdf.index()
+        self.assertEqual(os.stat(index_name).st_mtime_ns, mtime)
+        self.assertEqual(cached.ids, index.ids)
+        self.assertEqual(list(cached.offsets), list(index.offsets))
+
+        # a changed log is indexed again
+        time.sleep(0.01)
+        with open(self.file_name, 'a') as f:
+            f.write('(20.000000) can0 7FF#01\n')
+        self.assertEqual(len(self.cdf.index()), 1001)
+        # so is a different spacing
+        self.assertNotEqual(len(self.cdf.index(every_frames=10).timestamps),
+                            len(index.timestamps))
+
+    def test_foreign_file(self):
+        """ Test a file in the way of the cache is not overwritten """
+        index_name = self.file_name + '.idx'
+        with open(index_name, 'wb') as f:
+            f.write(b'not an index')
+        with self.assertRaises(ValueError):
+            self.cdf.index()
+        with open(index_name, 'rb') as f:
+            self.assertEqual(f.read(), b'not an index')
+
+    def test_extract(self):
+        batch = self.cdf.extract(2.0, 2.5)
+        self.assertEqual(list(batch), self.frames[200:251])
+        self.assertEqual(len(self.cdf.extract(9.0)), 100)
+        self.assertEqual(len(self.cdf.extract(end_time=-1.0)), 0)
+
+    def test_logplayer(self):
+        with LogPlayer(self.file_name, realtime=False, index=True,
+                       start_time=4.0, end_time=4.5, loop=True) as lp:
+            self.assertEqual(lp.recv().timestamp, 4.0)
+            lp.seek(4.25)
+            self.assertEqual(lp.recv().timestamp, 4.25)
+            self.assertEqual(len(lp.extract(1.0, 1.5)), 51)
+        self.assertTrue(os.path.exists(self.file_name + '.idx'))
+
+    def test_compressed(self):
+        with self.assertRaises(ValueError):
+            log.CandumpIndex(self.file_name + '.gz')
+
+if __name__ == '__main__':
+    unittest.main()
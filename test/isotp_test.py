@@ -1,10 +1,13 @@
+import asyncio
 import unittest
 import threading
 from multiprocessing import Queue
 
 from pyvit.hw.loopback import LoopbackDev
-from pyvit.dispatch import Dispatcher
+from pyvit.dispatch import Dispatcher, ThreadDispatcher, AsyncDispatcher
 from pyvit.proto.isotp import IsotpInterface
+from pyvit.utils.ringbuffer import RingBuffer
+from pyvit import can
 
 
 class IsotpTest(unittest.TestCase):
@@ -75,5 +78,155 @@ class IsotpTest(unittest.TestCase):
         self.assertEqual(resp.data,
                          [0x04, 0xDE, 0xAD, 0xBE, 0xEF, 0x55, 0x55, 0x55])
 
+class IsotpThreadTest(IsotpTest):
+    def setUp(self):
+        self.dev = LoopbackDev()
+        self.disp = ThreadDispatcher(self.dev)
+        self.recv_queue = self.disp.create_queue()
+        self.disp.add_receiver(self.recv_queue)
+        self.sender = IsotpInterface(self.disp, 0, 1)
+        self.receiver = IsotpInterface(self.disp, 1, 0)
+        self.disp.start()
+
+
+class IsotpAsyncTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.disp = AsyncDispatcher(LoopbackDev())
+        self.sender = IsotpInterface(self.disp, 0, 1)
+        self.receiver = IsotpInterface(self.disp, 1, 0)
+        self.disp.start()
+
+    async def asyncTearDown(self):
+        self.disp.stop()
+
+    async def test_single_frame(self):
+        payload = [0xDE, 0xAD, 0xBE, 0xEF]
+        await self.sender.send_async(payload)
+        self.assertEqual(await self.receiver.recv_async(), payload)
+
+    async def test_multi_frame(self):
+        payload = [0xDE, 0xAD, 0xBE, 0xEF, 0xDE, 0xAD, 0xBE, 0xEF]*50
+        _, resp = await asyncio.gather(self.sender.send_async(payload),
+                                       self.receiver.recv_async(bs=10))
+        self.assertEqual(payload, resp)
+
+
+class _RecordingDispatcher:
+    """ Records the frames sent through it """
+    def __init__(self):
+        self._device = None
+        self.sent = []
+        self.batches = []
+
+    def create_queue(self):
+        return RingBuffer()
+
+    def add_receiver(self, rx_queue, **kwargs):
+        pass
+
+    def send(self, frame):
+        self.sent.append(frame)
+
+    def send_batch(self, frames):
+        self.batches.append(len(frames))
+        self.sent.extend(frames)
+
+
+class _FilterDevice:
+    """ Counts the filters added to it, like SocketCanDev """
+    def __init__(self):
+        self.filters = {}
+
+    def add_filter(self, arb_id, mask):
+        key = (arb_id, mask)
+        self.filters[key] = self.filters.get(key, 0) + 1
+
+    def remove_filter(self, arb_id, mask):
+        key = (arb_id, mask)
+        self.filters[key] -= 1
+        if not self.filters[key]:
+            del self.filters[key]
+
+
+class IsotpFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.disp = _RecordingDispatcher()
+        self.disp._device = _FilterDevice()
+
+    def test_sessions_share_device(self):
+        """ Test a session removes only its own filter from the device """
+        a = IsotpInterface(self.disp, 0x7E0, 0x7E8)
+        b = IsotpInterface(self.disp, 0x7E1, 0x7E9)
+        a._set_filter()
+        b._set_filter()
+        # setting the same filter again does not count it twice
+        a._set_filter()
+        self.assertEqual(self.disp._device.filters,
+                         {(0x7E8, 0xFFF): 1, (0x7E9, 0xFFF): 1})
+        a._unset_filter()
+        self.assertEqual(self.disp._device.filters, {(0x7E9, 0xFFF): 1})
+        a._unset_filter()
+        b._unset_filter()
+        self.assertEqual(self.disp._device.filters, {})
+
+
+class IsotpFdTest(unittest.TestCase):
+    def setUp(self):
+        self.disp = _RecordingDispatcher()
+        self.sender = IsotpInterface(self.disp, 0, 1, tx_dl=64)
+        self.receiver = IsotpInterface(self.disp, 1, 0)
+        self.receiver.block_size = 0
+        self.receiver.st_min = 0
+
+    def _transfer(self, payload):
+        # queue the flow control frame the sender will wait for
+        self.sender._recv_queue.put(can.Frame(1, [0x30, 0, 0, 0, 0, 0, 0, 0]))
+        self.sender.send(payload)
+        sent = [f for f in self.disp.sent if f.arb_id == 0]
+        for frame in sent:
+            self.assertTrue(frame.is_fd)
+            self.assertIn(frame.dlc, can.FD_LENGTHS)
+            resp = self.receiver.parse_frame(frame)
+        return sent, resp
+
+    def test_single_frame(self):
+        """ Test a CAN FD single frame with the escape sequence """
+        payload = list(range(40))
+        sent, resp = self._transfer(payload)
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0].data[:2], [0, 40])
+        self.assertEqual(sent[0].dlc, 48)
+        self.assertEqual(resp, payload)
+
+    def test_short_single_frame(self):
+        """ Test short messages keep the classic single frame layout """
+        sent, resp = self._transfer([1, 2, 3])
+        self.assertEqual(sent[0].data, [3, 1, 2, 3, 0x55, 0x55, 0x55, 0x55])
+        self.assertEqual(resp, [1, 2, 3])
+
+    def test_multi_frame(self):
+        """ Test a multi-frame CAN FD message uses 64 byte frames """
+        payload = [i & 0xFF for i in range(1000)]
+        sent, resp = self._transfer(payload)
+        # 62 bytes in the FF, 63 in each CF
+        self.assertEqual(len(sent), 1 + 15)
+        self.assertEqual(resp, payload)
+
+    def test_burst(self):
+        """ Test consecutive frames without a separation time are sent
+        together """
+        payload = [i & 0xFF for i in range(5000)]
+        sent, resp = self._transfer(payload)
+        self.assertEqual(resp, payload)
+        # 79 consecutive frames, at most max_burst per batch
+        self.assertEqual(self.disp.batches, [64, 15])
+
+    def test_escape_length(self):
+        """ Test messages above 4095 bytes use the 32 bit FF length """
+        payload = [i & 0xFF for i in range(5000)]
+        sent, resp = self._transfer(payload)
+        self.assertEqual(sent[0].data[:6], [0x10, 0, 0, 0, 0x13, 0x88])
+        self.assertEqual(resp, payload)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,6 @@
 import os
 import pyvit.can as can
+from pyvit.batch import FrameBatch
 from pyvit.file.db.jsondb import JsonDbParser
 
 import unittest
@@ -22,5 +23,30 @@ class FileDbJsonDbTest(unittest.TestCase):
         signals = bus_db.parse_frame(frame_1)
         # TODO: check signal values
 
+    def test_decode_batch(self):
+        """ Test decoding a batch of frames into signal columns """
+        uut = JsonDbParser()
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'vector_jsondb.json')
+        bus_db = uut.parse(file_path)
+
+        batch = FrameBatch.from_frames([
+            can.Frame(0x123, [88, 2, 0b00010100, 50, 10], timestamp=1.0),
+            can.Frame(0x456, [1, 2, 3], timestamp=1.5),
+            can.Frame(0x123, [0, 0, 0b00000011, 0, 200], timestamp=2.0)])
+
+        columns = bus_db.decode_batch(batch, 0x123)
+        self.assertEqual(list(columns['timestamp']), [1.0, 2.0])
+        self.assertEqual(list(columns['Engine RPM']), [600, 0])
+        self.assertEqual(list(columns['Gear']), [4, 3])
+        self.assertEqual(list(columns['Battery Voltage']), [2, 0])
+        self.assertEqual(list(columns['Fractional Factor']), [5.0, 0])
+        self.assertEqual(list(columns['Negative offset']), [-90, 100])
+
+        # the compiled decoder agrees with parse_frame
+        signals = bus_db.parse_frame(batch[0])
+        self.assertEqual(bus_db.parse_batch(batch)[0],
+                         dict((s.name, s.value) for s in signals))
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,7 @@ import unittest
 
 from pyvit.log import Logger
 from pyvit import can
+from pyvit.batch import FrameBatch
 from pyvit.hw.logplayer import LogPlayer
 
 
@@ -32,8 +33,91 @@ class CanTest(unittest.TestCase):
 
             self.assertEqual(count, 10)
 
+    def test_logplayer_batch(self):
+        with LogPlayer('tmp.log') as lp:
+            batch = lp.recv_batch(max_frames=4)
+            self.assertEqual(list(batch), [self.f] * 4)
+            self.assertEqual(len(lp.recv_batch()), 6)
+
     def tearDown(self):
         os.remove(self.log_filename)
 
+
+class LoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.log_filename = 'logger_tmp.log'
+        self.frames = [
+            can.Frame(0x7FF, data=[1, 2], timestamp=1.0, interface='can1'),
+            can.Frame(0x1ABCDEF, data=[], extended=True, timestamp=2.0,
+                      interface='can0'),
+            can.Frame(0x123, data=list(range(12)), fd=True,
+                      timestamp=3.0, interface='can0'),
+        ]
+
+    def tearDown(self):
+        for name in os.listdir('.'):
+            if name.startswith('logger_tmp.'):
+                os.remove(name)
+
+    def read_log(self, filename):
+        with LogPlayer(filename, realtime=False) as lp:
+            return lp.recv_all()
+
+    def test_frame_formats(self):
+        with Logger(self.log_filename) as log:
+            for frame in self.frames:
+                log.log_frame(frame)
+        self.assertEqual(self.read_log(self.log_filename), self.frames)
+
+    def test_batch(self):
+        batch = FrameBatch.from_frames(self.frames * 100)
+        with Logger(self.log_filename) as log:
+            log.log_batch(batch)
+            log.log_batch(self.frames)
+        self.assertEqual(self.read_log(self.log_filename),
+                         self.frames * 101)
+
+    def test_flush(self):
+        with Logger(self.log_filename) as log:
+            log.log_frame(self.frames[0])
+            log.flush()
+            self.assertEqual(self.read_log(self.log_filename),
+                             self.frames[:1])
+
+    def test_not_started(self):
+        log = Logger(self.log_filename)
+        for call in (lambda: log.log_frame(self.frames[0]), log.flush,
+                     log.clear):
+            with self.assertRaisesRegex(Exception, 'logger not started'):
+                call()
+
+    def test_rotation(self):
+        log = Logger(self.log_filename, max_bytes=1000)
+        log.BUFFER_SIZE = 100
+        with log:
+            for _ in range(100):
+                log.log_batch(self.frames)
+
+        self.assertGreater(len(log.rotated), 1)
+        self.assertEqual(log.rotated[0], 'logger_tmp.1.log')
+        frames = []
+        for name in log.rotated + [self.log_filename]:
+            self.assertLessEqual(os.path.getsize(name), 1000)
+            frames += self.read_log(name)
+        self.assertEqual(frames, self.frames * 100)
+
+    def test_compressed(self):
+        log = Logger(self.log_filename + '.gz', max_bytes=1000, threads=2)
+        log.BUFFER_SIZE = 100
+        with log:
+            for _ in range(100):
+                log.log_batch(self.frames)
+
+        self.assertEqual(log.rotated[0], 'logger_tmp.1.log.gz')
+        frames = []
+        for name in log.rotated + [self.log_filename + '.gz']:
+            frames += self.read_log(name)
+        self.assertEqual(frames, self.frames * 100)
+
 if __name__ == '__main__':
     unittest.main()
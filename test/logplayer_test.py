@@ -0,0 +1,89 @@
+import gzip
+import os
+import shutil
+import time
+import unittest
+
+from pyvit.hw.logplayer import LogPlayer
+
+
+class LogPlayerTest(unittest.TestCase):
+    def setUp(self):
+        # frame i is logged at i / 100 seconds, with id i & 0x7FF
+        self.log_filename = 'tmp_player.log'
+        with open(self.log_filename, 'w') as f:
+            for i in range(1000):
+                f.write('(%f) can0 %03X#%02X\n' % (i / 100, i & 0x7FF,
+                                                   i & 0xFF))
+                if i == 10:
+                    # blank lines are skipped, however many there are
+                    f.write('\n' * 5000)
+
+    def tearDown(self):
+        os.remove(self.log_filename)
+
+    def _play(self, count, **kwargs):
+        with LogPlayer(self.log_filename, **kwargs) as lp:
+            start = time.monotonic()
+            frames = [lp.recv() for _ in range(count)]
+            return frames, time.monotonic() - start
+
+    def test_speed(self):
+        frames, elapsed = self._play(21)
+        self.assertEqual(frames[-1].timestamp, 0.2)
+        self.assertGreaterEqual(elapsed, 0.19)
+        self.assertLess(elapsed, 0.3)
+
+        frames, elapsed = self._play(101, speed=10)
+        self.assertEqual([f.arb_id for f in frames], list(range(101)))
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 0.2)
+
+    def test_seek(self):
+        with LogPlayer(self.log_filename, realtime=False) as lp:
+            # force the binary search on this small log
+            lp.SEEK_SCAN = 64
+            for timestamp in (5.005, 0.0, 0.105, 9.99, 3.0):
+                lp.seek(timestamp)
+                self.assertAlmostEqual(lp.recv().timestamp,
+                                       round(timestamp + 0.0049, 2))
+            lp.seek(20)
+            self.assertIsNone(lp.recv())
+
+    def test_window_and_loop(self):
+        with LogPlayer(self.log_filename, realtime=False, loop=True,
+                       start_time=1.0, end_time=1.04) as lp:
+            batch = lp.recv_batch(max_frames=12)
+        self.assertEqual(list(batch.arb_ids), [100, 101, 102, 103, 104] * 2 +
+                         [100, 101])
+        # each pass carries on from the end of the one before
+        self.assertEqual([round(t, 2) for t in batch.timestamps],
+                         [1.0, 1.01, 1.02, 1.03, 1.04, 1.05, 1.06, 1.07,
+                          1.08, 1.09, 1.1, 1.11])
+
+        # a single frame is repeated LOOP_GAP seconds apart
+        with LogPlayer(self.log_filename, realtime=False, loop=True,
+                       start_time=1.0, end_time=1.0) as lp:
+            batch = lp.recv_batch(max_frames=3)
+        self.assertEqual(list(batch.timestamps), [1.0, 2.0, 3.0])
+
+    def test_extract(self):
+        with LogPlayer(self.log_filename) as lp:
+            batch = lp.extract(2.0, 2.5)
+            self.assertEqual(lp.recv().arb_id, 0)
+        self.assertEqual(list(batch.arb_ids), list(range(200, 251)))
+
+    def test_compressed(self):
+        with open(self.log_filename, 'rb') as f, \
+                gzip.open(self.log_filename + '.gz', 'wb') as gz:
+            shutil.copyfileobj(f, gz)
+        try:
+            with LogPlayer(self.log_filename + '.gz', realtime=False,
+                           start_time=5.0) as lp:
+                self.assertEqual(lp.recv().arb_id, 500)
+                lp.seek(2.0)
+                self.assertEqual(lp.recv().arb_id, 200)
+                self.assertEqual(len(lp.recv_batch()), 799)
+                self.assertEqual(len(lp.extract(2.0, 2.5)), 51)
+        finally:
+            os.remove(self.log_filename + '.gz')
@@ -1,6 +1,10 @@
+import fcntl
+import select
+import time
 import unittest
 
-from pyvit.hw.loopback import LoopbackDev
+from pyvit.hw.loopback import LoopbackDev, VirtualBus, frame_bits
+from pyvit.dispatch import ThreadDispatcher
 from pyvit import can
 
 
@@ -32,6 +36,122 @@ class LoopbackTest(unittest.TestCase):
         self.assertEqual(f2, self.dev.recv())
         self.assertEqual(f3, self.dev.recv())
 
+    def test_readiness(self):
+        """ Test fileno and poll are ready while frames are waiting """
+        self.assertFalse(self.dev.poll(0))
+        self.dev.send(can.Frame(0x1))
+        self.dev.send(can.Frame(0x2))
+        self.assertTrue(self.dev.poll(1))
+        self.assertTrue(select.select([self.dev], [], [], 1)[0])
+        self.dev.recv()
+        self.assertTrue(self.dev.poll(0))
+        self.dev.recv()
+        self.assertFalse(self.dev.poll(0))
+
+    @unittest.skipUnless(hasattr(fcntl, 'F_SETPIPE_SZ'),
+                         'needs pipes of a settable size')
+    def test_full_wake_pipe(self):
+        """ Test poll stays ready for frames sent while the pipe was full """
+        size = fcntl.fcntl(self.dev._wake_w, fcntl.F_SETPIPE_SZ, 4096)
+        count = size + 100
+        for i in range(count):
+            self.dev.send(can.Frame(i & 0x7FF))
+        for i in range(count):
+            self.assertTrue(self.dev.poll(1))
+            self.assertEqual(self.dev.recv().arb_id, i & 0x7FF)
+        self.assertFalse(self.dev.poll(0))
+
+
+class VirtualBusTest(unittest.TestCase):
+    def test_fast(self):
+        bus = VirtualBus()
+        a, b, c = bus.attach(), bus.attach(), bus.attach(receive_own=True)
+        stopped = bus.attach()
+        for dev in (a, b, c):
+            dev.start()
+
+        f = can.Frame(0x123, data=[1, 2])
+        a.send(f)
+        c.send_batch([can.Frame(1), can.Frame(2)])
+
+        # every receiver gets a copy of its own
+        received = [b.recv(), c.recv()]
+        self.assertEqual(received, [f, f])
+        self.assertIsNot(received[0], f)
+        self.assertIsNot(received[0], received[1])
+        self.assertEqual([b.recv().arb_id, b.recv().arb_id], [1, 2])
+        self.assertEqual([c.recv().arb_id, c.recv().arb_id], [1, 2])
+        self.assertEqual(a.recv().arb_id, 1)
+        self.assertEqual(a.recv().arb_id, 2)
+        # a node does not hear itself, a stopped node hears nothing
+        self.assertFalse(a.poll(0.01))
+        self.assertFalse(stopped.poll(0))
+
+    def test_frame_bits(self):
+        self.assertEqual(frame_bits(can.Frame(0x123, data=[0] * 8)), 111)
+        self.assertEqual(frame_bits(can.Frame(0x123, extended=True)), 67)
+        fd = can.Frame(0x123, data=[0] * 64, fd=True, bitrate_switch=True)
+        self.assertEqual(frame_bits(fd), 29)
+        self.assertEqual(frame_bits(fd, True), 543)
+
+    def test_arbitration(self):
+        # 10 kbit/s, so frames queued together wait for the first one
+        bus = VirtualBus(bitrate=10000)
+        a, b, listener = bus.attach(), bus.attach(), bus.attach()
+        for dev in (a, b, listener):
+            dev.start()
+
+        # the first frame keeps the bus busy until the others are queued,
+        # so they follow each other without the bus going idle
+        a.send(can.Frame(0x700, data=[0] * 8))
+        a.send_batch([can.Frame(0x300), can.Frame(0x050)])
+        b.send_batch([can.Frame(0x100), can.Frame(0x200)])
+        b.send(can.Frame(0x300 << 18, extended=True))
+        received = [listener.recv() for _ in range(6)]
+        bus.close()
+
+        # the lowest id at the head of a node queue wins, a standard id
+        # beats an extended one with the same base id
+        self.assertEqual([(f.arb_id, f.is_extended_id) for f in received],
+                         [(0x700, False), (0x100, False), (0x200, False),
+                          (0x300, False), (0x050, False),
+                          (0x300 << 18, True)])
+        for prev, frame in zip(received, received[1:]):
+            self.assertAlmostEqual(frame.timestamp - prev.timestamp,
+                                   bus.duration(frame))
+
+    def test_idle_bus(self):
+        """ Test a frame sent to an idle bus starts when it is sent """
+        bus = VirtualBus(bitrate=100000)
+        node, listener = bus.attach(), bus.attach()
+        node.start()
+        listener.start()
+
+        node.send(can.Frame(0x100))
+        first = listener.recv()
+        time.sleep(0.05)
+        node.send(can.Frame(0x200))
+        second = listener.recv()
+        bus.close()
+
+        self.assertGreaterEqual(second.timestamp - first.timestamp,
+                                0.05 + bus.duration(second))
+
+    def test_dispatcher(self):
+        bus = VirtualBus()
+        disp = ThreadDispatcher(bus.attach())
+        rx = disp.create_queue()
+        disp.add_receiver(rx)
+        node = bus.attach()
+        node.start()
+        disp.start()
+
+        node.send(can.Frame(0x7E8))
+        disp.send(can.Frame(0x7E0))
+        self.assertEqual(rx.get(timeout=1).arb_id, 0x7E8)
+        self.assertEqual(node.recv().arb_id, 0x7E0)
+        disp.close()
+
 
 if __name__ == '__main__':
     unittest.main()
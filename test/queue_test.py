@@ -0,0 +1,30 @@
+import unittest
+
+from pyvit.utils.queue import CanQueue
+from pyvit.hw.loopback import LoopbackDev
+from pyvit import can
+
+
+class CanQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = CanQueue(LoopbackDev())
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_send_recv(self):
+        self.queue.start()
+        self.queue.send(can.Frame(1))
+        self.queue.send(can.Frame(2))
+        self.assertEqual(self.queue.recv(timeout=5, arb_id=2).arb_id, 2)
+        self.assertIsNone(self.queue.recv(timeout=0.05))
+        self.queue.stop()
+
+    def test_restart(self):
+        self.queue.start()
+        self.queue.stop()
+        self.assertFalse(self.queue.running)
+        self.queue.start()
+        self.queue.send(can.Frame(0))
+        self.assertEqual(self.queue.recv(timeout=5, arb_id=0).arb_id, 0)
+        self.queue.stop()
@@ -0,0 +1,39 @@
+import unittest
+import threading
+from queue import Empty
+
+from pyvit.utils.ringbuffer import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_order(self):
+        rb = RingBuffer()
+        for i in range(10):
+            rb.put_nowait(i)
+        self.assertEqual(rb.qsize(), 10)
+        self.assertEqual([rb.get() for _ in range(10)], list(range(10)))
+        self.assertTrue(rb.empty())
+
+    def test_empty(self):
+        rb = RingBuffer()
+        with self.assertRaises(Empty):
+            rb.get_nowait()
+        with self.assertRaises(Empty):
+            rb.get(timeout=0.01)
+
+    def test_maxlen_drops_oldest(self):
+        rb = RingBuffer(maxlen=3)
+        for i in range(5):
+            rb.put_nowait(i)
+        self.assertEqual([rb.get() for _ in range(3)], [2, 3, 4])
+
+    def test_blocking_get(self):
+        rb = RingBuffer()
+        t = threading.Timer(0.05, rb.put_nowait, args=('frame', ))
+        t.start()
+        self.assertEqual(rb.get(timeout=5), 'frame')
+        t.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import multiprocessing
+import unittest
+
+from pyvit.utils.shmring import RingWriter, RingReader
+from pyvit.dispatch import Dispatcher
+from pyvit.hw.loopback import LoopbackDev
+from pyvit import can
+
+
+def _read_ids(name, count, result):
+    with RingReader(name, oldest=True) as reader:
+        result.put([reader.recv(timeout=5).arb_id for _ in range(count)])
+
+
+class ShmRingTest(unittest.TestCase):
+    def setUp(self):
+        self.writer = RingWriter(capacity=16)
+
+    def tearDown(self):
+        self.writer.close()
+
+    def test_round_trip(self):
+        reader = RingReader(self.writer.name)
+        frames = [can.Frame(0x123, data=[1, 2, 3], timestamp=1.5),
+                  can.Frame(0x1ABCDEF0, data=[0xFF] * 64, extended=True,
+                            fd=True, bitrate_switch=True),
+                  can.Frame(0x7FF)]
+        for frame in frames:
+            self.writer.put(frame)
+
+        self.assertEqual(reader.pending(), 3)
+        received = [reader.recv(timeout=1) for _ in frames]
+        self.assertEqual(received, frames)
+        self.assertEqual(received[0].timestamp, 1.5)
+        self.assertIsNone(received[1].timestamp)
+        self.assertIsNone(reader.recv(timeout=0.01))
+        reader.close()
+
+    def test_independent_readers(self):
+        first = RingReader(self.writer.name)
+        self.writer.put_batch([can.Frame(i) for i in range(4)])
+        second = RingReader(self.writer.name)
+        self.writer.put(can.Frame(4))
+
+        self.assertEqual([f.arb_id for f in first.recv_batch(timeout=1)],
+                         [0, 1, 2, 3, 4])
+        self.assertEqual([f.arb_id for f in second.recv_batch(timeout=1)],
+                         [4])
+        first.close()
+        second.close()
+
+    def test_lapped_reader(self):
+        reader = RingReader(self.writer.name)
+        self.writer.put_batch([can.Frame(i) for i in range(40)])
+
+        batch = reader.recv_batch(max_frames=100, timeout=1)
+        # only the frames still in the ring are read, the rest are lost
+        self.assertEqual(list(batch.arb_ids), list(range(25, 40)))
+        self.assertEqual(reader.lost, 25)
+
+    def test_other_process(self):
+        result = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=_read_ids, args=(self.writer.name, 10, result))
+        self.writer.put_batch([can.Frame(i) for i in range(5)])
+        process.start()
+        self.writer.put_batch([can.Frame(i) for i in range(5, 10)])
+        self.assertEqual(result.get(timeout=5), list(range(10)))
+        process.join()
+
+    def test_dispatcher_receiver(self):
+        reader = RingReader(self.writer.name)
+        disp = Dispatcher(LoopbackDev())
+        disp.add_receiver(self.writer, arb_ids=[1])
+
+        disp.start()
+        disp.send_batch([can.Frame(0), can.Frame(1, data=[0x55])])
+        frame = reader.recv(timeout=5)
+        disp.close()
+
+        self.assertEqual(frame, can.Frame(1, data=[0x55]))
+        self.assertEqual(disp.stats(self.writer).enqueued, 1)
+        reader.close()
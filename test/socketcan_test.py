@@ -0,0 +1,229 @@
+import collections
+import os
+import socket
+import time
+import types
+import unittest
+
+from pyvit import can
+from pyvit.hw import socketcan
+
+
+class SocketCanBatchTest(unittest.TestCase):
+    """ Exercises the batch receive path over a datagram socket pair, which
+    delivers one can_frame per datagram like a CAN_RAW socket """
+
+    timestamping = None
+    fd = False
+
+    def setUp(self):
+        self.tx, rx = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # bypass __init__, which needs a SocketCAN capable kernel
+        self.dev = socketcan.SocketCanDev.__new__(socketcan.SocketCanDev)
+        self.dev.socket = rx
+        self.dev.timestamping = self.timestamping
+        self.dev.fd = self.fd
+        self.dev._mtu = (socketcan._canfd_frame.size if self.fd
+                         else socketcan._can_frame.size)
+        self.dev._recv_buffer = None
+        self.dev._enable_timestamping()
+        self.dev._start_clocks()
+        self.dev.running = True
+
+    def tearDown(self):
+        self.tx.close()
+        self.dev.socket.close()
+
+    def _send(self, frame):
+        self.dev.socket, rx = self.tx, self.dev.socket
+        self.dev.send(frame)
+        self.dev.socket = rx
+
+    def test_recv_batch(self):
+        """ Test several queued frames are received in one batch """
+        frames = [can.Frame(0x123, [1, 2, 3]),
+                  can.Frame(0x1ABCDEF, [0xFF] * 8, extended=True),
+                  can.Frame(0x7FF, frame_type=can.FrameType.RemoteFrame)]
+        for frame in frames:
+            self._send(frame)
+
+        batch = self.dev.recv_batch(max_frames=2, timeout=1)
+        self.assertEqual(list(batch), frames[:2])
+        batch = self.dev.recv_batch(max_frames=16, timeout=1)
+        self.assertEqual(list(batch), frames[2:])
+
+    def test_recv_batch_fallback(self):
+        """ Test batch receive without recvmmsg """
+        recvmmsg, socketcan._recvmmsg = socketcan._recvmmsg, None
+        try:
+            self.test_recv_batch()
+        finally:
+            socketcan._recvmmsg = recvmmsg
+
+    def test_recv_batch_timeout(self):
+        """ Test an empty batch is returned when nothing arrives """
+        self.assertEqual(len(self.dev.recv_batch(timeout=0.01)), 0)
+
+    def test_recv(self):
+        """ Test single frame receive """
+        frame = can.Frame(0x10, [0xDE, 0xAD])
+        self._send(frame)
+        self.assertEqual(self.dev.recv(), frame)
+
+    def test_send_batch(self):
+        """ Test several frames are sent in order by one call """
+        frames = [can.Frame(i, [i] * (i % 9)) for i in range(20)]
+        self.dev.socket, rx = self.tx, self.dev.socket
+        self.dev.send_batch(frames)
+        self.dev.socket = rx
+        self.assertEqual(list(self.dev.recv_batch(timeout=1)), frames)
+
+    def test_send_batch_fallback(self):
+        """ Test batch send without sendmmsg """
+        sendmmsg, socketcan._sendmmsg = socketcan._sendmmsg, None
+        try:
+            self.test_send_batch()
+        finally:
+            socketcan._sendmmsg = sendmmsg
+
+class SocketCanFdTest(SocketCanBatchTest):
+    """ Runs the receive tests again on a CAN FD socket, which receives both
+    can_frame and canfd_frame structs """
+
+    fd = True
+
+    def test_fd_frames(self):
+        """ Test CAN FD frames mixed with classic frames """
+        frames = [can.Frame(0x123, list(range(64)), fd=True,
+                            bitrate_switch=True),
+                  can.Frame(0x124, [1, 2]),
+                  can.Frame(0x125, [3] * 12, fd=True,
+                            error_state_indicator=True)]
+        for frame in frames:
+            self._send(frame)
+        self.assertEqual(self.dev.recv(), frames[0])
+        self.assertEqual(list(self.dev.recv_batch(timeout=1)), frames[1:])
+
+
+class SocketCanKernelTimestampTest(SocketCanBatchTest):
+    """ Runs the receive tests again with kernel timestamps, which AF_UNIX
+    sockets support through the same SO_TIMESTAMPNS option """
+
+    timestamping = 'kernel'
+
+    def test_timestamps(self):
+        """ Test frames carry the kernel receive time, not the read time """
+        for i in range(3):
+            self._send(can.Frame(i))
+            time.sleep(0.02)
+        # read late, so the read time differs from the arrival time
+        time.sleep(0.05)
+        frames = list(self.dev.recv_batch(timeout=1))
+        self.assertEqual(len(frames), 3)
+        for a, b in zip(frames, frames[1:]):
+            self.assertAlmostEqual(b.timestamp - a.timestamp, 0.02,
+                                   delta=0.01)
+        self.assertLess(frames[-1].timestamp,
+                        self.dev._software_timestamp() - 0.04)
+
+    def test_clock_step(self):
+        """ Test kernel timestamps stay on the monotonic clock when the
+        realtime clock steps """
+        stepped = types.SimpleNamespace(
+            time=lambda: time.time() + 3600, monotonic=time.monotonic)
+        # the offset is sampled again on the next frame
+        self.dev._next_sync = 0
+        socketcan.time = stepped
+        try:
+            now = stepped.time()
+            ancdata = [(socket.SOL_SOCKET, socketcan.SO_TIMESTAMPNS,
+                        socketcan._timespec.pack(int(now),
+                                                 int(now % 1 * 1e9)))]
+            self.assertAlmostEqual(self.dev._kernel_timestamp(ancdata),
+                                   self.dev._software_timestamp(),
+                                   delta=0.01)
+        finally:
+            socketcan.time = time
+
+    def test_timestamps_fallback(self):
+        """ Test kernel timestamps without recvmmsg """
+        recvmmsg, socketcan._recvmmsg = socketcan._recvmmsg, None
+        try:
+            self.test_timestamps()
+        finally:
+            socketcan._recvmmsg = recvmmsg
+
+
+@unittest.skipUnless(os.path.exists('/sys/class/net/vcan0'),
+                     'needs a vcan0 interface')
+class SocketCanVcanTest(unittest.TestCase):
+    def test_kernel_timestamps(self):
+        """ Test kernel timestamps on a virtual CAN interface """
+        tx = socketcan.SocketCanDev('vcan0')
+        rx = socketcan.SocketCanDev('vcan0', timestamping='kernel')
+        tx.start()
+        rx.start()
+        for i in range(10):
+            tx.send(can.Frame(i, [i]))
+            time.sleep(0.01)
+        frames = [rx.recv() for _ in range(10)]
+        self.assertEqual([f.arb_id for f in frames], list(range(10)))
+        for a, b in zip(frames, frames[1:]):
+            self.assertAlmostEqual(b.timestamp - a.timestamp, 0.01,
+                                   delta=0.005)
+
+
+class _OptionSocket:
+    """ Records the socket options set on it """
+    def __init__(self):
+        self.options = {}
+
+    def setsockopt(self, level, option, value):
+        self.options[(level, option)] = value
+
+
+class SocketCanFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.dev = socketcan.SocketCanDev.__new__(socketcan.SocketCanDev)
+        self.dev.socket = _OptionSocket()
+        self.dev._filter_id = 0
+        self.dev._filter_mask = 0
+        self.dev._shared_filters = collections.Counter()
+
+    def _filters(self):
+        packed = self.dev.socket.options[(socket.SOL_CAN_RAW,
+                                          socket.CAN_RAW_FILTER)]
+        return list(socketcan._can_filter.iter_unpack(packed))
+
+    def test_set_filters(self):
+        """ Test filters are packed as an array of can_filter structs """
+        self.dev.set_filters([(0x7E8, 0x7FF), (0x100, 0x700)])
+        self.assertEqual(self._filters(), [(0x7E8, 0x7FF), (0x100, 0x700)])
+        self.dev.set_filters(None)
+        self.assertEqual(self._filters(), [(0, 0)])
+
+    def test_filter_id_mask(self):
+        """ Test the single filter interface used by IsotpInterface """
+        self.dev.set_filter_id(0x7E8)
+        self.dev.set_filter_mask(0xFFF)
+        self.assertEqual(self._filters(), [(0x7E8, 0xFFF)])
+        self.dev.set_filter_mask(0)
+        self.assertEqual(self._filters(), [(0x7E8, 0)])
+
+    def test_shared_filters(self):
+        """ Test added filters are counted and pushed as their union """
+        self.dev.add_filter(0x7E8, 0xFFF)
+        self.dev.add_filter(0x7E9, 0xFFF)
+        self.dev.add_filter(0x7E8, 0xFFF)
+        self.assertEqual(self._filters(), [(0x7E8, 0xFFF), (0x7E9, 0xFFF)])
+        self.dev.remove_filter(0x7E8, 0xFFF)
+        self.assertEqual(self._filters(), [(0x7E8, 0xFFF), (0x7E9, 0xFFF)])
+        self.dev.remove_filter(0x7E8, 0xFFF)
+        self.assertEqual(self._filters(), [(0x7E9, 0xFFF)])
+        self.dev.remove_filter(0x7E9, 0xFFF)
+        self.assertEqual(self._filters(), [(0, 0)])
+        with self.assertRaises(ValueError):
+            self.dev.remove_filter(0x7E9, 0xFFF)
+
+if __name__ == '__main__':
+    unittest.main()
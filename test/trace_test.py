@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+import pyvit.can as can
+from pyvit.file import log
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        temp_file.close()
+        self.file_name = temp_file.name
+        # frame i is at i / 1000 seconds, a chunk holds about 100 frames
+        self.frames = [can.Frame(0x100 + i % 10, data=[i & 0xFF] * (i % 9),
+                                 timestamp=i / 1000, interface='can0')
+                       for i in range(1000)]
+        with log.TraceWriter(self.file_name, chunk_size=1000) as writer:
+            writer.write_batch(self.frames)
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_read_all(self):
+        with log.TraceReader(self.file_name) as reader:
+            self.assertEqual(len(reader), 1000)
+            frames = list(reader)
+        self.assertEqual(frames, self.frames)
+        self.assertEqual([f.timestamp for f in frames],
+                         [f.timestamp for f in self.frames])
+        self.assertEqual(frames[0].interface, 'can0')
+
+    def test_time_range(self):
+        with log.TraceReader(self.file_name) as reader:
+            chunks = reader.matching_chunks(0.5, 0.55)
+            batch = reader.read(0.5, 0.55)
+            self.assertLess(len(chunks), 3)
+            self.assertGreater(len(reader.chunks), 8)
+        self.assertEqual(list(batch), self.frames[500:551])
+
+    def test_ids(self):
+        with log.TraceReader(self.file_name) as reader:
+            batch = reader.read(arb_ids=[0x103])
+            ranged = list(reader.iter_batches(0.1, 0.3, arb_ids=[0x105]))
+            self.assertEqual(reader.matching_chunks(arb_ids=[0x200]), [])
+        self.assertEqual(list(batch), self.frames[3::10])
+        self.assertGreater(len(ranged), 1)
+        self.assertEqual([f for b in ranged for f in b],
+                         self.frames[105:300:10])
+
+    def test_no_timestamp(self):
+        frames = [can.Frame(0x1, extended=True), can.Frame(0x1FFFFFFF,
+                  data=[0] * 64, fd=True, extended=True)]
+        with log.TraceWriter(self.file_name) as writer:
+            writer.write_batch(frames)
+        with log.TraceReader(self.file_name) as reader:
+            self.assertEqual(list(reader), frames)
+            self.assertIsNone(list(reader)[0].timestamp)
+            self.assertEqual(len(reader.read(0, 1)), 0)
+
+    def test_not_closed(self):
+        with open(self.file_name, 'wb') as f:
+            f.write(b'candump')
+        with self.assertRaises(ValueError):
+            log.TraceReader(self.file_name)
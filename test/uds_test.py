@@ -1,5 +1,9 @@
+import asyncio
 import unittest
+from pyvit.dispatch import AsyncDispatcher
+from pyvit.hw.loopback import LoopbackDev
 from pyvit.proto import uds
+from pyvit.proto.isotp import IsotpInterface
 
 
 class CanTest(unittest.TestCase):
@@ -386,5 +390,57 @@ class CanTest(unittest.TestCase):
         print(resp)
 
 
+class _ScriptedTransport:
+    """ Receives the (arb_id, data) messages given, then nothing """
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.last_arb_id = None
+
+    def recv(self, timeout=1):
+        if not self.messages:
+            return None
+        self.last_arb_id, data = self.messages.pop(0)
+        return data
+
+    async def recv_async(self, timeout=1):
+        return self.recv(timeout)
+
+
+# a positive and a negative response to TesterPresent from two ECUs
+FUNCTIONAL_RESPONSES = [(0x7E8, [0x7E, 0x00]), (0x7E9, [0x7F, 0x3E, 0x11])]
+
+
+class FunctionalUDSTest(unittest.TestCase):
+    def test_decode_responses(self):
+        tester = uds.UDSInterface(functional_timeout=0.05)
+        tester.transport_layer = _ScriptedTransport(FUNCTIONAL_RESPONSES)
+        resps = tester.decode_responses(0.01)
+        self.assertEqual(sorted(resps), [0x7E8, 0x7E9])
+        self.assertEqual(resps[0x7E8].SID, uds.TesterPresent.SID)
+
+
+class AsyncUDSTest(unittest.IsolatedAsyncioTestCase):
+    async def test_decode_responses_async(self):
+        tester = uds.UDSInterface(functional_timeout=0.05)
+        tester.transport_layer = _ScriptedTransport(FUNCTIONAL_RESPONSES)
+        resps = await tester.decode_responses_async(0.01)
+        self.assertEqual(sorted(resps), [0x7E8, 0x7E9])
+
+    async def test_request_async(self):
+        disp = AsyncDispatcher(LoopbackDev())
+        tester = uds.UDSInterface(disp, 0x7E0, 0x7E8)
+        ecu = IsotpInterface(disp, 0x7E8, 0x7E0)
+
+        async def respond():
+            req = await ecu.recv_async()
+            await ecu.send_async([req[0] + 0x40, req[1]])
+
+        async with disp:
+            resp, _ = await asyncio.gather(
+                tester.request_async(uds.TesterPresent.Request()),
+                respond())
+        self.assertEqual(resp.SID, uds.TesterPresent.SID)
+
+
 if __name__ == '__main__':
     unittest.main()